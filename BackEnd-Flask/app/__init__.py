@@ -3,10 +3,11 @@ from flask_sqlalchemy import SQLAlchemy
 from flask_cors import CORS
 from flask_jwt_extended import JWTManager
 from app.config import config
+from app.replicas import SesionEnrutada
 import os
 
 # Inicializar extensiones
-db = SQLAlchemy()
+db = SQLAlchemy(session_options={'class_': SesionEnrutada})
 cors = CORS()
 jwt = JWTManager()
 
@@ -22,16 +23,28 @@ def create_app(config_name=None):
     # Cargar configuración
     app.config.from_object(config[config_name])
     
+    # Binds de las réplicas de lectura (antes de que db.init_app cree los motores)
+    from app import replicas
+    replicas.init_app(app)
+    
     # Inicializar extensiones con la app
     db.init_app(app)
     cors.init_app(app, origins=app.config['CORS_ORIGINS'])
     jwt.init_app(app)
     
+    # Serialización JSON rápida (orjson si está disponible)
+    from app import serializacion
+    serializacion.init_app(app)
+    
+    # Métricas por endpoint (antes de los blueprints para medir también sus hooks)
+    from app import metricas
+    metricas.init_app(app)
+    
     # Crear directorio de uploads si no existe
     os.makedirs(app.config['UPLOAD_FOLDER'], exist_ok=True)
     
     # Registrar blueprints/rutas
-    from app.routes import main_bp, auth_bp, tramites_bp, solicitudes_bp, documentos_bp, ml_bp
+    from app.routes import main_bp, auth_bp, tramites_bp, solicitudes_bp, documentos_bp, ml_bp, eventos_bp, tareas_bp
     
     app.register_blueprint(main_bp)
     app.register_blueprint(auth_bp, url_prefix='/api/auth')
@@ -39,12 +52,35 @@ def create_app(config_name=None):
     app.register_blueprint(solicitudes_bp, url_prefix='/api/solicitudes')
     app.register_blueprint(documentos_bp, url_prefix='/api/documentos')
     app.register_blueprint(ml_bp, url_prefix='/api/ml')
+    app.register_blueprint(eventos_bp, url_prefix='/api/eventos')
+    app.register_blueprint(tareas_bp, url_prefix='/api/tareas')
       # Importar modelos para que SQLAlchemy los reconozca
     from app import models
     
     # Inicializar configuración de la aplicación
     config[config_name].init_app(app)
     
+    # Pub/sub de eventos en tiempo real
+    from app import eventos
+    eventos.init_app(app)
+    
+    # Cola de tareas en segundo plano
+    from app import tareas
+    tareas.init_app(app)
+    
+    # Límites y semáforos de operaciones costosas (los usa también la cola de tareas)
+    from app import admision
+    admision.init_app(app)
+    
+    # Escrituras diferidas de ultima_actividad
+    from app import actividad
+    actividad.init_app(app)
+    
+    # Pila de ML: perezosa por defecto, precargada si se pide
+    if app.config['ML_PRECARGAR']:
+        from app.ml_utils import precargar
+        precargar()
+    
     # Crear tablas si no existen (solo en desarrollo)
     with app.app_context():
         if config_name == 'development':
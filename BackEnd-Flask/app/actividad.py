@@ -0,0 +1,85 @@
+"""
+Registro diferido de usuarios.ultima_actividad.
+
+En vez de un UPDATE + commit por cada login, las marcas de actividad se
+acumulan en memoria (una por usuario, la más reciente) y un hilo del proceso
+las escribe juntas cada ACTIVIDAD_INTERVALO_SEGUNDOS con un solo executemany.
+Con ACTIVIDAD_INTERVALO_SEGUNDOS = 0 se escribe en la misma petición.
+"""
+from flask import current_app # type: ignore
+from app import db
+from datetime import datetime
+import atexit
+import threading
+
+
+class RegistroActividad:
+    """Búfer de ultima_actividad por proceso, volcado periódicamente en lote"""
+
+    def __init__(self, app, intervalo):
+        self.app = app
+        self.intervalo = intervalo
+        self._pendientes = {}
+        self._lock = threading.Lock()
+        self._hilo = None
+        self._detener = threading.Event()
+
+    def registrar(self, usuario_id, fecha=None):
+        fecha = fecha or datetime.utcnow()
+        with self._lock:
+            actual = self._pendientes.get(usuario_id)
+            if actual is None or fecha > actual:
+                self._pendientes[usuario_id] = fecha
+            if self._hilo is None:
+                # El hilo se crea al primer uso: con gunicorn --preload no queda en el master
+                self._hilo = threading.Thread(target=self._bucle, name='actividad', daemon=True)
+                self._hilo.start()
+                atexit.register(self.volcar)
+
+    def volcar(self):
+        """Escribir las marcas pendientes con un solo UPDATE ejecutado en lote; devuelve cuántas"""
+        with self._lock:
+            pendientes, self._pendientes = self._pendientes, {}
+        if not pendientes:
+            return 0
+        tabla = db.Model.metadata.tables['usuarios']
+        with self.app.app_context():
+            try:
+                db.session.execute(
+                    tabla.update()
+                    .where(tabla.c.id == db.bindparam('b_id'))
+                    .values(ultima_actividad=db.bindparam('b_fecha')),
+                    [{'b_id': usuario_id, 'b_fecha': fecha} for usuario_id, fecha in pendientes.items()]
+                )
+                db.session.commit()
+            except Exception as e:
+                db.session.rollback()
+                # Se reintentan en el próximo volcado salvo que haya marcas más nuevas
+                with self._lock:
+                    for usuario_id, fecha in pendientes.items():
+                        if usuario_id not in self._pendientes:
+                            self._pendientes[usuario_id] = fecha
+                self.app.logger.warning(f'No se pudo volcar ultima_actividad: {e}')
+                return 0
+            finally:
+                db.session.remove()
+        return len(pendientes)
+
+    def _bucle(self):
+        while not self._detener.wait(self.intervalo):
+            self.volcar()
+
+
+def init_app(app):
+    intervalo = app.config['ACTIVIDAD_INTERVALO_SEGUNDOS']
+    app.extensions['actividad'] = RegistroActividad(app, intervalo) if intervalo > 0 else None
+
+
+def registrar_actividad(usuario):
+    """Marcar la actividad de un usuario (diferida, o inmediata si el intervalo es 0)"""
+    registro = current_app.extensions.get('actividad')
+    if registro is None:
+        usuario.ultima_actividad = datetime.utcnow()
+        db.session.commit()
+    else:
+        registro.registrar(usuario.id)
@@ -0,0 +1,264 @@
+"""
+Control de admisión para operaciones costosas (entrenamiento y procesamiento ML,
+verificación de integridad, subidas de documentos).
+
+- Cubetas de tokens por usuario y globales: @limitar('operacion') responde 429
+  con Retry-After cuando se agotan. Se configuran en ADMISION_LIMITES como
+  (capacidad, tokens por minuto).
+- Semáforo de concurrencia por operación: como máximo N ejecuciones a la vez.
+  Las vistas síncronas (subidas) responden 503 si está lleno; las tareas de la
+  cola declaradas con @tarea(..., operacion=...) se posponen.
+- Single-flight: una_vez(clave, funcion) hace que llamadas concurrentes iguales
+  del proceso compartan un único cálculo. Para la cola, encolar(...,
+  compartir_en_curso=True) devuelve la tarea pendiente o en proceso con la misma
+  clave_unica en vez de crear otra.
+
+Backends:
+- 'memoria': estado por proceso (desarrollo, tests, un solo worker)
+- 'redis':   cubetas y semáforos compartidos entre workers y servidores (requiere redis)
+"""
+from flask import current_app, jsonify # type: ignore
+from flask_jwt_extended import get_jwt_identity # type: ignore
+from collections import defaultdict
+from functools import wraps
+import math
+import threading
+import time
+import uuid
+
+
+class BackendMemoria:
+    """Cubetas y semáforos en memoria del proceso"""
+
+    def __init__(self):
+        self._cubetas = {}
+        self._ocupados = defaultdict(int)
+        self._lock = threading.Lock()
+
+    def consumir(self, cubetas, ahora=None):
+        """
+        Tomar un token de cada cubeta [(clave, capacidad, tokens_por_segundo)] o de ninguna.
+        Devuelve 0 si se admitió o los segundos que faltan para que haya tokens.
+        """
+        ahora = ahora or time.monotonic()
+        with self._lock:
+            niveles = []
+            espera = 0
+            for clave, capacidad, tasa in cubetas:
+                tokens, ultimo = self._cubetas.get(clave, (capacidad, ahora))
+                tokens = min(capacidad, tokens + (ahora - ultimo) * tasa)
+                niveles.append(tokens)
+                if tokens < 1:
+                    espera = max(espera, (1 - tokens) / tasa)
+            if espera:
+                return espera
+            for (clave, _, _), tokens in zip(cubetas, niveles):
+                self._cubetas[clave] = (tokens - 1, ahora)
+            return 0
+
+    def adquirir(self, clave, limite, ttl):
+        """Ocupar una plaza del semáforo; devuelve una ficha para liberar() o None si está lleno"""
+        with self._lock:
+            if self._ocupados[clave] >= limite:
+                return None
+            self._ocupados[clave] += 1
+            return clave
+
+    def liberar(self, clave, ficha):
+        with self._lock:
+            if self._ocupados[clave] > 0:
+                self._ocupados[clave] -= 1
+
+
+class BackendRedis:
+    """Cubetas y semáforos compartidos en Redis (scripts Lua atómicos)"""
+
+    CONSUMIR = """
+        local ahora = tonumber(ARGV[1])
+        local niveles = {}
+        local espera = 0
+        for i, clave in ipairs(KEYS) do
+            local capacidad = tonumber(ARGV[i * 2])
+            local tasa = tonumber(ARGV[i * 2 + 1])
+            local estado = redis.call('HMGET', clave, 'tokens', 'ultimo')
+            local tokens = tonumber(estado[1]) or capacidad
+            local ultimo = tonumber(estado[2]) or ahora
+            tokens = math.min(capacidad, tokens + math.max(0, ahora - ultimo) * tasa)
+            niveles[i] = tokens
+            if tokens < 1 then
+                espera = math.max(espera, (1 - tokens) / tasa)
+            end
+        end
+        if espera > 0 then
+            return tostring(espera)
+        end
+        for i, clave in ipairs(KEYS) do
+            local capacidad = tonumber(ARGV[i * 2])
+            local tasa = tonumber(ARGV[i * 2 + 1])
+            redis.call('HSET', clave, 'tokens', niveles[i] - 1, 'ultimo', ahora)
+            redis.call('EXPIRE', clave, math.ceil(capacidad / tasa) + 1)
+        end
+        return '0'
+    """
+
+    # Semáforo como conjunto ordenado de fichas con vencimiento (si un proceso muere, su plaza caduca)
+    ADQUIRIR = """
+        local ahora = tonumber(ARGV[1])
+        local ttl = tonumber(ARGV[4])
+        redis.call('ZREMRANGEBYSCORE', KEYS[1], '-inf', ahora)
+        if redis.call('ZCARD', KEYS[1]) < tonumber(ARGV[2]) then
+            redis.call('ZADD', KEYS[1], ahora + ttl, ARGV[3])
+            redis.call('EXPIRE', KEYS[1], math.ceil(ttl) + 1)
+            return 1
+        end
+        return 0
+    """
+
+    def __init__(self, url, prefijo='docucontrol:admision:'):
+        import redis # type: ignore
+        self._redis = redis.Redis.from_url(url)
+        self._prefijo = prefijo
+        self._consumir = self._redis.register_script(self.CONSUMIR)
+        self._adquirir = self._redis.register_script(self.ADQUIRIR)
+
+    def consumir(self, cubetas, ahora=None):
+        argumentos = [ahora or time.time()]
+        for _, capacidad, tasa in cubetas:
+            argumentos += [capacidad, tasa]
+        return float(self._consumir(keys=[self._prefijo + 'cubeta:' + c[0] for c in cubetas], args=argumentos))
+
+    def adquirir(self, clave, limite, ttl):
+        ficha = uuid.uuid4().hex
+        ocupada = self._adquirir(keys=[self._prefijo + 'semaforo:' + clave], args=[time.time(), limite, ficha, ttl])
+        return ficha if ocupada else None
+
+    def liberar(self, clave, ficha):
+        self._redis.zrem(self._prefijo + 'semaforo:' + clave, ficha)
+
+
+BACKENDS = {
+    'memoria': lambda app: BackendMemoria(),
+    'redis': lambda app: BackendRedis(app.config['ADMISION_REDIS_URL'])
+}
+
+
+def init_app(app):
+    app.extensions['admision'] = BACKENDS[app.config['ADMISION_BACKEND']](app)
+
+
+def obtener_backend():
+    return current_app.extensions['admision']
+
+
+def _limites(operacion):
+    if not current_app.config['ADMISION_HABILITADA']:
+        return {}
+    return current_app.config['ADMISION_LIMITES'].get(operacion, {})
+
+
+def admitir(operacion, usuario_id=None):
+    """Consumir los tokens de la operación; devuelve 0 o los segundos de espera sugeridos"""
+    limites = _limites(operacion)
+    cubetas = []
+    if usuario_id is not None and 'usuario' in limites:
+        capacidad, por_minuto = limites['usuario']
+        cubetas.append((f'{operacion}:usuario:{usuario_id}', capacidad, por_minuto / 60))
+    if 'global' in limites:
+        capacidad, por_minuto = limites['global']
+        cubetas.append((f'{operacion}:global', capacidad, por_minuto / 60))
+    if not cubetas:
+        return 0
+    return obtener_backend().consumir(cubetas)
+
+
+def adquirir(operacion):
+    """
+    Ocupar una plaza del semáforo de la operación.
+    Devuelve una ficha (True si la operación no tiene límite) o None si está lleno.
+    """
+    limite = _limites(operacion).get('concurrencia')
+    if not limite:
+        return True
+    return obtener_backend().adquirir(operacion, limite, current_app.config['ADMISION_CONCURRENCIA_TTL_SEGUNDOS'])
+
+
+def liberar(operacion, ficha):
+    if ficha is not True:
+        obtener_backend().liberar(operacion, ficha)
+
+
+def _rechazo(codigo, mensaje, espera):
+    espera = max(1, math.ceil(espera))
+    respuesta = jsonify({'error': mensaje, 'reintentar_en': espera})
+    respuesta.status_code = codigo
+    respuesta.headers['Retry-After'] = str(espera)
+    return respuesta
+
+
+def respuesta_ocupado():
+    """503 con Retry-After para una operación cuyo semáforo está lleno"""
+    return _rechazo(503, 'Servidor ocupado con esta operación, reintente en unos segundos',
+                    current_app.config['ADMISION_POSPONER_SEGUNDOS'])
+
+
+def limitar(operacion, concurrencia=False):
+    """
+    Decorador de vistas (después de @jwt_required): aplica las cubetas de la operación y,
+    con concurrencia=True, ocupa una plaza del semáforo mientras se ejecuta la vista.
+    Las vistas que solo encolan dejan el semáforo a la tarea (ver tareas.ejecutar_tarea).
+    """
+    def decorador(vista):
+        @wraps(vista)
+        def envoltura(*args, **kwargs):
+            espera = admitir(operacion, get_jwt_identity())
+            if espera:
+                current_app.logger.info(f'Admisión: {operacion} limitada para usuario {get_jwt_identity()}')
+                return _rechazo(429, 'Demasiadas solicitudes para esta operación, reintente más tarde', espera)
+            if not concurrencia:
+                return vista(*args, **kwargs)
+            ficha = adquirir(operacion)
+            if ficha is None:
+                return respuesta_ocupado()
+            try:
+                return vista(*args, **kwargs)
+            finally:
+                liberar(operacion, ficha)
+        return envoltura
+    return decorador
+
+
+class _Vuelo:
+    __slots__ = ('listo', 'resultado', 'error')
+
+    def __init__(self):
+        self.listo = threading.Event()
+        self.resultado = None
+        self.error = None
+
+
+_vuelos = {}
+_vuelos_lock = threading.Lock()
+
+
+def una_vez(clave, funcion):
+    """Ejecutar funcion() una sola vez para todas las llamadas concurrentes con la misma clave"""
+    with _vuelos_lock:
+        vuelo = _vuelos.get(clave)
+        lider = vuelo is None
+        if lider:
+            vuelo = _vuelos[clave] = _Vuelo()
+    if not lider:
+        vuelo.listo.wait()
+        if vuelo.error is not None:
+            raise vuelo.error
+        return vuelo.resultado
+    try:
+        vuelo.resultado = funcion()
+        return vuelo.resultado
+    except Exception as e:
+        vuelo.error = e
+        raise
+    finally:
+        with _vuelos_lock:
+            del _vuelos[clave]
+        vuelo.listo.set()
@@ -0,0 +1,368 @@
+"""
+Almacenamiento por niveles de los archivos de documentos.
+
+- activo:    archivo suelto en UPLOAD_FOLDER (ruta_archivo)
+- archivado: miembro de un paquete en ARCHIVO_DIRECTORIO
+
+La tarea documentos.archivar empaqueta los documentos de solicitudes finalizadas
+hace más de ARCHIVO_DIAS_FINALIZADA días y borra los archivos sueltos, así el
+directorio activo (y sus copias de seguridad) solo crece con el trabajo en curso.
+
+Formato de un paquete:
+
+    DCPAQ1\\n | miembro | miembro | ... | índice JSON | offset del índice (8 bytes) | DCPAQ1\\n
+
+Cada miembro es el archivo comprimido con zlib, o tal cual si no se reduce (jpg,
+png, docx ya vienen comprimidos). La base guarda paquete, offset, longitud y
+compresión de cada documento: leer uno es un seek y una lectura secuencial. El
+índice del final hace que el paquete se pueda auditar o reconstruir sin la base.
+
+abrir_documento(), archivo_local() y hash_documento() leen de cualquiera de los
+dos niveles; los usan las descargas, las vistas previas y la verificación de integridad.
+
+Los archivos activos se reparten en UPLOAD_FOLDER/ab/cd/<nombre_archivo>, con ab/cd
+tomados del MD5 del nombre (65.536 directorios, pocos archivos en cada uno), y
+ruta_archivo guarda esa ruta relativa: mover la raíz solo requiere cambiar
+UPLOAD_FOLDER. Las filas antiguas con ruta absoluta se siguen resolviendo tal cual
+hasta que migrar_uploads.py las reubica.
+
+Documento.archivo_existe guarda si el archivo está en su nivel; reconciliar_archivos()
+lo recalcula listando cada directorio una vez con os.scandir en lugar de un stat
+por documento.
+"""
+from flask import current_app # type: ignore
+from app import db
+from app.models import Documento, Solicitud
+from contextlib import contextmanager
+from datetime import datetime, timedelta
+import hashlib
+import io
+import json
+import os
+import shutil
+import struct
+import tempfile
+import uuid
+import zlib
+
+MAGIA = b'DCPAQ1\n'
+TAMANO_BLOQUE = 1024 * 1024
+
+
+def ruta_repartida(nombre_archivo):
+    """Ruta relativa (con '/') de un archivo nuevo dentro de UPLOAD_FOLDER"""
+    digest = hashlib.md5(nombre_archivo.encode('utf-8')).hexdigest()
+    return f'{digest[:2]}/{digest[2:4]}/{nombre_archivo}'
+
+
+def ruta_fisica(ruta_archivo):
+    """Ruta en disco de Documento.ruta_archivo (relativa a UPLOAD_FOLDER, o absoluta en filas antiguas)"""
+    if os.path.isabs(ruta_archivo):
+        return ruta_archivo
+    return os.path.join(current_app.config['UPLOAD_FOLDER'], *ruta_archivo.split('/'))
+
+
+def preparar_ruta(nombre_archivo):
+    """(ruta relativa para la base, ruta en disco) de un archivo nuevo, con su directorio creado"""
+    relativa = ruta_repartida(nombre_archivo)
+    fisica = ruta_fisica(relativa)
+    os.makedirs(os.path.dirname(fisica), exist_ok=True)
+    return relativa, fisica
+
+
+def directorio_archivo():
+    directorio = current_app.config['ARCHIVO_DIRECTORIO']
+    os.makedirs(directorio, exist_ok=True)
+    return directorio
+
+
+def archivado(documento):
+    return getattr(documento, 'almacenamiento', 'activo') == 'archivado'
+
+
+def archivo_disponible(documento):
+    """True si los bytes del documento están en su nivel de almacenamiento"""
+    if archivado(documento):
+        return os.path.exists(os.path.join(current_app.config['ARCHIVO_DIRECTORIO'], documento.paquete))
+    return os.path.exists(ruta_fisica(documento.ruta_archivo))
+
+
+class LectorMiembro(io.RawIOBase):
+    """Lectura de un miembro de paquete con memoria acotada (con seek si no está comprimido)"""
+
+    def __init__(self, ruta, offset, longitud, compresion):
+        self._archivo = open(ruta, 'rb')
+        self._archivo.seek(offset)
+        self._inicio = offset
+        self._longitud = longitud
+        self._leido = 0
+        self._descompresor = zlib.decompressobj() if compresion == 'zlib' else None
+        self._pendiente = b''
+        self._posicion = 0
+
+    def readable(self):
+        return True
+
+    def seekable(self):
+        return self._descompresor is None
+
+    def tell(self):
+        return self._posicion if self._descompresor is not None else self._leido
+
+    def seek(self, posicion, desde=io.SEEK_SET):
+        if self._descompresor is not None:
+            raise io.UnsupportedOperation('Miembro comprimido: no admite seek')
+        base = {io.SEEK_SET: 0, io.SEEK_CUR: self._leido, io.SEEK_END: self._longitud}[desde]
+        self._leido = min(max(0, base + posicion), self._longitud)
+        self._archivo.seek(self._inicio + self._leido)
+        return self._leido
+
+    def _leer_crudo(self, n):
+        datos = self._archivo.read(min(n, self._longitud - self._leido))
+        self._leido += len(datos)
+        return datos
+
+    def readinto(self, destino):
+        n = len(destino)
+        if self._descompresor is None:
+            datos = self._leer_crudo(n)
+        else:
+            while len(self._pendiente) < n and not self._descompresor.eof:
+                crudo = self._leer_crudo(TAMANO_BLOQUE)
+                if not crudo:
+                    self._pendiente += self._descompresor.flush()
+                    break
+                self._pendiente += self._descompresor.decompress(crudo)
+            datos, self._pendiente = self._pendiente[:n], self._pendiente[n:]
+            self._posicion += len(datos)
+        destino[:len(datos)] = datos
+        return len(datos)
+
+    def close(self):
+        self._archivo.close()
+        super().close()
+
+
+def abrir_documento(documento):
+    """Archivo binario de solo lectura con el contenido del documento, esté en el nivel que esté"""
+    if archivado(documento):
+        ruta = os.path.join(current_app.config['ARCHIVO_DIRECTORIO'], documento.paquete)
+        return io.BufferedReader(LectorMiembro(ruta, documento.paquete_offset, documento.paquete_longitud,
+                                               documento.paquete_compresion), TAMANO_BLOQUE)
+    return open(ruta_fisica(documento.ruta_archivo), 'rb')
+
+
+@contextmanager
+def archivo_local(documento):
+    """Ruta de un archivo con el contenido (para quien necesita una ruta: mmap, librerías de imágenes)"""
+    if not archivado(documento):
+        yield ruta_fisica(documento.ruta_archivo)
+        return
+    extension = os.path.splitext(documento.nombre_archivo)[1]
+    with tempfile.NamedTemporaryFile(suffix=extension, delete=False) as temporal:
+        with abrir_documento(documento) as origen:
+            shutil.copyfileobj(origen, temporal, TAMANO_BLOQUE)
+    try:
+        yield temporal.name
+    finally:
+        os.remove(temporal.name)
+
+
+def hash_documento(documento):
+    """SHA256 del contenido leído por bloques desde su nivel de almacenamiento"""
+    sha256 = hashlib.sha256()
+    with abrir_documento(documento) as f:
+        for bloque in iter(lambda: f.read(TAMANO_BLOQUE), b''):
+            sha256.update(bloque)
+    return sha256.hexdigest()
+
+
+def leer_indice(ruta):
+    """Índice guardado al final de un paquete: {documento_id: {...}}"""
+    with open(ruta, 'rb') as f:
+        f.seek(-(8 + len(MAGIA)), io.SEEK_END)
+        offset_indice = struct.unpack('>Q', f.read(8))[0]
+        if f.read(len(MAGIA)) != MAGIA:
+            raise ValueError(f'{ruta} no es un paquete válido')
+        f.seek(offset_indice)
+        return json.loads(f.read()[:-(8 + len(MAGIA))])
+
+
+def _escribir_miembro(destino, ruta_origen, tamano):
+    """Copiar un archivo al paquete (comprimido si reduce más de un 5%); devuelve (longitud, compresión, sha256)"""
+    offset = destino.tell()
+    sha256 = hashlib.sha256()
+    compresor = zlib.compressobj(current_app.config['ARCHIVO_NIVEL_COMPRESION'])
+    with open(ruta_origen, 'rb') as origen:
+        for bloque in iter(lambda: origen.read(TAMANO_BLOQUE), b''):
+            sha256.update(bloque)
+            destino.write(compresor.compress(bloque))
+    destino.write(compresor.flush())
+    longitud = destino.tell() - offset
+    if longitud < tamano * 0.95:
+        return longitud, 'zlib', sha256.hexdigest()
+    # Ya venía comprimido: se guarda tal cual para no pagar la descompresión al leer
+    destino.seek(offset)
+    destino.truncate()
+    with open(ruta_origen, 'rb') as origen:
+        shutil.copyfileobj(origen, destino, TAMANO_BLOQUE)
+    return destino.tell() - offset, 'ninguna', sha256.hexdigest()
+
+
+def _escribir_paquete(documentos):
+    """Crear un paquete con los documentos dados; devuelve (nombre, miembros, omitidos)"""
+    directorio = directorio_archivo()
+    nombre = f"paquete-{datetime.utcnow().strftime('%Y%m%d-%H%M%S')}-{uuid.uuid4().hex[:8]}.dcpaq"
+    ruta = os.path.join(directorio, nombre)
+    temporal = ruta + '.tmp'
+    miembros, omitidos = [], []
+    try:
+        with open(temporal, 'w+b') as f:
+            f.write(MAGIA)
+            for documento in documentos:
+                offset = f.tell()
+                try:
+                    longitud, compresion, sha256 = _escribir_miembro(f, ruta_fisica(documento.ruta_archivo),
+                                                                  documento.tamano_bytes)
+                except FileNotFoundError:
+                    f.seek(offset)
+                    f.truncate()
+                    omitidos.append({'id': documento.id, 'motivo': 'archivo faltante'})
+                    continue
+                if documento.hash_archivo and sha256 != documento.hash_archivo:
+                    # No se archiva un archivo que no coincide con lo registrado
+                    f.seek(offset)
+                    f.truncate()
+                    omitidos.append({'id': documento.id, 'motivo': 'hash incorrecto'})
+                    continue
+                miembros.append({'id': documento.id, 'offset': offset, 'longitud': longitud,
+                                 'compresion': compresion, 'tamano': documento.tamano_bytes, 'sha256': sha256,
+                                 'ruta_archivo': ruta_fisica(documento.ruta_archivo)})
+            offset_indice = f.tell()
+            f.write(json.dumps({str(m['id']): {k: v for k, v in m.items() if k not in ('id', 'ruta_archivo')}
+                                for m in miembros}).encode())
+            f.write(struct.pack('>Q', offset_indice))
+            f.write(MAGIA)
+            f.flush()
+            os.fsync(f.fileno())
+        if not miembros:
+            os.remove(temporal)
+            return None, [], omitidos
+        os.replace(temporal, ruta)
+    except BaseException:
+        if os.path.exists(temporal):
+            os.remove(temporal)
+        raise
+    return nombre, miembros, omitidos
+
+
+def archivar_documentos(dias=None, max_bytes_paquete=None):
+    """
+    Empaquetar los documentos activos de solicitudes finalizadas hace más de `dias` días.
+    Los archivos sueltos se borran solo después de confirmar la base.
+    """
+    dias = current_app.config['ARCHIVO_DIAS_FINALIZADA'] if dias is None else dias
+    max_bytes_paquete = max_bytes_paquete or current_app.config['ARCHIVO_PAQUETE_MAX_BYTES']
+    corte = datetime.utcnow() - timedelta(days=dias)
+    candidatos = db.session.query(
+        Documento.id, Documento.ruta_archivo, Documento.tamano_bytes, Documento.hash_archivo
+    ).join(Solicitud, Documento.solicitud_id == Solicitud.id).filter(
+        Solicitud.estado_actual == 'finalizado',
+        Solicitud.fecha_finalizacion < corte,
+        Documento.almacenamiento == 'activo'
+    ).order_by(Documento.id).all()
+
+    # Agrupar en paquetes de hasta max_bytes_paquete (un documento mayor va solo)
+    grupos, grupo, acumulado = [], [], 0
+    for documento in candidatos:
+        if grupo and acumulado + documento.tamano_bytes > max_bytes_paquete:
+            grupos.append(grupo)
+            grupo, acumulado = [], 0
+        grupo.append(documento)
+        acumulado += documento.tamano_bytes
+    if grupo:
+        grupos.append(grupo)
+
+    resumen = {'candidatos': len(candidatos), 'archivados': 0, 'paquetes': [], 'omitidos': [],
+               'bytes_originales': 0, 'bytes_archivados': 0}
+    tabla = Documento.__table__
+    for grupo in grupos:
+        nombre, miembros, omitidos = _escribir_paquete(grupo)
+        resumen['omitidos'] += omitidos
+        if not miembros:
+            continue
+        try:
+            db.session.execute(
+                tabla.update()
+                .where(tabla.c.id == db.bindparam('b_id'))
+                .where(tabla.c.almacenamiento == 'activo')
+                .values(almacenamiento='archivado', paquete=nombre, paquete_offset=db.bindparam('b_offset'),
+                        paquete_longitud=db.bindparam('b_longitud'), paquete_compresion=db.bindparam('b_compresion'),
+                        hash_archivo=db.bindparam('b_hash'), archivo_existe=True),
+                [{'b_id': m['id'], 'b_offset': m['offset'], 'b_longitud': m['longitud'],
+                  'b_compresion': m['compresion'], 'b_hash': m['sha256']} for m in miembros]
+            )
+            db.session.commit()
+        except Exception:
+            db.session.rollback()
+            # El paquete queda huérfano pero los documentos siguen activos: se descarta
+            os.remove(os.path.join(directorio_archivo(), nombre))
+            raise
+        for miembro in miembros:
+            try:
+                os.remove(miembro['ruta_archivo'])
+            except OSError as e:
+                current_app.logger.warning(f"No se pudo borrar {miembro['ruta_archivo']} tras archivarlo: {e}")
+        resumen['archivados'] += len(miembros)
+        resumen['bytes_originales'] += sum(m['tamano'] for m in miembros)
+        resumen['bytes_archivados'] += sum(m['longitud'] for m in miembros)
+        resumen['paquetes'].append({'paquete': nombre, 'documentos': len(miembros)})
+    return resumen
+
+
+def _listar(directorio):
+    """Nombres de los archivos de un directorio (scandir no hace stat en la mayoría de sistemas)"""
+    try:
+        with os.scandir(directorio) as entradas:
+            return {entrada.name for entrada in entradas if entrada.is_file()}
+    except (FileNotFoundError, NotADirectoryError):
+        return set()
+
+
+def reconciliar_archivos(lote=2000):
+    """
+    Recalcular Documento.archivo_existe de todos los documentos.
+    Las filas se recorren ordenadas por ruta, así los documentos de un mismo directorio
+    llegan juntos y cada directorio se lista una sola vez.
+    """
+    paquetes = _listar(current_app.config['ARCHIVO_DIRECTORIO'])
+    filas = db.session.query(
+        Documento.id, Documento.ruta_archivo, Documento.almacenamiento, Documento.paquete, Documento.archivo_existe
+    ).order_by(Documento.ruta_archivo).yield_per(lote)
+
+    resumen = {'revisados': 0, 'directorios_listados': 0, 'marcados_faltantes': 0, 'marcados_presentes': 0}
+    cambios = []
+    directorio_actual, nombres = None, set()
+    for fila in filas:
+        resumen['revisados'] += 1
+        if fila.almacenamiento == 'archivado':
+            existe = fila.paquete in paquetes
+        else:
+            directorio, nombre = os.path.split(ruta_fisica(fila.ruta_archivo))
+            if directorio != directorio_actual:
+                directorio_actual, nombres = directorio, _listar(directorio)
+                resumen['directorios_listados'] += 1
+            existe = nombre in nombres
+        if existe != bool(fila.archivo_existe):
+            cambios.append({'b_id': fila.id, 'b_existe': existe})
+            resumen['marcados_presentes' if existe else 'marcados_faltantes'] += 1
+
+    # Las escrituras van después de recorrer el cursor (con yield_per sigue abierto mientras se itera)
+    tabla = Documento.__table__
+    for inicio in range(0, len(cambios), lote):
+        db.session.execute(
+            tabla.update().where(tabla.c.id == db.bindparam('b_id')).values(archivo_existe=db.bindparam('b_existe')),
+            cambios[inicio:inicio + lote]
+        )
+        db.session.commit()
+    return resumen
@@ -0,0 +1,403 @@
+"""
+Modo de despliegue ASGI opcional para las rutas dominadas por E/S (ver asgi.py en la raíz).
+
+Con WSGI cada conexión ocupa un hilo del worker mientras dura: una subida lenta, una
+descarga hacia un cliente lento o un stream SSE abierto. Aquí un bucle de asyncio
+atiende las conexiones y los hilos solo se ocupan mientras hay trabajo:
+
+- El resto de la API (los blueprints de app/routes.py, sin cambios) pasa por un puente
+  WSGI. El cuerpo de la petición se recibe en el bucle: en memoria, o en un archivo
+  temporal a partir de ASGI_CUERPO_MEMORIA_BYTES. La vista de Flask se ejecuta en el
+  pool de ASGI_HILOS hilos. La respuesta se envía por bloques: cada lectura del archivo
+  va al pool y cada envío al cliente se espera en el bucle. Así las subidas (multipart
+  y fragmentos) y las descargas (Range, 304, paquetes archivados) no retienen un hilo
+  mientras la red va lenta.
+- GET /api/eventos/stream: manejador async; espera eventos con obtener_async().
+- GET /api/tareas/<id>: manejador async; con ?esperar=N (hasta ASGI_ESPERA_TAREA_MAX
+  segundos) responde cuando la tarea termina, consultando la cola sin bloquear el bucle.
+- GET /api/ml/comparacion-prioridad: el cálculo (CPU) va a un pool de ASGI_PROCESOS_ML
+  procesos, para no retener el GIL del proceso que atiende las conexiones.
+
+Los manejadores async no pasan por los hooks de Flask (métricas, CORS); las cabeceras
+CORS se añaden aquí.
+"""
+from flask_jwt_extended import decode_token # type: ignore
+from app import db
+from app.models import Usuario
+from app.eventos import canales_usuario, formatear_evento, ROLES_PERSONAL
+from app.tareas import tarea_to_dict
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+from urllib.parse import parse_qsl
+import asyncio
+import functools
+import multiprocessing
+import re
+import sys
+import tempfile
+
+ESTADOS_FINALES = ('completada', 'fallida')
+
+
+class NoAutorizado(Exception):
+    """Token ausente o inválido, con el código que devolvería flask_jwt_extended"""
+
+    def __init__(self, mensaje, codigo=401):
+        super().__init__(mensaje)
+        self.codigo = codigo
+
+
+def _cabeceras(scope):
+    return {nombre.decode('latin1').lower(): valor.decode('latin1') for nombre, valor in scope['headers']}
+
+
+def _parametros(scope):
+    return dict(parse_qsl(scope['query_string'].decode('latin1')))
+
+
+def _environ(scope, cuerpo, longitud):
+    """Entorno WSGI de una petición ASGI"""
+    servidor = scope.get('server') or ('localhost', 80)
+    cliente = scope.get('client') or ('', 0)
+    raiz = scope.get('root_path', '')
+    ruta = scope['path'][len(raiz):] if scope['path'].startswith(raiz) else scope['path']
+    environ = {
+        'REQUEST_METHOD': scope['method'],
+        'SCRIPT_NAME': raiz.encode('utf-8').decode('latin1'),
+        'PATH_INFO': ruta.encode('utf-8').decode('latin1'),
+        'QUERY_STRING': scope['query_string'].decode('latin1'),
+        'SERVER_NAME': servidor[0],
+        'SERVER_PORT': str(servidor[1]),
+        'SERVER_PROTOCOL': f"HTTP/{scope.get('http_version', '1.1')}",
+        'REMOTE_ADDR': cliente[0],
+        'REMOTE_PORT': str(cliente[1]),
+        'CONTENT_LENGTH': str(longitud),
+        'wsgi.version': (1, 0),
+        'wsgi.url_scheme': scope.get('scheme', 'http'),
+        'wsgi.input': cuerpo,
+        'wsgi.errors': sys.stderr,
+        'wsgi.multithread': True,
+        'wsgi.multiprocess': True,
+        'wsgi.run_once': False,
+        'asgi.scope': scope
+    }
+    for nombre, valor in scope['headers']:
+        nombre = nombre.decode('latin1').upper().replace('-', '_')
+        valor = valor.decode('latin1')
+        if nombre == 'CONTENT_LENGTH':
+            continue
+        if nombre == 'CONTENT_TYPE':
+            environ['CONTENT_TYPE'] = valor
+            continue
+        clave = f'HTTP_{nombre}'
+        environ[clave] = f'{environ[clave]},{valor}' if clave in environ else valor
+    return environ
+
+
+def _siguiente_bloque(iterador, tamano):
+    """Juntar trozos del cuerpo WSGI hasta `tamano` bytes (menos saltos entre hilo y bucle); None al terminar"""
+    partes, total = [], 0
+    for trozo in iterador:
+        if trozo:
+            partes.append(trozo)
+            total += len(trozo)
+            if total >= tamano:
+                break
+    else:
+        if not partes:
+            return None
+    return b''.join(partes)
+
+
+# Proceso del pool de ML: su propia app (spawn, sin heredar hilos ni conexiones del servidor)
+_app_ml = None
+_modelo_cargado = False
+
+
+def _iniciar_proceso_ml():
+    global _app_ml
+    from app import create_app
+    _app_ml = create_app()
+
+
+def _comparacion_prioridad():
+    """Datos de comparación de prioridad ya serializados (la serialización también es CPU)"""
+    global _modelo_cargado
+    from app.ml_utils import solicitud_processor
+    with _app_ml.app_context():
+        if not _modelo_cargado:
+            try:
+                solicitud_processor.load_priority_model()
+                _modelo_cargado = True
+            except Exception as e:
+                _app_ml.logger.warning(f'No se pudo cargar el modelo ML: {e}')
+        try:
+            datos = solicitud_processor.get_priority_comparison_data()
+            return _app_ml.json.dumps({'data': datos}).encode('utf-8')
+        finally:
+            db.session.remove()
+
+
+class AppASGI:
+    """Aplicación ASGI: manejadores async para las rutas de E/S y puente WSGI para el resto"""
+
+    def __init__(self, app):
+        self.app = app
+        self.hilos = ThreadPoolExecutor(max_workers=app.config['ASGI_HILOS'], thread_name_prefix='asgi')
+        self._procesos = None  # Pool de ML, creado al primer uso
+        self._calculos = {}  # Cálculos de ML en curso: las peticiones simultáneas comparten uno
+        self.rutas = [
+            ('GET', re.compile(r'/api/eventos/stream/?'), self.stream_eventos),
+            ('GET', re.compile(r'/api/tareas/(\d+)'), self.estado_tarea),
+            ('GET', re.compile(r'/api/ml/comparacion-prioridad'), self.comparacion_prioridad)
+        ]
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] == 'lifespan':
+            return await self._ciclo_de_vida(receive, send)
+        if scope['type'] != 'http':
+            return
+        for metodo, patron, manejador in self.rutas:
+            coincidencia = patron.fullmatch(scope['path'])
+            if coincidencia and scope['method'] == metodo:
+                return await manejador(scope, receive, send, *coincidencia.groups())
+        await self.wsgi(scope, receive, send)
+
+    async def _ciclo_de_vida(self, receive, send):
+        while True:
+            mensaje = await receive()
+            if mensaje['type'] == 'lifespan.startup':
+                await send({'type': 'lifespan.startup.complete'})
+            elif mensaje['type'] == 'lifespan.shutdown':
+                self.cerrar()
+                await send({'type': 'lifespan.shutdown.complete'})
+                return
+
+    def cerrar(self):
+        self.hilos.shutdown(wait=False)
+        if self._procesos is not None:
+            self._procesos.shutdown(wait=False, cancel_futures=True)
+
+    async def en_hilo(self, funcion, *args):
+        return await asyncio.get_running_loop().run_in_executor(self.hilos, functools.partial(funcion, *args))
+
+    # --------------------------------------------------------------------------------------------
+    # Utilidades de los manejadores async
+    # --------------------------------------------------------------------------------------------
+
+    def _usuario(self, scope, permitir_query=False):
+        """(usuario_id, rol) del JWT de la petición (se ejecuta en un hilo: consulta la base)"""
+        autorizacion = _cabeceras(scope).get('authorization', '')
+        token = autorizacion[7:] if autorizacion.startswith('Bearer ') else None
+        if token is None and permitir_query:
+            token = _parametros(scope).get('jwt')
+        if not token:
+            raise NoAutorizado('Missing Authorization Header')
+        with self.app.app_context():
+            try:
+                claims = decode_token(token)
+            except Exception as e:
+                codigo = 401 if type(e).__name__ == 'ExpiredSignatureError' else 422
+                raise NoAutorizado(str(e), codigo)
+            if claims.get('type') != 'access':
+                raise NoAutorizado('Only non-refresh tokens are allowed', 422)
+            try:
+                usuario = db.session.get(Usuario, int(claims[self.app.config['JWT_IDENTITY_CLAIM']]))
+                if not usuario:
+                    raise NoAutorizado('Usuario no válido')
+                return usuario.id, usuario.rol
+            finally:
+                db.session.remove()
+
+    def _cabeceras_cors(self, scope):
+        origen = _cabeceras(scope).get('origin')
+        permitidos = self.app.config['CORS_ORIGINS']
+        if origen and (permitidos == '*' or origen in permitidos):
+            return [(b'access-control-allow-origin', origen.encode('latin1')), (b'vary', b'Origin')]
+        return []
+
+    async def _responder(self, scope, send, codigo, cuerpo, tipo=b'application/json'):
+        await send({
+            'type': 'http.response.start',
+            'status': codigo,
+            'headers': [(b'content-type', tipo), (b'content-length', str(len(cuerpo)).encode()),
+                        *self._cabeceras_cors(scope)]
+        })
+        await send({'type': 'http.response.body', 'body': cuerpo})
+
+    async def _json(self, scope, send, codigo, datos):
+        with self.app.app_context():
+            cuerpo = self.app.json.dumps(datos).encode('utf-8')
+        await self._responder(scope, send, codigo, cuerpo)
+
+    async def _autenticar(self, scope, send, permitir_query=False):
+        """(usuario_id, rol), o None tras responder el error"""
+        try:
+            return await self.en_hilo(self._usuario, scope, permitir_query)
+        except NoAutorizado as e:
+            await self._json(scope, send, e.codigo, {'msg': str(e)})
+            return None
+
+    # --------------------------------------------------------------------------------------------
+    # Manejadores async
+    # --------------------------------------------------------------------------------------------
+
+    async def stream_eventos(self, scope, receive, send):
+        """Mismo protocolo que la vista SSE de routes.py, sin un hilo por cliente"""
+        usuario = await self._autenticar(scope, send, permitir_query=True)
+        if usuario is None:
+            return
+        ultimo_id = _cabeceras(scope).get('last-event-id')
+        ultimo_id = int(ultimo_id) if ultimo_id and ultimo_id.isdigit() else None
+        backend = self.app.extensions['eventos']
+        suscripcion = await self.en_hilo(backend.suscribir, canales_usuario(*usuario), ultimo_id)
+        heartbeat = self.app.config['SSE_HEARTBEAT_SEGUNDOS']
+        desconexion = asyncio.ensure_future(self._esperar_desconexion(receive))
+        try:
+            await send({
+                'type': 'http.response.start',
+                'status': 200,
+                'headers': [(b'content-type', b'text/event-stream; charset=utf-8'), (b'cache-control', b'no-cache'),
+                            (b'x-accel-buffering', b'no'), *self._cabeceras_cors(scope)]
+            })
+            await send({'type': 'http.response.body', 'body': b'retry: 5000\n\n', 'more_body': True})
+            while True:
+                espera = asyncio.ensure_future(suscripcion.obtener_async(timeout=heartbeat))
+                await asyncio.wait({espera, desconexion}, return_when=asyncio.FIRST_COMPLETED)
+                if desconexion.done():
+                    espera.cancel()
+                    break
+                recibido = espera.result()
+                texto = ': ping\n\n' if recibido is None else formatear_evento(*recibido)
+                await send({'type': 'http.response.body', 'body': texto.encode('utf-8'), 'more_body': True})
+        finally:
+            desconexion.cancel()
+            suscripcion.cerrar()
+
+    @staticmethod
+    async def _esperar_desconexion(receive):
+        while (await receive())['type'] != 'http.disconnect':
+            pass
+
+    async def estado_tarea(self, scope, receive, send, tarea_id):
+        """Estado de una tarea; con ?esperar=N espera (sin hilo) a que termine"""
+        usuario = await self._autenticar(scope, send)
+        if usuario is None:
+            return
+        usuario_id, rol = usuario
+        try:
+            esperar = min(max(float(_parametros(scope).get('esperar') or 0), 0), self.app.config['ASGI_ESPERA_TAREA_MAX'])
+        except ValueError:
+            esperar = 0
+        cola = self.app.extensions['tareas']
+        bucle = asyncio.get_running_loop()
+        limite = bucle.time() + esperar
+        intervalo = 0.1
+        while True:
+            datos = await self.en_hilo(cola.obtener, int(tarea_id))
+            if not datos:
+                return await self._json(scope, send, 404, {'error': 'Tarea no encontrada'})
+            if rol not in ROLES_PERSONAL and datos['usuario_id'] != usuario_id:
+                return await self._json(scope, send, 403, {'error': 'Sin permisos para ver esta tarea'})
+            restante = limite - bucle.time()
+            if datos['estado'] in ESTADOS_FINALES or restante <= 0:
+                return await self._json(scope, send, 200, tarea_to_dict(datos))
+            await asyncio.sleep(min(intervalo, restante))
+            intervalo = min(intervalo * 2, 1.0)
+
+    def _pool_ml(self):
+        if self._procesos is None:
+            self._procesos = ProcessPoolExecutor(
+                max_workers=self.app.config['ASGI_PROCESOS_ML'],
+                mp_context=multiprocessing.get_context('spawn'),
+                initializer=_iniciar_proceso_ml
+            )
+        return self._procesos
+
+    async def comparacion_prioridad(self, scope, receive, send):
+        usuario = await self._autenticar(scope, send)
+        if usuario is None:
+            return
+        if usuario[1] not in ROLES_PERSONAL:
+            return await self._json(scope, send, 403, {'error': 'Sin permisos para ver comparación ML'})
+        clave = 'ml.comparacion_prioridad'
+        futuro = self._calculos.get(clave)
+        if futuro is None:
+            futuro = asyncio.get_running_loop().run_in_executor(self._pool_ml(), _comparacion_prioridad)
+            self._calculos[clave] = futuro
+            futuro.add_done_callback(lambda _: self._calculos.pop(clave, None))
+        try:
+            # shield: si este cliente se desconecta, el cálculo sigue para los demás
+            cuerpo = await asyncio.shield(futuro)
+        except Exception as e:
+            return await self._json(scope, send, 500, {'error': str(e)})
+        await self._responder(scope, send, 200, cuerpo)
+
+    # --------------------------------------------------------------------------------------------
+    # Puente WSGI
+    # --------------------------------------------------------------------------------------------
+
+    async def _recibir_cuerpo(self, receive, maximo):
+        """Cuerpo de la petición en un archivo temporal (en memoria hasta ASGI_CUERPO_MEMORIA_BYTES)"""
+        limite_memoria = self.app.config['ASGI_CUERPO_MEMORIA_BYTES']
+        cuerpo = tempfile.SpooledTemporaryFile(max_size=limite_memoria)
+        total = 0
+        while True:
+            mensaje = await receive()
+            if mensaje['type'] == 'http.disconnect':
+                cuerpo.close()
+                return None, total
+            datos = mensaje.get('body', b'')
+            total += len(datos)
+            if maximo is not None and total > maximo:
+                cuerpo.close()
+                return None, total
+            if datos:
+                # Ya en disco: la escritura va al pool para no bloquear el bucle
+                if total > limite_memoria:
+                    await self.en_hilo(cuerpo.write, datos)
+                else:
+                    cuerpo.write(datos)
+            if not mensaje.get('more_body', False):
+                cuerpo.seek(0)
+                return cuerpo, total
+
+    async def wsgi(self, scope, receive, send):
+        maximo = self.app.config.get('MAX_CONTENT_LENGTH')
+        declarado = _cabeceras(scope).get('content-length')
+        if maximo is not None and declarado and declarado.isdigit() and int(declarado) > maximo:
+            return await self._json(scope, send, 413, {'error': 'El archivo supera el tamaño máximo permitido'})
+        cuerpo, longitud = await self._recibir_cuerpo(receive, maximo)
+        if cuerpo is None:
+            if maximo is not None and longitud > maximo:
+                await self._json(scope, send, 413, {'error': 'El archivo supera el tamaño máximo permitido'})
+            return
+
+        inicio = {}
+        escrito = []
+
+        def start_response(estado, cabeceras, exc_info=None):
+            inicio['estado'] = int(estado.split(' ', 1)[0])
+            inicio['cabeceras'] = [(k.lower().encode('latin1'), v.encode('latin1')) for k, v in cabeceras]
+            return escrito.append
+
+        def llamar():
+            resultado = self.app(_environ(scope, cuerpo, longitud), start_response)
+            iterador = iter(resultado)
+            return resultado, iterador, _siguiente_bloque(iterador, bloque)
+
+        bloque = self.app.config['ASGI_BLOQUE_RESPUESTA_BYTES']
+        resultado = None
+        try:
+            resultado, iterador, trozo = await self.en_hilo(llamar)
+            await send({'type': 'http.response.start', 'status': inicio['estado'], 'headers': inicio['cabeceras']})
+            if escrito:
+                await send({'type': 'http.response.body', 'body': b''.join(escrito), 'more_body': True})
+            while trozo is not None:
+                await send({'type': 'http.response.body', 'body': trozo, 'more_body': True})
+                trozo = await self.en_hilo(_siguiente_bloque, iterador, bloque)
+            await send({'type': 'http.response.body', 'body': b''})
+        finally:
+            cerrar = getattr(resultado, 'close', None)
+            if cerrar is not None:
+                await self.en_hilo(cerrar)
+            cuerpo.close()
@@ -0,0 +1,272 @@
+"""
+Subidas reanudables por fragmentos para documentos grandes (planos dwg, PDFs escaneados).
+
+Protocolo (rutas /api/documentos/cargas en routes.py):
+1. iniciar: se registra la carga en el área temporal (CARGAS_DIRECTORIO)
+2. PUT de fragmentos en orden con ?offset=; tras un corte, GET devuelve cuántos
+   bytes hay (recibido) y el cliente continúa desde ahí
+3. finalizar: se comprueba el tamaño (y el SHA256 si el cliente lo envía), el
+   archivo se mueve con os.replace a UPLOAD_FOLDER y se crea el Documento
+
+Cada fragmento se escribe por bloques, sin cargarlo entero en memoria. El SHA256
+se calcula a medida que llegan los fragmentos; si uno llega a otro proceso (o tras
+reiniciar) se recalcula leyendo del disco lo ya recibido. Las cargas sin actividad
+durante CARGAS_EXPIRACION_HORAS se eliminan.
+"""
+from flask import current_app # type: ignore
+from werkzeug.utils import secure_filename # type: ignore
+from app.almacenamiento import preparar_ruta
+from datetime import datetime
+import hashlib
+import json
+import os
+import random
+import threading
+import time
+import uuid
+
+TAMANO_BLOQUE = 1024 * 1024
+
+# Hash incremental por carga en este proceso: carga_id -> (bytes procesados, sha256)
+_hashes = {}
+_hashes_lock = threading.Lock()
+_ultima_limpieza = 0
+
+
+class ErrorCarga(Exception):
+    """Error del protocolo de carga con el código HTTP a devolver"""
+
+    def __init__(self, mensaje, codigo=400, **datos):
+        super().__init__(mensaje)
+        self.codigo = codigo
+        self.datos = datos
+
+
+def directorio_cargas():
+    directorio = current_app.config['CARGAS_DIRECTORIO'] or os.path.join(current_app.config['UPLOAD_FOLDER'], '.cargas')
+    os.makedirs(directorio, exist_ok=True)
+    return directorio
+
+
+def _rutas(carga_id):
+    # El id viene de la URL: solo se aceptan los generados por iniciar_carga()
+    if len(carga_id) != 32 or any(c not in '0123456789abcdef' for c in carga_id):
+        raise ErrorCarga('Carga no encontrada', 404)
+    base = os.path.join(directorio_cargas(), carga_id)
+    return base + '.json', base + '.part', base + '.lock'
+
+
+def _guardar_metadata(ruta, metadata):
+    temporal = f'{ruta}.{uuid.uuid4().hex}.tmp'
+    with open(temporal, 'w', encoding='utf-8') as f:
+        json.dump(metadata, f)
+    os.replace(temporal, ruta)
+
+
+def obtener_carga(carga_id, usuario_id):
+    """Metadata de la carga con 'recibido' = bytes ya escritos"""
+    ruta_meta, ruta_parte, _ = _rutas(carga_id)
+    try:
+        with open(ruta_meta, encoding='utf-8') as f:
+            metadata = json.load(f)
+    except (OSError, ValueError):
+        raise ErrorCarga('Carga no encontrada', 404)
+    if metadata['usuario_id'] != usuario_id:
+        raise ErrorCarga('Carga no encontrada', 404)
+    metadata['recibido'] = os.path.getsize(ruta_parte) if os.path.exists(ruta_parte) else 0
+    return metadata
+
+
+def carga_to_dict(metadata):
+    expira = metadata['actualizada_en'] + current_app.config['CARGAS_EXPIRACION_HORAS'] * 3600
+    return {
+        'carga_id': metadata['id'],
+        'solicitud_id': metadata['solicitud_id'],
+        'nombre': metadata['nombre'],
+        'tipo_documento': metadata['tipo_documento'],
+        'tamano': metadata['tamano'],
+        'recibido': metadata['recibido'],
+        'completa': metadata['recibido'] == metadata['tamano'],
+        'tamano_fragmento': current_app.config['CARGAS_TAMANO_FRAGMENTO'],
+        'expira_en': datetime.utcfromtimestamp(expira).isoformat()
+    }
+
+
+def iniciar_carga(solicitud_id, usuario_id, nombre, tamano, tipo_documento, tipo_mime):
+    limpiar_vencidas()
+    if not isinstance(tamano, int) or tamano <= 0:
+        raise ErrorCarga('El tamaño del archivo debe ser un entero positivo')
+    if tamano > current_app.config['CARGAS_TAMANO_MAX']:
+        raise ErrorCarga(f"El archivo supera el máximo de {current_app.config['CARGAS_TAMANO_MAX']} bytes", 413)
+    carga_id = uuid.uuid4().hex
+    ruta_meta, ruta_parte, _ = _rutas(carga_id)
+    ahora = time.time()
+    metadata = {
+        'id': carga_id,
+        'solicitud_id': solicitud_id,
+        'usuario_id': usuario_id,
+        'nombre': secure_filename(nombre),
+        'tamano': tamano,
+        'tipo_documento': tipo_documento,
+        'tipo_mime': tipo_mime or 'application/octet-stream',
+        'creada_en': ahora,
+        'actualizada_en': ahora
+    }
+    open(ruta_parte, 'wb').close()
+    _guardar_metadata(ruta_meta, metadata)
+    metadata['recibido'] = 0
+    return metadata
+
+
+def _bloquear(ruta_lock):
+    """Candado entre procesos con un archivo creado en exclusiva (portable, sin fcntl)"""
+    try:
+        os.close(os.open(ruta_lock, os.O_CREAT | os.O_EXCL | os.O_WRONLY))
+        return
+    except FileExistsError:
+        pass
+    # Candado de un proceso que murió a mitad de un fragmento
+    try:
+        vencido = time.time() - os.path.getmtime(ruta_lock) > current_app.config['CARGAS_CANDADO_SEGUNDOS']
+    except OSError:
+        vencido = True
+    if not vencido:
+        raise ErrorCarga('Ya se está recibiendo un fragmento de esta carga', 409)
+    try:
+        os.remove(ruta_lock)
+    except OSError:
+        pass
+    try:
+        os.close(os.open(ruta_lock, os.O_CREAT | os.O_EXCL | os.O_WRONLY))
+    except FileExistsError:
+        raise ErrorCarga('Ya se está recibiendo un fragmento de esta carga', 409)
+
+
+def _hash_hasta(carga_id, ruta_parte, recibido):
+    """sha256 de los primeros `recibido` bytes, reutilizando el estado del proceso si coincide"""
+    with _hashes_lock:
+        estado = _hashes.pop(carga_id, None)
+    if estado is not None and estado[0] == recibido:
+        return estado[1]
+    sha256 = hashlib.sha256()
+    with open(ruta_parte, 'rb') as f:
+        restante = recibido
+        while restante:
+            bloque = f.read(min(TAMANO_BLOQUE, restante))
+            if not bloque:
+                break
+            sha256.update(bloque)
+            restante -= len(bloque)
+    return sha256
+
+
+def escribir_fragmento(carga_id, usuario_id, offset, flujo, longitud):
+    """
+    Añadir un fragmento leído de `flujo` en la posición `offset`.
+    Un reenvío de bytes ya recibidos se acepta sin escribir (el cliente no vio la respuesta).
+    """
+    metadata = obtener_carga(carga_id, usuario_id)
+    ruta_meta, ruta_parte, ruta_lock = _rutas(carga_id)
+    if longitud is None:
+        raise ErrorCarga('Se requiere Content-Length', 411)
+    if longitud > current_app.config['CARGAS_TAMANO_FRAGMENTO']:
+        raise ErrorCarga(f"El fragmento supera {current_app.config['CARGAS_TAMANO_FRAGMENTO']} bytes", 413)
+    if offset + longitud <= metadata['recibido'] and longitud:
+        return metadata
+    if offset != metadata['recibido']:
+        raise ErrorCarga('Offset incorrecto: continúe desde el recibido', 409, recibido=metadata['recibido'])
+    if offset + longitud > metadata['tamano']:
+        raise ErrorCarga('El fragmento excede el tamaño declarado', 400)
+
+    _bloquear(ruta_lock)
+    try:
+        # Con el candado tomado, el tamaño en disco es la fuente de verdad
+        recibido = os.path.getsize(ruta_parte)
+        if recibido != offset:
+            raise ErrorCarga('Offset incorrecto: continúe desde el recibido', 409, recibido=recibido)
+        sha256 = _hash_hasta(carga_id, ruta_parte, recibido)
+        with open(ruta_parte, 'ab') as f:
+            restante = longitud
+            while restante:
+                bloque = flujo.read(min(TAMANO_BLOQUE, restante))
+                if not bloque:
+                    break
+                f.write(bloque)
+                sha256.update(bloque)
+                restante -= len(bloque)
+                recibido += len(bloque)
+        with _hashes_lock:
+            _hashes[carga_id] = (recibido, sha256)
+        metadata['actualizada_en'] = time.time()
+        _guardar_metadata(ruta_meta, {k: v for k, v in metadata.items() if k != 'recibido'})
+    finally:
+        os.remove(ruta_lock)
+    metadata['recibido'] = recibido
+    if restante:
+        # Conexión cortada a mitad del fragmento: lo escrito queda y se reanuda desde ahí
+        raise ErrorCarga('Fragmento incompleto', 400, recibido=recibido)
+    return metadata
+
+
+def finalizar_carga(carga_id, usuario_id, hash_esperado=None):
+    """
+    Verificar la carga y moverla a UPLOAD_FOLDER.
+    Devuelve (metadata, nombre_archivo, ruta_relativa, ruta_en_disco, hash_archivo); la carga deja de existir.
+    """
+    metadata = obtener_carga(carga_id, usuario_id)
+    ruta_meta, ruta_parte, ruta_lock = _rutas(carga_id)
+    if metadata['recibido'] != metadata['tamano']:
+        raise ErrorCarga('La carga está incompleta', 409, recibido=metadata['recibido'])
+    _bloquear(ruta_lock)
+    try:
+        hash_archivo = _hash_hasta(carga_id, ruta_parte, metadata['recibido']).hexdigest()
+        if hash_esperado and hash_esperado.lower() != hash_archivo:
+            raise ErrorCarga('El SHA256 no coincide con el del archivo recibido', 422, hash_archivo=hash_archivo)
+
+        timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
+        nombre_archivo = f"{metadata['solicitud_id']}_{timestamp}_{random.randint(1000, 9999)}_{metadata['nombre']}"
+        ruta_relativa, ruta_archivo = preparar_ruta(nombre_archivo)
+        # Mismo sistema de archivos (el área temporal está bajo UPLOAD_FOLDER): renombrado atómico
+        os.replace(ruta_parte, ruta_archivo)
+        os.remove(ruta_meta)
+    finally:
+        if os.path.exists(ruta_lock):
+            os.remove(ruta_lock)
+    return metadata, nombre_archivo, ruta_relativa, ruta_archivo, hash_archivo
+
+
+def cancelar_carga(carga_id, usuario_id):
+    obtener_carga(carga_id, usuario_id)
+    _eliminar(carga_id)
+
+
+def _eliminar(carga_id):
+    with _hashes_lock:
+        _hashes.pop(carga_id, None)
+    for ruta in _rutas(carga_id):
+        try:
+            os.remove(ruta)
+        except FileNotFoundError:
+            pass
+
+
+def limpiar_vencidas(forzar=False):
+    """Eliminar cargas sin actividad (como mucho una pasada cada CARGAS_LIMPIEZA_SEGUNDOS por proceso)"""
+    global _ultima_limpieza
+    ahora = time.time()
+    if not forzar and ahora - _ultima_limpieza < current_app.config['CARGAS_LIMPIEZA_SEGUNDOS']:
+        return 0
+    _ultima_limpieza = ahora
+    limite = ahora - current_app.config['CARGAS_EXPIRACION_HORAS'] * 3600
+    eliminadas = 0
+    with os.scandir(directorio_cargas()) as entradas:
+        for entrada in entradas:
+            if not entrada.name.endswith('.json'):
+                continue
+            try:
+                if entrada.stat().st_mtime < limite:
+                    _eliminar(entrada.name[:-len('.json')])
+                    eliminadas += 1
+            except (OSError, ErrorCarga):
+                continue
+    return eliminadas
@@ -1,4 +1,5 @@
 import os
+import tempfile
 from dotenv import load_dotenv
 
 load_dotenv()
@@ -19,13 +20,21 @@ class Config:
     # URI de conexión a la base de datos
     SQLALCHEMY_DATABASE_URI = f"mysql+pymysql://{MYSQL_USER}:{MYSQL_PASSWORD}@{MYSQL_HOST}:{MYSQL_PORT}/{MYSQL_DATABASE}"
     SQLALCHEMY_TRACK_MODIFICATIONS = False
+    
+    # Réplicas de lectura (ver app/replicas.py): URIs separadas por comas; sin réplicas todo va a la principal
+    REPLICAS_URIS = [uri.strip() for uri in (os.environ.get('REPLICAS_URIS') or '').split(',') if uri.strip()]
+    # Tras escribir, las lecturas del usuario van a la principal durante este tiempo (> retraso de replicación)
+    REPLICAS_ADHERENCIA_SEGUNDOS = float(os.environ.get('REPLICAS_ADHERENCIA_SEGUNDOS') or 10)
+    REPLICAS_ADHERENCIA_BACKEND = os.environ.get('REPLICAS_ADHERENCIA_BACKEND') or 'memoria'  # 'memoria' o 'redis'
+    REPLICAS_REDIS_URL = os.environ.get('REPLICAS_REDIS_URL') or 'redis://localhost:6379/0'
       # Configuración de JWT
     JWT_SECRET_KEY = os.environ.get('JWT_SECRET_KEY') or 'jwt-secret-key-change-in-production'
     JWT_ACCESS_TOKEN_EXPIRES = 3600  # 1 hora
     JWT_ALGORITHM = 'HS256'
     JWT_IDENTITY_CLAIM = 'sub'
       # Configuración de archivos
-    UPLOAD_FOLDER = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'uploads')
+    # Raíz de los archivos: Documento.ruta_archivo es relativa a ella (ver app/almacenamiento.py)
+    UPLOAD_FOLDER = os.environ.get('UPLOAD_FOLDER') or os.path.join(os.path.dirname(os.path.abspath(__file__)), 'uploads')
     MAX_CONTENT_LENGTH = 16 * 1024 * 1024  # 16MB máximo por archivo
     
     # Tipos de archivo permitidos
@@ -33,6 +42,116 @@ class Config:
         'pdf', 'jpg', 'jpeg', 'png', 'doc', 'docx', 'dwg', 'txt'
     }
     
+    # Subidas reanudables por fragmentos (ver app/cargas.py)
+    CARGAS_DIRECTORIO = os.environ.get('CARGAS_DIRECTORIO')  # Por defecto UPLOAD_FOLDER/.cargas (mismo disco: renombrado atómico)
+    CARGAS_TAMANO_MAX = int(os.environ.get('CARGAS_TAMANO_MAX') or 2 * 1024 * 1024 * 1024)  # 2GB por archivo
+    CARGAS_TAMANO_FRAGMENTO = 8 * 1024 * 1024  # Debe ser menor que MAX_CONTENT_LENGTH
+    CARGAS_EXPIRACION_HORAS = 24  # Cargas sin actividad que se eliminan
+    CARGAS_LIMPIEZA_SEGUNDOS = 600  # Frecuencia máxima de la limpieza por proceso
+    CARGAS_CANDADO_SEGUNDOS = 300  # Candado de fragmento que se considera abandonado
+    
+    # Descargas (ver app/descargas.py). DESCARGAS_OFFLOAD: None, 'x-accel' (nginx) o 'x-sendfile'
+    DESCARGAS_OFFLOAD = os.environ.get('DESCARGAS_OFFLOAD') or None
+    DESCARGAS_ACCEL_PREFIJO = os.environ.get('DESCARGAS_ACCEL_PREFIJO') or '/_uploads/'  # location internal de nginx
+    # Recalcular el SHA256 en cada descarga completa (los rangos y 304 solo comparan el tamaño)
+    DESCARGAS_VERIFICAR_HASH = os.environ.get('DESCARGAS_VERIFICAR_HASH', 'True').lower() in ('true', '1')
+    
+    # Vistas previas de jpg/png/pdf (ver app/vistas_previas.py)
+    PREVIEWS_DIRECTORIO = os.environ.get('PREVIEWS_DIRECTORIO')  # Por defecto UPLOAD_FOLDER/.previews
+    PREVIEWS_CACHE_MAX_BYTES = int(os.environ.get('PREVIEWS_CACHE_MAX_BYTES') or 256 * 1024 * 1024)
+    PREVIEWS_TAMANOS = {'miniatura': 256, 'pagina': 1024}  # Lado mayor en píxeles
+    # PNG más grandes no se reducen sin Pillow: el camino en Python puro corre en el hilo de la
+    # petición y tarda ~2 s por megapíxel en el peor caso (filtro Paeth)
+    PREVIEWS_MAX_PIXELES_PURO = 1000000
+    
+    # Archivo de documentos fríos en paquetes comprimidos (ver app/almacenamiento.py)
+    ARCHIVO_DIRECTORIO = os.environ.get('ARCHIVO_DIRECTORIO') or os.path.join(
+        os.path.dirname(os.path.abspath(__file__)), 'paquetes')
+    ARCHIVO_DIAS_FINALIZADA = int(os.environ.get('ARCHIVO_DIAS_FINALIZADA') or 180)  # Antigüedad mínima de la finalización
+    ARCHIVO_PAQUETE_MAX_BYTES = int(os.environ.get('ARCHIVO_PAQUETE_MAX_BYTES') or 1024 * 1024 * 1024)
+    ARCHIVO_NIVEL_COMPRESION = 6  # zlib 1-9
+    # Cada cuánto worker.py encola la reconciliación de Documento.archivo_existe (0 = nunca)
+    ARCHIVOS_RECONCILIAR_SEGUNDOS = int(os.environ.get('ARCHIVOS_RECONCILIAR_SEGUNDOS') or 0)
+
+    # Modo ASGI (ver app/asgi.py)
+    ASGI_HILOS = int(os.environ.get('ASGI_HILOS') or 32)  # Vistas de Flask y lecturas de archivo en curso
+    ASGI_PROCESOS_ML = int(os.environ.get('ASGI_PROCESOS_ML') or 1)
+    ASGI_ESPERA_TAREA_MAX = 30  # Segundos máximos de ?esperar= en GET /api/tareas/<id>
+    ASGI_CUERPO_MEMORIA_BYTES = 1024 * 1024  # Cuerpos mayores se reciben en un archivo temporal
+    ASGI_BLOQUE_RESPUESTA_BYTES = 256 * 1024  # Bytes leídos por salto al pool al enviar una respuesta
+
+    # Máximo de solicitudes aceptadas en una carga masiva
+    BULK_SOLICITUDES_MAX = int(os.environ.get('BULK_SOLICITUDES_MAX') or 500)
+
+    # Máximo de cambios de estado/reasignaciones aceptados en un lote
+    BULK_TRANSICIONES_MAX = int(os.environ.get('BULK_TRANSICIONES_MAX') or 1000)
+
+    # Eventos en tiempo real (SSE): backend de pub/sub 'memoria' o 'redis'
+    EVENTOS_BACKEND = os.environ.get('EVENTOS_BACKEND') or 'memoria'
+    EVENTOS_REDIS_URL = os.environ.get('EVENTOS_REDIS_URL') or 'redis://localhost:6379/0'
+    EVENTOS_HISTORIAL = 1000  # Eventos recientes guardados para reconexiones (Last-Event-ID)
+    SSE_HEARTBEAT_SEGUNDOS = 15
+    # Streams SSE simultáneos por proceso en modo WSGI (con workers sync/gthread cada uno ocupa
+    # un hilo; con gevent o en modo ASGI se puede subir mucho). 0 = sin límite
+    SSE_MAX_CONEXIONES = int(os.environ.get('SSE_MAX_CONEXIONES') or 50)
+    
+    # Cola de tareas en segundo plano (ver worker.py)
+    TAREAS_DB_PATH = os.environ.get('TAREAS_DB_PATH') or os.path.join(os.path.dirname(os.path.abspath(__file__)), 'tareas.sqlite3')
+    TAREAS_EN_LINEA = os.environ.get('TAREAS_EN_LINEA', 'False').lower() in ('true', '1')  # Ejecutar en la petición, sin workers
+    TAREAS_TIMEOUT_SEGUNDOS = 300  # Tras este tiempo sin latido una tarea en proceso se considera abandonada
+    TAREAS_LATIDO_SEGUNDOS = 30  # Cada cuánto renueva su latido el worker que ejecuta una tarea
+    TAREAS_BACKOFF_SEGUNDOS = 30  # Espera base entre reintentos (se duplica en cada intento)
+    TAREAS_POLL_SEGUNDOS = 1.0
+    
+    # Instrumentación de peticiones y endpoint /metrics (formato Prometheus)
+    METRICAS_HABILITADAS = os.environ.get('METRICAS_HABILITADAS', 'True').lower() in ('true', '1')
+    METRICAS_TOKEN = os.environ.get('METRICAS_TOKEN')  # /metrics acepta "Authorization: Bearer <token>" o un JWT de admin
+    # Acceso anónimo a /metrics (expone latencias, SQL lento y versiones de modelo): solo desarrollo/testing
+    METRICAS_ANONIMAS = os.environ.get('METRICAS_ANONIMAS', 'False').lower() in ('true', '1')
+    METRICAS_UMBRAL_LENTO_MS = int(os.environ.get('METRICAS_UMBRAL_LENTO_MS') or 1000)  # Log de peticiones lentas
+    
+    # Importar pandas/scikit-learn y cargar el modelo al crear la app (con gunicorn --preload
+    # se hace una vez en el master y los workers comparten la memoria). Por defecto, al primer uso.
+    ML_PRECARGAR = os.environ.get('ML_PRECARGAR', 'False').lower() in ('true', '1')
+    # Fracción más reciente de las solicitudes etiquetadas que no se usa para entrenar y sirve
+    # para evaluar el modelo (ver app/evaluacion.py); 0 = evaluar solo lo que llegue después
+    ML_EVALUACION_FRACCION = float(os.environ.get('ML_EVALUACION_FRACCION') or 0.2)
+    ML_EVALUACION_LOTE = 5000  # Filas por bloque al extraer la ventana de evaluación
+    # Reentrenamiento automático al crear solicitudes: solo si pasó este tiempo desde el último
+    # entrenamiento y hay al menos estas solicitudes etiquetadas nuevas (el endpoint de
+    # entrenamiento no espera). Cada modelo entrenado queda como candidato en sombra.
+    ML_REENTRENO_MIN_SEGUNDOS = int(os.environ.get('ML_REENTRENO_MIN_SEGUNDOS') or 3600)
+    ML_REENTRENO_MIN_NUEVAS = int(os.environ.get('ML_REENTRENO_MIN_NUEVAS') or 200)
+    # Versiones de modelo que se conservan en model_versions además del activo, el candidato y
+    # las anteriores para revertir (que también se limitan a este número)
+    ML_VERSIONES_CONSERVAR = int(os.environ.get('ML_VERSIONES_CONSERVAR') or 5)
+    
+    # Hash de contraseñas (formato de werkzeug: 'scrypt:n:r:p' o 'pbkdf2:sha256:iteraciones').
+    # Al cambiarlo, las contraseñas existentes se re-hashean en el siguiente login correcto.
+    PASSWORD_HASH_METODO = os.environ.get('PASSWORD_HASH_METODO') or 'scrypt:32768:8:1'
+    # Segundos entre escrituras en lote de usuarios.ultima_actividad (0 = escribir en cada login)
+    ACTIVIDAD_INTERVALO_SEGUNDOS = float(os.environ.get('ACTIVIDAD_INTERVALO_SEGUNDOS') or 30)
+    
+    # Control de admisión de operaciones costosas (ver app/admision.py): backend 'memoria' o 'redis'
+    ADMISION_HABILITADA = os.environ.get('ADMISION_HABILITADA', 'True').lower() in ('true', '1')
+    ADMISION_BACKEND = os.environ.get('ADMISION_BACKEND') or 'memoria'
+    ADMISION_REDIS_URL = os.environ.get('ADMISION_REDIS_URL') or 'redis://localhost:6379/0'
+    # Por operación: cubetas (capacidad, tokens por minuto) por usuario y global,
+    # y ejecuciones simultáneas permitidas
+    ADMISION_LIMITES = {
+        'ml.entrenar': {'usuario': (2, 0.2), 'global': (5, 1), 'concurrencia': 1},
+        'ml.procesar': {'usuario': (5, 1), 'global': (20, 5), 'concurrencia': 1},
+        'ml.puntuar': {'concurrencia': 2},
+        'documentos.integridad': {'usuario': (2, 0.2), 'global': (4, 0.5), 'concurrencia': 1},
+        'documentos.subir': {'usuario': (30, 10), 'global': (300, 120), 'concurrencia': 8},
+        'documentos.fragmento': {'concurrencia': 8},
+        'documentos.analizar': {'concurrencia': 4},
+        'documentos.preview': {'concurrencia': 2},  # Generaciones de vistas previas (solo fallos de caché)
+        'documentos.archivar': {'usuario': (2, 0.2), 'concurrencia': 1},
+    }
+    ADMISION_POSPONER_SEGUNDOS = 5  # Espera de una tarea cuyo semáforo está lleno (y Retry-After del 503)
+    ADMISION_CONCURRENCIA_TTL_SEGUNDOS = 1800  # Vencimiento de una plaza en Redis si el proceso muere
+    
     # Configuración de directorios
     @staticmethod
     def init_app(app):
@@ -49,6 +168,7 @@ class DevelopmentConfig(Config):
     """Configuración para desarrollo"""
     DEBUG = True
     TESTING = False
+    METRICAS_ANONIMAS = True
 
 class ProductionConfig(Config):
     """Configuración para producción"""
@@ -58,7 +178,11 @@ class ProductionConfig(Config):
 class TestingConfig(Config):
     """Configuración para testing"""
     TESTING = True
+    METRICAS_ANONIMAS = True
     SQLALCHEMY_DATABASE_URI = 'sqlite:///:memory:'
+    TAREAS_DB_PATH = os.path.join(tempfile.gettempdir(), 'docucontrol_tareas_test.sqlite3')
+    TAREAS_EN_LINEA = True
+    ACTIVIDAD_INTERVALO_SEGUNDOS = 0
 
 # Configuración por defecto
 config = {
@@ -0,0 +1,117 @@
+"""
+Envío de archivos de documentos con peticiones condicionales y por rangos.
+
+- ETag fuerte = Documento.hash_archivo (SHA256 del contenido) y Last-Modified =
+  fecha de subida: If-None-Match / If-Modified-Since responden 304 sin abrir el archivo.
+- Range / If-Range: respuestas 206 parciales (visores de PDF, descargas reanudadas).
+- DESCARGAS_OFFLOAD: 'x-accel' (nginx) o 'x-sendfile' (Apache/lighttpd) entregan los
+  bytes desde el proxy; el worker de Python solo comprueba permisos y cabeceras.
+- Documentos archivados (app/almacenamiento.py): se sirven desde su paquete, siempre
+  por Python; los rangos de un miembro comprimido se resuelven descomprimiendo en flujo.
+"""
+from flask import current_app, request, send_file # type: ignore
+from werkzeug.wsgi import wrap_file # type: ignore
+from datetime import timezone
+from urllib.parse import quote
+from app.trabajos import calcular_hash_archivo
+from app.almacenamiento import archivado, abrir_documento, ruta_fisica
+import os
+
+
+class ArchivoCorrupto(Exception):
+    """El archivo en disco no coincide con el registrado en el documento"""
+
+
+def _cabeceras_cache(respuesta, documento):
+    # Respuesta autenticada: el navegador puede guardarla pero debe revalidar (barato con 304)
+    respuesta.headers['Cache-Control'] = 'private, no-cache'
+    if documento.hash_archivo:
+        respuesta.set_etag(documento.hash_archivo)
+    if documento.fecha_subida:
+        respuesta.last_modified = documento.fecha_subida.replace(tzinfo=timezone.utc)
+    return respuesta
+
+
+def no_modificado(documento):
+    """True si la copia del cliente sigue vigente según If-None-Match o, si no lo envía, If-Modified-Since"""
+    if request.if_none_match:
+        return bool(documento.hash_archivo) and request.if_none_match.contains(documento.hash_archivo)
+    if request.if_modified_since and documento.fecha_subida:
+        # HTTP tiene resolución de segundos
+        subida = documento.fecha_subida.replace(tzinfo=timezone.utc, microsecond=0)
+        return subida <= request.if_modified_since
+    return False
+
+
+def _disposicion(documento, adjunto):
+    tipo = 'attachment' if adjunto else 'inline'
+    return f"{tipo}; filename*=UTF-8''{quote(documento.nombre_original or documento.nombre_archivo)}"
+
+
+def enviar_documento(documento, adjunto=True, verificar_hash=None):
+    """
+    Respuesta con el archivo del documento (200, 206 o 304).
+    Lanza FileNotFoundError si falta el archivo y ArchivoCorrupto si no coincide con lo registrado.
+    """
+    if no_modificado(documento):
+        return _cabeceras_cache(current_app.response_class(status=304), documento)
+    if archivado(documento):
+        return _enviar_archivado(documento, adjunto)
+
+    ruta = ruta_fisica(documento.ruta_archivo)
+    tamano = os.path.getsize(ruta)
+    if documento.tamano_bytes is not None and tamano != documento.tamano_bytes:
+        raise ArchivoCorrupto(f'Tamaño en disco {tamano} distinto del registrado {documento.tamano_bytes}')
+
+    modo = current_app.config['DESCARGAS_OFFLOAD']
+    if modo:
+        respuesta = current_app.response_class(mimetype=documento.tipo_mime or 'application/octet-stream')
+        if modo == 'x-accel':
+            relativa = os.path.relpath(os.path.abspath(ruta), os.path.abspath(current_app.config['UPLOAD_FOLDER']))
+            if relativa.startswith('..'):
+                raise FileNotFoundError(ruta)
+            respuesta.headers['X-Accel-Redirect'] = current_app.config['DESCARGAS_ACCEL_PREFIJO'] + quote(
+                relativa.replace(os.sep, '/'))
+        else:
+            respuesta.headers['X-Sendfile'] = os.path.abspath(ruta)
+        respuesta.headers['Content-Disposition'] = _disposicion(documento, adjunto)
+        return _cabeceras_cache(respuesta, documento)
+
+    respuesta = send_file(
+        ruta,
+        as_attachment=adjunto,
+        download_name=documento.nombre_original,
+        mimetype=documento.tipo_mime,
+        etag=documento.hash_archivo or True,
+        last_modified=documento.fecha_subida,
+        conditional=True
+    )
+    # El SHA256 completo solo se verifica al enviar el archivo entero, no en rangos
+    if verificar_hash is None:
+        verificar_hash = current_app.config['DESCARGAS_VERIFICAR_HASH']
+    if verificar_hash and respuesta.status_code == 200 and documento.hash_archivo:
+        if calcular_hash_archivo(ruta) != documento.hash_archivo:
+            respuesta.close()
+            raise ArchivoCorrupto('El SHA256 del archivo no coincide con el registrado')
+    respuesta.headers['Cache-Control'] = 'private, no-cache'
+    return respuesta
+
+
+def _enviar_archivado(documento, adjunto):
+    """Respuesta (200 o 206) con el contenido leído del paquete; el hash se comprobó al archivar"""
+    archivo = abrir_documento(documento)
+    respuesta = current_app.response_class(
+        wrap_file(request.environ, archivo),
+        mimetype=documento.tipo_mime or 'application/octet-stream',
+        direct_passthrough=True
+    )
+    respuesta.content_length = documento.tamano_bytes
+    respuesta.headers['Content-Disposition'] = _disposicion(documento, adjunto)
+    _cabeceras_cache(respuesta, documento)
+    try:
+        # make_conditional recorta el cuerpo a Range (con seek o leyendo y descartando) y evalúa If-Range
+        return respuesta.make_conditional(request.environ, accept_ranges=True,
+                                          complete_length=documento.tamano_bytes)
+    except Exception:
+        archivo.close()
+        raise
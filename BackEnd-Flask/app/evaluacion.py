@@ -0,0 +1,205 @@
+"""
+Evaluación y deriva del modelo de prioridad sobre una ventana independiente.
+
+Al entrenar, las solicitudes etiquetadas se ordenan por id y la última fracción
+ML_EVALUACION_FRACCION queda fuera del entrenamiento: el artefacto del modelo guarda
+su corte_id y la distribución de referencia de cada característica (histograma sobre
+los cuantiles del conjunto de entrenamiento). La ventana de evaluación son las
+solicitudes con id > corte_id, incluidas las que llegan después del entrenamiento.
+
+La evaluación es incremental y se guarda por versión del modelo
+(model_versions/priority_eval_<version>.json): cada llamada solo extrae y predice las
+solicitudes con id mayor que el último evaluado, y suma sus conteos a la matriz de
+confusión y a los histogramas de la ventana. El resumen (matriz de confusión,
+precisión/recall por clase y PSI por característica) es de tamaño fijo.
+"""
+from flask import current_app # type: ignore
+from app import db
+from app.models import Solicitud
+from datetime import datetime
+import json
+import math
+import os
+
+# Population Stability Index: < 0.1 estable, < 0.25 moderada, si no alta
+UMBRALES_PSI = ((0.1, 'estable'), (0.25, 'moderada'))
+CUANTILES_REFERENCIA = 10
+
+
+def clases_prioridad():
+    return list(Solicitud.__table__.c.prioridad.type.enums)
+
+
+def corte_entrenamiento(fraccion):
+    """Último id de solicitud etiquetada que entra en el entrenamiento (None si no hay datos)"""
+    consulta = db.session.query(Solicitud.id).filter(Solicitud.prioridad.isnot(None))
+    total = consulta.count()
+    if not total:
+        return None
+    n_entrenamiento = max(1, total - int(total * max(0.0, min(fraccion, 0.9))))
+    return consulta.order_by(Solicitud.id).offset(n_entrenamiento - 1).limit(1).scalar()
+
+
+def _bordes(valores):
+    """Bordes interiores de los cuantiles de una columna (los extremos quedan abiertos)"""
+    import numpy as np # type: ignore
+    bordes = np.unique(np.quantile(valores, np.linspace(0, 1, CUANTILES_REFERENCIA + 1))[1:-1])
+    return bordes.tolist()
+
+
+def _histograma(valores, bordes):
+    import numpy as np # type: ignore
+    return np.bincount(np.searchsorted(bordes, valores, side='right'), minlength=len(bordes) + 1).tolist()
+
+
+def referencia_distribuciones(X, codificador):
+    """Histogramas de referencia de cada característica del conjunto de entrenamiento"""
+    import numpy as np # type: ignore
+    referencia = {}
+    for columna in X.columns:
+        valores = X[columna].to_numpy()
+        base = columna[:-len('_encoded')] if columna.endswith('_encoded') else None
+        if base is not None and codificador.ajustado(base):
+            # Categórica: un intervalo por código (incluido el de valores desconocidos)
+            bordes = (np.arange(codificador.num_codigos(base) - 1) + 0.5).tolist()
+        else:
+            bordes = _bordes(valores)
+        referencia[columna] = {'bordes': bordes, 'conteos': _histograma(valores, bordes)}
+    return referencia
+
+
+def psi(referencia, actual, epsilon=1e-4):
+    total_ref, total_act = sum(referencia), sum(actual)
+    if not total_ref or not total_act:
+        return None
+    valor = 0.0
+    for r, a in zip(referencia, actual):
+        p = max(r / total_ref, epsilon)
+        q = max(a / total_act, epsilon)
+        valor += (q - p) * math.log(q / p)
+    return valor
+
+
+def _estado_deriva(valor):
+    if valor is None:
+        return None
+    for umbral, estado in UMBRALES_PSI:
+        if valor < umbral:
+            return estado
+    return 'alta'
+
+
+def _ruta_estado(version):
+    from app import servicio_modelos
+    return os.path.join(servicio_modelos.DIRECTORIO_VERSIONES, f'priority_eval_{version}.json')
+
+
+def _leer_estado(procesador):
+    ruta = _ruta_estado(procesador.version_modelo)
+    try:
+        with open(ruta, encoding='utf-8') as f:
+            estado = json.load(f)
+        if estado.get('version') == procesador.version_modelo:
+            return estado
+    except (OSError, ValueError):
+        pass
+    clases = clases_prioridad()
+    return {
+        'version': procesador.version_modelo,
+        'corte_id': procesador.metadatos_modelo.get('corte_id'),
+        'ultimo_id': procesador.metadatos_modelo.get('corte_id') or 0,
+        'clases': clases,
+        'matriz': [[0] * len(clases) for _ in clases],
+        'evaluadas': 0,
+        'sin_etiqueta': 0,
+        'histogramas': {columna: [0] * (len(ref['bordes']) + 1)
+                        for columna, ref in (procesador.metadatos_modelo.get('referencia') or {}).items()},
+        'actualizado': None
+    }
+
+
+def _guardar_estado(estado):
+    ruta = _ruta_estado(estado['version'])
+    os.makedirs(os.path.dirname(ruta), exist_ok=True)
+    temporal = f'{ruta}.{os.getpid()}.tmp'
+    with open(temporal, 'w', encoding='utf-8') as f:
+        json.dump(estado, f)
+    os.replace(temporal, ruta)
+
+
+def actualizar_evaluacion(procesador, lote=5000):
+    """Evaluar las solicitudes nuevas de la ventana y devolver el estado acumulado de la versión cargada"""
+    import numpy as np # type: ignore
+    estado = _leer_estado(procesador)
+    X, y_real = procesador.extraer_matriz_entrenamiento(lote=lote, desde_id=estado['ultimo_id'])
+    if not len(X):
+        return estado
+
+    indice = {clase: i for i, clase in enumerate(estado['clases'])}
+    etiquetadas = np.array([real in indice for real in y_real], dtype=bool)
+    if etiquetadas.any():
+        predichas = procesador.priority_model.predict(X[etiquetadas])
+        reales = np.array([indice[real] for real in y_real[etiquetadas]])
+        predichas = np.array([indice.get(p, -1) for p in predichas.tolist()])
+        validas = predichas >= 0
+        k = len(estado['clases'])
+        conteos = np.bincount(reales[validas] * k + predichas[validas], minlength=k * k).reshape(k, k)
+        estado['matriz'] = (np.array(estado['matriz']) + conteos).tolist()
+        estado['evaluadas'] += int(etiquetadas.sum())
+    estado['sin_etiqueta'] += int((~etiquetadas).sum())
+
+    referencia = procesador.metadatos_modelo.get('referencia') or {}
+    for columna, ref in referencia.items():
+        if columna in X:
+            nuevos = _histograma(X[columna].to_numpy(), ref['bordes'])
+            estado['histogramas'][columna] = [a + b for a, b in zip(estado['histogramas'][columna], nuevos)]
+
+    estado['ultimo_id'] = int(X.index.max())
+    estado['actualizado'] = datetime.utcnow().isoformat()
+    _guardar_estado(estado)
+    return estado
+
+
+def resumen(estado, referencia):
+    """Agregados compactos: matriz de confusión, métricas por clase y deriva por característica"""
+    clases, matriz = estado['clases'], estado['matriz']
+    por_clase = {}
+    for i, clase in enumerate(clases):
+        aciertos = matriz[i][i]
+        reales = sum(matriz[i])
+        predichas = sum(fila[i] for fila in matriz)
+        por_clase[clase] = {
+            'precision': round(aciertos / predichas, 4) if predichas else None,
+            'recall': round(aciertos / reales, 4) if reales else None,
+            'soporte': reales
+        }
+    total = sum(map(sum, matriz))
+    deriva = {}
+    for columna, ref in referencia.items():
+        valor = psi(ref['conteos'], estado['histogramas'].get(columna, []))
+        deriva[columna] = {'psi': round(valor, 4) if valor is not None else None, 'estado': _estado_deriva(valor)}
+    return {
+        'version_modelo': estado['version'],
+        'ventana': {
+            'desde_id': estado['corte_id'],
+            'hasta_id': estado['ultimo_id'],
+            # Sin corte (modelo anterior a la evaluación) la ventana incluye los datos de entrenamiento
+            'independiente': estado['corte_id'] is not None,
+            'evaluadas': estado['evaluadas'],
+            'sin_etiqueta': estado['sin_etiqueta'],
+            'actualizado': estado['actualizado']
+        },
+        'clases': clases,
+        'matriz_confusion': matriz,
+        'exactitud': round(sum(matriz[i][i] for i in range(len(clases))) / total, 4) if total else None,
+        'por_clase': por_clase,
+        'reales': {clase: sum(matriz[i]) for i, clase in enumerate(clases)},
+        'predichas': {clase: sum(fila[i] for fila in matriz) for i, clase in enumerate(clases)},
+        'deriva': deriva
+    }
+
+
+def evaluar_modelo(procesador):
+    """Actualizar la evaluación de la versión cargada del modelo y devolver su resumen"""
+    estado = actualizar_evaluacion(procesador, current_app.config['ML_EVALUACION_LOTE'])
+    return resumen(estado, procesador.metadatos_modelo.get('referencia') or {})
@@ -0,0 +1,247 @@
+"""
+Pub/sub de eventos de la aplicación (cambios de estado, documentos nuevos, resultados ML).
+
+Los eventos se acumulan en la sesión de SQLAlchemy y solo se publican cuando la
+transacción se confirma (after_commit); si hay rollback se descartan.
+
+Backends:
+- 'memoria': en proceso, sin dependencias (desarrollo, tests, un solo worker)
+- 'redis':   compartido entre workers/servidores (requiere el paquete redis)
+"""
+from flask import current_app # type: ignore
+from sqlalchemy import event # type: ignore
+from app import db
+from collections import defaultdict, deque
+import asyncio
+import itertools
+import json
+import queue
+import threading
+import time
+
+ROLES_PERSONAL = ['administrativo', 'supervisor', 'admin']
+
+# Streams SSE abiertos en este proceso por la vista WSGI (cada uno ocupa un hilo salvo con gevent)
+_streams_abiertos = 0
+_streams_lock = threading.Lock()
+
+
+def abrir_stream(maximo):
+    """Reservar un stream SSE del proceso; False si ya hay `maximo` abiertos (0 = sin límite)"""
+    global _streams_abiertos
+    with _streams_lock:
+        if maximo and _streams_abiertos >= maximo:
+            return False
+        _streams_abiertos += 1
+        return True
+
+
+def cerrar_stream():
+    global _streams_abiertos
+    with _streams_lock:
+        _streams_abiertos -= 1
+
+
+def formatear_evento(evento_id, evento):
+    """Mensaje SSE de un evento"""
+    return f"id: {evento_id}\nevent: {evento['tipo']}\ndata: {json.dumps(evento)}\n\n"
+
+
+def canales_usuario(usuario_id, rol):
+    """Canales a los que se suscribe un usuario: los suyos y, si es personal, el canal común"""
+    canales = [f'usuario:{usuario_id}']
+    if rol in ROLES_PERSONAL:
+        canales.append('personal')
+    return canales
+
+
+class SuscripcionMemoria:
+    """Suscripción a uno o más canales del backend en memoria"""
+
+    def __init__(self, backend, canales, capacidad):
+        self.backend = backend
+        self.canales = set(canales)
+        self._cola = queue.Queue(maxsize=capacidad)
+        self._aviso = None  # (bucle, asyncio.Event) mientras obtener_async() espera
+
+    def _entregar(self, evento_id, evento):
+        try:
+            self._cola.put_nowait((evento_id, evento))
+        except queue.Full:
+            # Cliente lento: se descarta el evento; al reconectar se recupera con Last-Event-ID
+            pass
+        aviso = self._aviso
+        if aviso is not None:
+            aviso[0].call_soon_threadsafe(aviso[1].set)
+
+    def obtener(self, timeout=None):
+        """Esperar el siguiente evento (evento_id, evento) o None si vence el timeout"""
+        try:
+            return self._cola.get(timeout=timeout)
+        except queue.Empty:
+            return None
+
+    async def obtener_async(self, timeout=None):
+        """Como obtener(), pero esperando en el bucle de asyncio (modo ASGI) sin ocupar un hilo"""
+        bucle = asyncio.get_running_loop()
+        aviso = asyncio.Event()
+        self._aviso = (bucle, aviso)
+        try:
+            # Se revisa la cola después de registrar el aviso para no perder una entrega intermedia
+            try:
+                return self._cola.get_nowait()
+            except queue.Empty:
+                pass
+            try:
+                await asyncio.wait_for(aviso.wait(), timeout)
+            except asyncio.TimeoutError:
+                pass
+            try:
+                return self._cola.get_nowait()
+            except queue.Empty:
+                return None
+        finally:
+            self._aviso = None
+
+    def cerrar(self):
+        self.backend._desuscribir(self)
+
+
+class BackendMemoria:
+    """Backend de pub/sub en proceso, con un búfer corto para reconexiones"""
+
+    def __init__(self, historial=1000, capacidad_suscripcion=256):
+        self._lock = threading.Lock()
+        self._suscripciones = defaultdict(set)
+        self._recientes = deque(maxlen=historial)
+        self._ids = itertools.count(1)
+        self._capacidad = capacidad_suscripcion
+
+    def publicar(self, canales, evento):
+        """Publicar un evento en varios canales; cada suscriptor lo recibe una sola vez"""
+        with self._lock:
+            evento_id = next(self._ids)
+            self._recientes.append((evento_id, frozenset(canales), evento))
+            destinos = set()
+            for canal in canales:
+                destinos.update(self._suscripciones.get(canal, ()))
+        for suscripcion in destinos:
+            suscripcion._entregar(evento_id, evento)
+        return evento_id
+
+    def suscribir(self, canales, ultimo_id=None):
+        suscripcion = SuscripcionMemoria(self, canales, self._capacidad)
+        with self._lock:
+            for canal in suscripcion.canales:
+                self._suscripciones[canal].add(suscripcion)
+            if ultimo_id is not None:
+                for evento_id, canales, evento in self._recientes:
+                    if evento_id > ultimo_id and canales & suscripcion.canales:
+                        suscripcion._entregar(evento_id, evento)
+        return suscripcion
+
+    def _desuscribir(self, suscripcion):
+        with self._lock:
+            for canal in suscripcion.canales:
+                suscriptores = self._suscripciones.get(canal)
+                if suscriptores is not None:
+                    suscriptores.discard(suscripcion)
+                    if not suscriptores:
+                        del self._suscripciones[canal]
+
+    def total_suscripciones(self):
+        with self._lock:
+            return len({s for subs in self._suscripciones.values() for s in subs})
+
+
+class SuscripcionRedis:
+    """Suscripción a canales de Redis (una conexión por suscriptor)"""
+
+    def __init__(self, pubsub):
+        self._pubsub = pubsub
+        self._ultimo_id = 0
+
+    def obtener(self, timeout=None):
+        while True:
+            mensaje = self._pubsub.get_message(ignore_subscribe_messages=True, timeout=timeout or 0)
+            if not mensaje:
+                return None
+            datos = json.loads(mensaje['data'])
+            # El mismo evento llega por cada canal suscrito: se entrega una sola vez
+            if datos['id'] > self._ultimo_id:
+                self._ultimo_id = datos['id']
+                return datos['id'], datos['evento']
+
+    async def obtener_async(self, timeout=None, intervalo=0.1):
+        """Lecturas no bloqueantes del socket de Redis intercaladas con esperas de asyncio"""
+        limite = time.monotonic() + (timeout or 0)
+        while True:
+            recibido = self.obtener(timeout=0)
+            if recibido is not None or time.monotonic() >= limite:
+                return recibido
+            await asyncio.sleep(intervalo)
+
+    def cerrar(self):
+        self._pubsub.close()
+
+
+class BackendRedis:
+    """Backend de pub/sub compartido sobre Redis (sin reenvío por Last-Event-ID)"""
+
+    def __init__(self, url, prefijo='docucontrol:eventos:'):
+        import redis # type: ignore
+        self._redis = redis.Redis.from_url(url)
+        self._prefijo = prefijo
+
+    def publicar(self, canales, evento):
+        evento_id = self._redis.incr(f'{self._prefijo}seq')
+        mensaje = json.dumps({'id': evento_id, 'evento': evento})
+        for canal in canales:
+            self._redis.publish(self._prefijo + canal, mensaje)
+        return evento_id
+
+    def suscribir(self, canales, ultimo_id=None):
+        pubsub = self._redis.pubsub()
+        pubsub.subscribe(*[self._prefijo + canal for canal in canales])
+        return SuscripcionRedis(pubsub)
+
+
+BACKENDS = {
+    'memoria': lambda app: BackendMemoria(historial=app.config['EVENTOS_HISTORIAL']),
+    'redis': lambda app: BackendRedis(app.config['EVENTOS_REDIS_URL'])
+}
+
+
+def init_app(app):
+    """Crear el backend configurado y publicar los eventos encolados al confirmar la sesión"""
+    app.extensions['eventos'] = BACKENDS[app.config['EVENTOS_BACKEND']](app)
+    if not event.contains(db.session, 'after_commit', _publicar_pendientes):
+        event.listen(db.session, 'after_commit', _publicar_pendientes)
+        event.listen(db.session, 'after_rollback', _descartar_pendientes)
+
+
+def obtener_backend():
+    return current_app.extensions['eventos']
+
+
+def publicar_al_confirmar(tipo, usuario_id, **datos):
+    """Encolar un evento para publicarlo cuando la transacción actual se confirme"""
+    evento = {'tipo': tipo, 'usuario_id': usuario_id, **datos}
+    db.session.info.setdefault('eventos_pendientes', []).append(evento)
+
+
+def _publicar_pendientes(session):
+    pendientes = session.info.pop('eventos_pendientes', None)
+    if not pendientes:
+        return
+    try:
+        backend = obtener_backend()
+    except (RuntimeError, KeyError):
+        return
+    for evento in pendientes:
+        backend.publicar([f"usuario:{evento['usuario_id']}", 'personal'], evento)
+
+
+def _descartar_pendientes(session):
+    session.info.pop('eventos_pendientes', None)
+
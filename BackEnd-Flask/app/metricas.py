@@ -0,0 +1,243 @@
+"""
+Instrumentación de la API: latencia, consultas SQL, tamaño de respuesta e inferencia ML.
+
+Por cada petición se mide (por blueprint y endpoint):
+- latencia total
+- número y tiempo acumulado de consultas SQL (eventos del engine)
+- bytes de la respuesta
+- tiempo de inferencia ML (medir_inferencia)
+
+Además, por versión del modelo de prioridad: latencia de predicción según su rol
+(activo, candidato, sombra), comparaciones en sombra y el tiempo que el envío a
+sombra añade al camino crítico (ver servicio_modelos).
+
+Los valores se agregan en histogramas en memoria del proceso y se exponen en
+formato de texto de Prometheus (GET /metrics). Las peticiones que superan
+METRICAS_UMBRAL_LENTO_MS se registran en el log 'docucontrol.lentas' junto con
+las sentencias SQL que ejecutaron.
+"""
+from flask import g, request, has_request_context # type: ignore
+from sqlalchemy import event # type: ignore
+from sqlalchemy.engine import Engine # type: ignore
+from bisect import bisect_left
+from contextlib import contextmanager
+import logging
+import threading
+import time
+
+BUCKETS_LATENCIA = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+BUCKETS_CONSULTAS = (0, 1, 2, 5, 10, 20, 50, 100, 200, 500)
+BUCKETS_BYTES = (256, 1024, 4096, 16384, 65536, 262144, 1048576, 4194304, 16777216)
+BUCKETS_SOBRECOSTO = (0.00001, 0.00005, 0.0001, 0.0005, 0.001, 0.005, 0.01)
+
+MAX_SENTENCIAS_POR_PETICION = 100
+
+logger_lentas = logging.getLogger('docucontrol.lentas')
+
+
+class Histograma:
+    """Histograma acumulativo con etiquetas, al estilo de Prometheus"""
+
+    def __init__(self, nombre, ayuda, etiquetas, buckets):
+        self.nombre = nombre
+        self.ayuda = ayuda
+        self.etiquetas = etiquetas
+        self.buckets = buckets
+        self._series = {}
+
+    def observar(self, valores_etiquetas, valor):
+        serie = self._series.get(valores_etiquetas)
+        if serie is None:
+            # [conteos por bucket..., +Inf], suma
+            serie = self._series[valores_etiquetas] = [[0] * (len(self.buckets) + 1), 0.0]
+        serie[0][bisect_left(self.buckets, valor)] += 1
+        serie[1] += valor
+
+    def exportar(self):
+        lineas = [f'# HELP {self.nombre} {self.ayuda}', f'# TYPE {self.nombre} histogram']
+        for valores_etiquetas, (conteos, suma) in sorted(self._series.items()):
+            base = ','.join(f'{k}="{_escapar(v)}"' for k, v in zip(self.etiquetas, valores_etiquetas))
+            acumulado = 0
+            for limite, conteo in zip(self.buckets, conteos):
+                acumulado += conteo
+                lineas.append(f'{self.nombre}_bucket{{{base},le="{limite}"}} {acumulado}')
+            acumulado += conteos[-1]
+            lineas.append(f'{self.nombre}_bucket{{{base},le="+Inf"}} {acumulado}')
+            lineas.append(f'{self.nombre}_sum{{{base}}} {suma}')
+            lineas.append(f'{self.nombre}_count{{{base}}} {acumulado}')
+        return lineas
+
+
+def _escapar(valor):
+    return str(valor).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+class RegistroMetricas:
+    """Histogramas de la aplicación (uno por proceso)"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        etiquetas = ('blueprint', 'endpoint', 'metodo', 'estado')
+        self.latencia = Histograma(
+            'docucontrol_peticion_duracion_segundos', 'Latencia de las peticiones HTTP',
+            etiquetas, BUCKETS_LATENCIA)
+        self.consultas = Histograma(
+            'docucontrol_peticion_consultas_sql', 'Consultas SQL ejecutadas por petición',
+            etiquetas, BUCKETS_CONSULTAS)
+        self.tiempo_sql = Histograma(
+            'docucontrol_peticion_sql_segundos', 'Tiempo en consultas SQL por petición',
+            etiquetas, BUCKETS_LATENCIA)
+        self.bytes_respuesta = Histograma(
+            'docucontrol_respuesta_bytes', 'Tamaño del cuerpo de la respuesta',
+            etiquetas, BUCKETS_BYTES)
+        self.inferencia = Histograma(
+            'docucontrol_inferencia_ml_segundos', 'Tiempo de inferencia/entrenamiento ML por operación',
+            ('operacion',), BUCKETS_LATENCIA)
+        self.inferencia_modelo = Histograma(
+            'docucontrol_modelo_inferencia_segundos', 'Tiempo de predicción por versión de modelo y rol',
+            ('version', 'rol'), BUCKETS_LATENCIA)
+        self.sobrecosto_sombra = Histograma(
+            'docucontrol_sombra_sobrecosto_segundos', 'Tiempo añadido al camino crítico al enviar a sombra',
+            ('origen',), BUCKETS_SOBRECOSTO)
+        self.sombra = {}
+        self.peticiones_lentas = 0
+
+    def registrar_peticion(self, etiquetas, duracion, consultas, tiempo_sql, bytes_respuesta):
+        with self._lock:
+            self.latencia.observar(etiquetas, duracion)
+            self.consultas.observar(etiquetas, consultas)
+            self.tiempo_sql.observar(etiquetas, tiempo_sql)
+            if bytes_respuesta is not None:
+                self.bytes_respuesta.observar(etiquetas, bytes_respuesta)
+
+    def registrar_inferencia(self, operacion, duracion):
+        with self._lock:
+            self.inferencia.observar((operacion,), duracion)
+
+    def registrar_modelo(self, version, rol, duracion):
+        with self._lock:
+            self.inferencia_modelo.observar((str(version), rol), duracion)
+
+    def registrar_sobrecosto_sombra(self, origen, duracion):
+        with self._lock:
+            self.sobrecosto_sombra.observar((origen,), duracion)
+
+    def registrar_sombra(self, version, origen, resultado, cantidad):
+        """
+        origen: 'procesar' (comparado con las reglas) o 'predecir' (con el modelo activo);
+        resultado: comparadas, desacuerdos, descartadas (cola llena) o errores
+        """
+        with self._lock:
+            clave = (str(version), origen, resultado)
+            self.sombra[clave] = self.sombra.get(clave, 0) + cantidad
+
+    def resumen_sombra(self):
+        """{version: {origen: {resultado: cantidad}}} de las comparaciones en sombra de este proceso"""
+        with self._lock:
+            resumen = {}
+            for (version, origen, resultado), cantidad in self.sombra.items():
+                resumen.setdefault(version, {}).setdefault(origen, {})[resultado] = cantidad
+            return resumen
+
+    def exportar(self):
+        """Texto en formato de exposición de Prometheus"""
+        with self._lock:
+            lineas = []
+            for histograma in (self.latencia, self.consultas, self.tiempo_sql,
+                               self.bytes_respuesta, self.inferencia, self.inferencia_modelo,
+                               self.sobrecosto_sombra):
+                lineas.extend(histograma.exportar())
+            lineas.append('# HELP docucontrol_sombra_total Predicciones del modelo candidato en sombra')
+            lineas.append('# TYPE docucontrol_sombra_total counter')
+            for (version, origen, resultado), cantidad in sorted(self.sombra.items()):
+                lineas.append(f'docucontrol_sombra_total{{version="{_escapar(version)}",origen="{origen}",'
+                              f'resultado="{resultado}"}} {cantidad}')
+            lineas.append('# HELP docucontrol_peticiones_lentas_total Peticiones por encima del umbral de lentitud')
+            lineas.append('# TYPE docucontrol_peticiones_lentas_total counter')
+            lineas.append(f'docucontrol_peticiones_lentas_total {self.peticiones_lentas}')
+        return '\n'.join(lineas) + '\n'
+
+
+registro = RegistroMetricas()
+
+
+@contextmanager
+def medir_inferencia(operacion):
+    """Medir una operación de ML (predicción, análisis, entrenamiento); sirve también como decorador"""
+    inicio = time.perf_counter()
+    try:
+        yield
+    finally:
+        duracion = time.perf_counter() - inicio
+        registro.registrar_inferencia(operacion, duracion)
+        if has_request_context() and hasattr(g, '_metricas'):
+            g._metricas['tiempo_ml'] += duracion
+
+
+def _antes_de_consulta(conn, cursor, statement, parameters, context, executemany):
+    if has_request_context() and hasattr(g, '_metricas'):
+        conn.info.setdefault('_metricas_inicio', []).append(time.perf_counter())
+
+
+def _despues_de_consulta(conn, cursor, statement, parameters, context, executemany):
+    if not (has_request_context() and hasattr(g, '_metricas')):
+        return
+    inicios = conn.info.get('_metricas_inicio')
+    if not inicios:
+        return
+    duracion = time.perf_counter() - inicios.pop()
+    metricas = g._metricas
+    metricas['consultas'] += 1
+    metricas['tiempo_sql'] += duracion
+    if len(metricas['sentencias']) < MAX_SENTENCIAS_POR_PETICION:
+        metricas['sentencias'].append((duracion, statement))
+
+
+def _error_de_consulta(contexto):
+    inicios = contexto.connection.info.get('_metricas_inicio') if contexto.connection is not None else None
+    if inicios:
+        inicios.pop()
+
+
+def _iniciar_peticion():
+    g._metricas = {'inicio': time.perf_counter(), 'consultas': 0, 'tiempo_sql': 0.0,
+                   'tiempo_ml': 0.0, 'sentencias': []}
+
+
+def _finalizar_peticion(app, response):
+    metricas = g.pop('_metricas', None)
+    if metricas is None:
+        return response
+    duracion = time.perf_counter() - metricas['inicio']
+    etiquetas = (request.blueprint or '', request.endpoint or 'sin_ruta', request.method,
+                 str(response.status_code))
+    # En streaming solo se conoce el tamaño si viene en Content-Length (archivos sí, SSE no)
+    bytes_respuesta = response.content_length if response.is_streamed else response.calculate_content_length()
+    registro.registrar_peticion(etiquetas, duracion, metricas['consultas'], metricas['tiempo_sql'],
+                                bytes_respuesta)
+
+    if duracion * 1000 >= app.config['METRICAS_UMBRAL_LENTO_MS']:
+        with registro._lock:
+            registro.peticiones_lentas += 1
+        sentencias = '\n'.join(f'  [{d * 1000:.1f} ms] {s}' for d, s in metricas['sentencias'])
+        logger_lentas.warning(
+            f'Petición lenta {request.method} {request.path} ({etiquetas[1]}) -> {response.status_code}: '
+            f'{duracion * 1000:.1f} ms, {metricas["consultas"]} consultas '
+            f'({metricas["tiempo_sql"] * 1000:.1f} ms SQL), ML {metricas["tiempo_ml"] * 1000:.1f} ms, '
+            f'{bytes_respuesta if bytes_respuesta is not None else "?"} bytes\n{sentencias}'
+        )
+    return response
+
+
+def init_app(app):
+    """Instrumentar las peticiones de la app y los engines de SQLAlchemy"""
+    if not app.config['METRICAS_HABILITADAS']:
+        return
+    if not event.contains(Engine, 'before_cursor_execute', _antes_de_consulta):
+        event.listen(Engine, 'before_cursor_execute', _antes_de_consulta)
+        event.listen(Engine, 'after_cursor_execute', _despues_de_consulta)
+        event.listen(Engine, 'handle_error', _error_de_consulta)
+    if not logger_lentas.handlers and not logging.getLogger().handlers:
+        logger_lentas.addHandler(logging.StreamHandler())
+    app.before_request(_iniciar_peticion)
+    app.after_request(lambda response: _finalizar_peticion(app, response))
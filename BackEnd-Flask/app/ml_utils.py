@@ -1,23 +1,164 @@
-import pandas as pd # type: ignore
-import numpy as np # type: ignore
-from sklearn.ensemble import RandomForestClassifier # type: ignore
-from sklearn.preprocessing import LabelEncoder # type: ignore
+# pandas, scikit-learn y joblib se importan dentro de los métodos que los usan:
+# importarlos aquí cuesta segundos y memoria en cada worker aunque no atienda ML
 from datetime import datetime, timedelta
 import json
-import joblib # type: ignore
 from app import db
 from app.models import Solicitud, Tramite, Usuario, Documento
+from app.metricas import medir_inferencia
+from app.replicas import leer_de_replica
+from app.evaluacion import corte_entrenamiento, referencia_distribuciones, evaluar_modelo
+from app import servicio_modelos
+import threading
+
+# Columnas de entrenamiento del modelo de prioridad, en el orden en que se ajusta
+COLUMNAS_ENTRENAMIENTO = [
+    'dias_desde_solicitud', 'dias_hasta_limite', 'costo_tramite', 'tiempo_estimado',
+    'num_documentos', 'urgencia_score', 'categoria_tramite_encoded', 'rol_usuario_encoded'
+]
+COLUMNAS_CATEGORICAS = ['categoria_tramite', 'rol_usuario']
+DESCONOCIDO = 0  # Código de los valores no vistos al ajustar (y de los nulos)
+
+
+def consulta_entrenamiento(solo_etiquetadas=False, desde_id=None, hasta_id=None):
+    """
+    Una fila plana por solicitud con el número de documentos agregado en la base
+    (como vista_pendientes_ml): sin cargar objetos del ORM ni una consulta por solicitud.
+    desde_id (excluido) y hasta_id (incluido) acotan el rango de ids.
+    """
+    documentos = db.session.query(
+        Documento.solicitud_id, db.func.count(Documento.id).label('num_documentos')
+    ).group_by(Documento.solicitud_id).subquery()
+    consulta = db.session.query(
+        Solicitud.id, Solicitud.fecha_solicitud, Solicitud.fecha_limite,
+        Tramite.categoria, db.func.coalesce(Tramite.costo, 0), db.func.coalesce(Tramite.tiempo_estimado_dias, 0),
+        Usuario.rol, db.func.coalesce(documentos.c.num_documentos, 0), Solicitud.prioridad
+    ).join(Tramite, Solicitud.tramite_id == Tramite.id) \
+     .join(Usuario, Solicitud.usuario_id == Usuario.id) \
+     .outerjoin(documentos, documentos.c.solicitud_id == Solicitud.id)
+    if solo_etiquetadas:
+        consulta = consulta.filter(Solicitud.prioridad.isnot(None))
+    if desde_id is not None:
+        consulta = consulta.filter(Solicitud.id > desde_id)
+    if hasta_id is not None:
+        consulta = consulta.filter(Solicitud.id <= hasta_id)
+    return consulta.order_by(Solicitud.id)
+
+
+class _BufferColumnas:
+    """Columnas NumPy que crecen por duplicación al agregar bloques de filas"""
+
+    def __init__(self, tipos, capacidad):
+        import numpy as np # type: ignore
+        self.columnas = {nombre: np.empty(capacidad, dtype=tipo) for nombre, tipo in tipos.items()}
+        self.n = 0
+
+    def agregar(self, bloque):
+        import numpy as np # type: ignore
+        cantidad = len(next(iter(bloque.values())))
+        capacidad = len(next(iter(self.columnas.values())))
+        if self.n + cantidad > capacidad:
+            capacidad = max(capacidad * 2, self.n + cantidad)
+            for nombre, columna in self.columnas.items():
+                nueva = np.empty(capacidad, dtype=columna.dtype)
+                nueva[:self.n] = columna[:self.n]
+                self.columnas[nombre] = nueva
+        for nombre, valores in bloque.items():
+            self.columnas[nombre][self.n:self.n + cantidad] = valores
+        self.n += cantidad
+
+    def recortar(self):
+        """Columnas con exactamente n filas (copia una columna a la vez para no duplicar la matriz)"""
+        for nombre in list(self.columnas):
+            self.columnas[nombre] = self.columnas[nombre][:self.n].copy()
+        return self.columnas
+
+
+class CodificadorCategorias:
+    """
+    Codificación de las columnas categóricas, ajustada al entrenar y guardada con el modelo.
+
+    Cada valor visto al ajustar recibe un código fijo (1..k, en orden alfabético) y los
+    valores nuevos o nulos van a DESCONOCIDO. La transformación toma los códigos de
+    pd.Categorical sobre las clases ajustadas (una búsqueda hash por fila) y añade las
+    columnas <columna>_encoded sin reescribir los valores originales.
+
+    Los artefactos anteriores guardaban LabelEncoder (códigos 0..k-1, los valores nuevos
+    iban a la primera clase): desde_label_encoders conserva esa numeración.
+    """
+
+    def __init__(self, columnas=COLUMNAS_CATEGORICAS, desplazamiento=1):
+        self.columnas = list(columnas)
+        self.desplazamiento = desplazamiento
+        self.clases = {}
+        self._tipos = {}
+
+    def __getstate__(self):
+        # Solo las clases: los tipos de pandas se reconstruyen al cargar
+        return {'columnas': self.columnas, 'desplazamiento': self.desplazamiento, 'clases': self.clases}
+
+    def __setstate__(self, estado):
+        self.__init__(estado['columnas'], estado['desplazamiento'])
+        self.clases = estado['clases']
+
+    @classmethod
+    def desde_label_encoders(cls, encoders):
+        codificador = cls(list(encoders), desplazamiento=0)
+        codificador.clases = {columna: encoder.classes_.tolist() for columna, encoder in encoders.items()}
+        return codificador
+
+    def ajustado(self, columna):
+        return columna in self.clases
+
+    def num_codigos(self, columna):
+        """Códigos posibles de la columna, incluido DESCONOCIDO"""
+        return len(self.clases.get(columna, ())) + self.desplazamiento
+
+    def ajustar(self, columna, valores):
+        import pandas as pd # type: ignore
+        self.clases[columna] = sorted(pd.unique(pd.Series(valores, dtype=object).dropna()).tolist())
+        self._tipos.pop(columna, None)
+
+    def codificar(self, columna, valores):
+        """Códigos int64 de los valores (DESCONOCIDO si no se vieron al ajustar)"""
+        import numpy as np # type: ignore
+        import pandas as pd # type: ignore
+        if columna not in self.clases:
+            return np.full(len(valores), DESCONOCIDO, dtype=np.int64)
+        tipo = self._tipos.get(columna)
+        if tipo is None:
+            tipo = self._tipos[columna] = pd.CategoricalDtype(pd.Index(self.clases[columna], dtype=object))
+        codigos = np.asarray(pd.Categorical(np.asarray(valores, dtype=object), dtype=tipo).codes, dtype=np.int64)
+        return np.where(codigos < 0, DESCONOCIDO, codigos + self.desplazamiento)
+
+    def transformar(self, df, ajustar=True):
+        """Añadir <columna>_encoded a df (con ajustar, las columnas sin clases se ajustan con estos datos)"""
+        for columna in self.columnas:
+            if ajustar and columna not in self.clases:
+                self.ajustar(columna, df[columna])
+            df[f'{columna}_encoded'] = self.codificar(columna, df[columna])
+        return df
+
 
 class SolicitudMLProcessor:
     """Procesador de Machine Learning para solicitudes"""
     
     def __init__(self):
         self.priority_model = None
-        self.label_encoders = {}
+        self.codificador = CodificadorCategorias()
         self.is_trained = False
+        # Versión del modelo cargado y sus metadatos de evaluación (corte_id, referencia)
+        self.version_modelo = None
+        self.metadatos_modelo = {}
+        # Candidato del manifiesto (otro SolicitudMLProcessor) y su modo (ver app/servicio_modelos.py)
+        self.candidato = None
+        self.candidato_config = None
+        self._manifiesto_firma = None
+        self._manifiesto_revisar = 0
+        self._manifiesto_lock = threading.Lock()
     
     def prepare_features(self, solicitudes_data):
         """Preparar características para el modelo ML (acepta dict plano o anidado)"""
+        import pandas as pd # type: ignore
         features = []
         for solicitud in solicitudes_data:
             # Soporta tanto dict plano como dict anidado
@@ -49,28 +190,13 @@ class SolicitudMLProcessor:
             })
         return pd.DataFrame(features)
     
-    def encode_categorical_features(self, df):
-        """Codificar características categóricas"""
-        categorical_columns = ['categoria_tramite', 'rol_usuario']
-        
-        for column in categorical_columns:
-            if column not in self.label_encoders:
-                self.label_encoders[column] = LabelEncoder()
-                df[column + '_encoded'] = self.label_encoders[column].fit_transform(df[column])
-            else:
-                # Para nuevas categorías no vistas, asignar valor por defecto
-                unique_values = df[column].unique()
-                known_values = self.label_encoders[column].classes_
-                
-                # Manejar valores nuevos
-                for value in unique_values:
-                    if value not in known_values:
-                        # Asignar a la categoría más común
-                        df.loc[df[column] == value, column] = known_values[0]
-                
-                df[column + '_encoded'] = self.label_encoders[column].transform(df[column])
-        
-        return df
+    def encode_categorical_features(self, df, ajustar=False):
+        """
+        Codificar características categóricas (los valores no vistos van a DESCONOCIDO).
+        Solo el entrenamiento pasa ajustar=True: al puntuar, el codificador global no debe
+        quedar ajustado con el primer lote que llega.
+        """
+        return self.codificador.transformar(df, ajustar=ajustar)
     
     def calculate_priority_score(self, features_df):
         """Calcular puntuación de prioridad basada en reglas de negocio"""
@@ -130,6 +256,7 @@ class SolicitudMLProcessor:
         else:
             return 'baja'
     
+    @medir_inferencia('prioridad.procesar')
     def process_solicitudes(self, solicitudes_data):
         """Procesar solicitudes con ML y reglas de negocio"""
         if not solicitudes_data:
@@ -153,6 +280,7 @@ class SolicitudMLProcessor:
                 'solicitud_id': solicitud['id'],
                 'puntuacion_ml': round(score, 2),
                 'prioridad_ml': priority_level,
+                'modelo': 'reglas',
                 'factores': {
                     'urgencia_temporal': features_df.iloc[i]['urgencia_score'],
                     'categoria_tramite': features_df.iloc[i]['categoria_tramite'],
@@ -161,92 +289,145 @@ class SolicitudMLProcessor:
                 }
             })
         
-        return results
+        # El candidato del manifiesto, si lo hay, sirve su fracción (ab) o se compara en sombra
+        servicio_modelos.sincronizar(self)
+        return servicio_modelos.servir_lote(self, solicitudes_data, results)
 
+    @medir_inferencia('prioridad.entrenar')
+    @leer_de_replica()
     def train_priority_model_from_db(self):
         """Entrenar modelo ML usando datos históricos de la base de datos y guardar el modelo versionado en model_versions"""
         import os
         from datetime import datetime
-        # Obtener solicitudes con prioridad real y datos completos
-        solicitudes = (
-            db.session.query(Solicitud)
-            .filter(Solicitud.prioridad.isnot(None))
-            .all()
-        )
-        if not solicitudes:
+        from sklearn.ensemble import RandomForestClassifier # type: ignore
+        import joblib # type: ignore
+        from flask import current_app # type: ignore
+        # Las solicitudes etiquetadas más recientes quedan fuera para evaluar (ver app/evaluacion.py)
+        corte_id = corte_entrenamiento(current_app.config['ML_EVALUACION_FRACCION'])
+        if corte_id is None:
+            return {'status': 'error', 'message': 'No hay datos suficientes para entrenar.'}
+        # Solicitudes con prioridad real, extraídas por bloques directamente a columnas NumPy;
+        # el codificador se ajusta de nuevo con su vocabulario
+        self.codificador = CodificadorCategorias()
+        X, y = self.extraer_matriz_entrenamiento(solo_etiquetadas=True, hasta_id=corte_id)
+        if not len(y):
             return {'status': 'error', 'message': 'No hay datos suficientes para entrenar.'}
-
-        # Preparar datos para entrenamiento
-        data = []
-        for s in solicitudes:
-            tramite = s.tramite
-            usuario = s.usuario
-            documentos = s.documentos
-            data.append({
-                'id': s.id,
-                'fecha_solicitud': s.fecha_solicitud,
-                'fecha_limite': s.fecha_limite,
-                'tramite': {
-                    'categoria': tramite.categoria,
-                    'costo': float(tramite.costo),
-                    'tiempo_estimado_dias': tramite.tiempo_estimado_dias
-                },
-                'usuario': {
-                    'rol': usuario.rol
-                },
-                'documentos': documentos,
-                'prioridad': s.prioridad
-            })
-        df = self.prepare_features(data)
-        df = self.encode_categorical_features(df)
-        X = df[
-            [
-                'dias_desde_solicitud', 'dias_hasta_limite', 'costo_tramite', 'tiempo_estimado',
-                'num_documentos', 'urgencia_score', 'categoria_tramite_encoded', 'rol_usuario_encoded'
-            ]
-        ]
-        y = [d['prioridad'] for d in data]
         # Entrenar modelo
         model = RandomForestClassifier(n_estimators=100, random_state=42)
         model.fit(X, y)
         self.priority_model = model
         self.is_trained = True
         # Guardar modelo y encoders versionados
-        version_dir = os.path.join(os.path.dirname(__file__), '..', 'model_versions')
+        version_dir = servicio_modelos.DIRECTORIO_VERSIONES
         os.makedirs(version_dir, exist_ok=True)
         timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
         model_path = os.path.join(version_dir, f'priority_model_{timestamp}.joblib')
         encoders_path = os.path.join(version_dir, f'priority_label_encoders_{timestamp}.joblib')
-        joblib.dump({'model': model, 'encoders': self.label_encoders}, model_path)
-        joblib.dump(self.label_encoders, encoders_path)
+        self.version_modelo = timestamp
+        self.metadatos_modelo = {
+            'corte_id': corte_id,
+            'n_entrenamiento': len(y),
+            'referencia': referencia_distribuciones(X, self.codificador)
+        }
+        artefacto = {'model': model, 'codificador': self.codificador, 'version': timestamp, **self.metadatos_modelo}
+        joblib.dump(artefacto, model_path)
+        joblib.dump(self.codificador, encoders_path)
         # También guardar/actualizar el modelo actual para carga rápida
-        joblib.dump({'model': model, 'encoders': self.label_encoders}, 'priority_model.joblib')
-        joblib.dump(self.label_encoders, 'priority_label_encoders.joblib')
+        joblib.dump(artefacto, 'priority_model.joblib')
+        joblib.dump(self.codificador, 'priority_label_encoders.joblib')
         return {'status': 'ok', 'message': f'Modelo entrenado y guardado en {model_path}', 'n_samples': len(y)}
 
+    @leer_de_replica()
     def extract_training_data(self):
-        """Extraer datos de la base de datos para entrenamiento ML (joins explícitos)"""
-        solicitudes = db.session.query(Solicitud, Tramite, Usuario) \
-            .join(Tramite, Solicitud.tramite_id == Tramite.id) \
-            .join(Usuario, Solicitud.usuario_id == Usuario.id) \
-            .all()
-        data = []
-        for s, tramite, usuario in solicitudes:
-            documentos = s.documentos
-            data.append({
-                'fecha_solicitud': s.fecha_solicitud,
-                'fecha_limite': s.fecha_limite,
-                'categoria_tramite': tramite.categoria,
-                'costo_tramite': float(tramite.costo),
-                'tiempo_estimado_dias': tramite.tiempo_estimado_dias,
-                'rol_usuario': usuario.rol,
-                'num_documentos': len(documentos),
-                'prioridad': s.prioridad
+        """Extraer datos de la base de datos para entrenamiento ML (una consulta agregada, leída de una réplica)"""
+        return [{
+            'fecha_solicitud': fila[1],
+            'fecha_limite': fila[2],
+            'categoria_tramite': fila[3],
+            'costo_tramite': float(fila[4]),
+            'tiempo_estimado_dias': fila[5],
+            'rol_usuario': fila[6],
+            'num_documentos': fila[7],
+            'prioridad': fila[8]
+        } for fila in consulta_entrenamiento()]
+
+    def _codificar_vocabulario(self, columna, vocabulario, codigos):
+        """
+        Pasar los códigos por orden de aparición de una columna categórica a los del
+        codificador (mismo criterio que encode_categorical_features(ajustar=True): se ajusta
+        si no lo está; con uno ya ajustado, los valores nuevos van a DESCONOCIDO).
+        """
+        import numpy as np # type: ignore
+        valores = list(vocabulario)
+        if not valores:
+            return codigos.astype(np.int64)
+        if not self.codificador.ajustado(columna):
+            self.codificador.ajustar(columna, valores)
+        return self.codificador.codificar(columna, valores)[codigos]
+
+    @leer_de_replica()
+    def extraer_matriz_entrenamiento(self, solo_etiquetadas=False, lote=5000, desde_id=None, hasta_id=None):
+        """
+        Matriz de entrenamiento (DataFrame con COLUMNAS_ENTRENAMIENTO, indexado por id de
+        solicitud) y etiquetas (prioridad) leyendo consulta_entrenamiento() por bloques de
+        `lote` filas (cursor del servidor con yield_per). Cada bloque se convierte a columnas
+        NumPy y se descarta: la memoria es proporcional a la matriz de características, no a
+        los objetos del ORM.
+        """
+        import numpy as np # type: ignore
+        import pandas as pd # type: ignore
+        ahora = np.datetime64(datetime.now(), 'us')
+        dia = np.timedelta64(1, 'D')
+        buffer = _BufferColumnas({
+            'id': np.int64, 'dias_desde_solicitud': np.int64, 'dias_hasta_limite': np.int64, 'costo_tramite': np.float64,
+            'tiempo_estimado': np.int64, 'num_documentos': np.int64, 'urgencia_score': np.int64,
+            'categoria_tramite': np.int32, 'rol_usuario': np.int32, 'prioridad': np.int32
+        }, lote)
+        vocabularios = {'categoria_tramite': {}, 'rol_usuario': {}, 'prioridad': {}}
+
+        def codigos(columna, valores):
+            vocabulario = vocabularios[columna]
+            return np.fromiter((vocabulario.setdefault(v, len(vocabulario)) for v in valores), np.int32, len(valores))
+
+        consulta = consulta_entrenamiento(solo_etiquetadas, desde_id, hasta_id)
+        resultado = db.session.execute(consulta.statement.execution_options(yield_per=lote))
+        for filas in resultado.partitions():
+            ids, fechas, limites, categorias, costos, tiempos, roles, documentos, prioridades = zip(*filas)
+            fechas = np.array(fechas, dtype='datetime64[us]')
+            limites = np.array(limites, dtype='datetime64[us]')
+            # Misma semántica que prepare_features: días enteros hacia abajo, 0 y 30 si falta la fecha
+            desde = np.where(np.isnat(fechas), 0, (ahora - fechas) // dia)
+            hasta = np.where(np.isnat(limites), 30, (limites - ahora) // dia)
+            buffer.agregar({
+                'id': np.array(ids, dtype=np.int64),
+                'dias_desde_solicitud': desde,
+                'dias_hasta_limite': hasta,
+                'costo_tramite': np.array(costos, dtype=np.float64),
+                'tiempo_estimado': np.array(tiempos, dtype=np.int64),
+                'num_documentos': np.array(documentos, dtype=np.int64),
+                'urgencia_score': np.where(hasta > 0, np.maximum(0, 10 - hasta), 10),
+                'categoria_tramite': codigos('categoria_tramite', categorias),
+                'rol_usuario': codigos('rol_usuario', roles),
+                'prioridad': codigos('prioridad', prioridades)
             })
-        return data
+        resultado.close()
+
+        columnas = buffer.recortar()
+        columnas['categoria_tramite_encoded'] = self._codificar_vocabulario(
+            'categoria_tramite', vocabularios['categoria_tramite'], columnas.pop('categoria_tramite'))
+        columnas['rol_usuario_encoded'] = self._codificar_vocabulario(
+            'rol_usuario', vocabularios['rol_usuario'], columnas.pop('rol_usuario'))
+        etiquetas = np.array(list(vocabularios['prioridad']), dtype=object)[columnas.pop('prioridad')] \
+            if vocabularios['prioridad'] else np.empty(0, dtype=object)
+        X = pd.DataFrame({nombre: columnas[nombre] for nombre in COLUMNAS_ENTRENAMIENTO},
+                         index=pd.Index(columnas['id'], name='id'), copy=False)
+        return X, etiquetas
 
     def train_priority_model(self, save_path='priority_model.joblib'):
         """Entrenar modelo ML de prioridad y guardar a disco"""
+        import pandas as pd # type: ignore
+        from sklearn.ensemble import RandomForestClassifier # type: ignore
+        import joblib # type: ignore
         data = self.extract_training_data()
         if not data:
             return False, 'No hay datos para entrenar.'
@@ -254,10 +435,10 @@ class SolicitudMLProcessor:
         X = df.drop('prioridad', axis=1)
         y = df['prioridad']
         # Codificar categóricos
-        for col in ['categoria_tramite', 'rol_usuario']:
-            le = LabelEncoder()
-            X[col] = le.fit_transform(X[col])
-            self.label_encoders[col] = le
+        self.codificador = CodificadorCategorias()
+        for col in COLUMNAS_CATEGORICAS:
+            self.codificador.ajustar(col, X[col])
+            X[col] = self.codificador.codificar(col, X[col])
         # Rellenar nulos
         X = X.fillna(0)
         # Entrenar modelo
@@ -266,65 +447,59 @@ class SolicitudMLProcessor:
         self.priority_model = model
         self.is_trained = True
         # Guardar modelo y encoders
-        joblib.dump({'model': model, 'encoders': self.label_encoders}, save_path)
+        joblib.dump({'model': model, 'codificador': self.codificador}, save_path)
         return True, f'Modelo entrenado y guardado en {save_path}'
 
     def load_priority_model(self, path=None):
-        """Cargar el modelo ML de prioridad más reciente desde model_versions o el path dado"""
+        """Cargar el modelo ML de prioridad activo del manifiesto (o el más reciente de model_versions) o el path dado"""
         import os
-        import glob
+        import joblib # type: ignore
         if path is None:
-            version_dir = os.path.join(os.path.dirname(__file__), '..', 'model_versions')
-            model_files = sorted(glob.glob(os.path.join(version_dir, 'priority_model_*.joblib')))
-            if model_files:
-                path = model_files[-1]  # El más reciente
+            version = servicio_modelos.version_activa()
+            if version:
+                path = servicio_modelos.ruta_version(version)
             else:
                 path = 'priority_model.joblib'  # Fallback
         obj = joblib.load(path)
         self.priority_model = obj['model']
-        self.label_encoders = obj['encoders']
+        self.codificador = obj.get('codificador') or CodificadorCategorias.desde_label_encoders(obj['encoders'])
+        # Los artefactos anteriores a la evaluación no traen versión: se deriva del archivo
+        self.version_modelo = obj.get('version') or servicio_modelos.version_de_ruta(path) or \
+            f"{os.path.splitext(os.path.basename(path))[0]}-{int(os.path.getmtime(path))}"
+        self.metadatos_modelo = {clave: obj.get(clave) for clave in ('corte_id', 'n_entrenamiento', 'referencia')}
         self.is_trained = True
 
+    @medir_inferencia('prioridad.predecir')
     def predict_priority(self, solicitudes_data):
-        """Predecir prioridad ML para nuevas solicitudes"""
+        """Predecir prioridad ML para nuevas solicitudes con el modelo activo (y el candidato en sombra o A/B)"""
         if not self.is_trained:
             self.load_priority_model()
-        features_df = self.prepare_features(solicitudes_data)
-        # Codificar categóricos
-        for col in ['categoria_tramite', 'rol_usuario']:
-            le = self.label_encoders.get(col)
-            if le:
-                features_df[col] = le.transform(features_df[col].fillna(le.classes_[0]))
-            else:
-                features_df[col] = 0
-        X = features_df[['dias_desde_solicitud', 'dias_hasta_limite', 'categoria_tramite', 'costo_tramite', 'tiempo_estimado', 'rol_usuario', 'num_documentos', 'urgencia_score']]
-        # Si hay columnas categóricas codificadas, usarlas
-        for col in ['categoria_tramite', 'rol_usuario']:
-            if col in features_df:
-                X[col] = features_df[col]
+        servicio_modelos.sincronizar(self)
+        return servicio_modelos.servir_prediccion(self, solicitudes_data)
+
+    def _predecir(self, solicitudes_data):
+        """Predicción con el modelo cargado en este procesador"""
+        # Codificador del modelo, sin reajustar: los valores no vistos van a DESCONOCIDO
+        features_df = self.codificador.transformar(self.prepare_features(solicitudes_data), ajustar=False)
+        # Columnas en el orden con que se ajustó el modelo (los entrenados desde la base usan COLUMNAS_ENTRENAMIENTO)
+        columnas = getattr(self.priority_model, 'feature_names_in_', None)
+        if columnas is None:
+            columnas = ['dias_desde_solicitud', 'dias_hasta_limite', 'categoria_tramite', 'costo_tramite', 'tiempo_estimado', 'rol_usuario', 'num_documentos', 'urgencia_score']
+        # Los modelos anteriores usan los nombres sin sufijo para las columnas codificadas
+        for col in COLUMNAS_CATEGORICAS:
+            if col in columnas:
+                features_df[col] = features_df[f'{col}_encoded']
+        X = features_df[list(columnas)]
         preds = self.priority_model.predict(X)
         return preds
 
+    @medir_inferencia('prioridad.comparar')
     def get_priority_comparison_data(self):
-        """Obtener datos para comparar prioridad real vs. predicha (pipeline igual que entrenamiento)"""
-        data = self.extract_training_data()
-        if not data:
-            return []
-        features_df = self.prepare_features(data)
-        features_df = self.encode_categorical_features(features_df)
-        X = features_df[
-            [
-                'dias_desde_solicitud', 'dias_hasta_limite', 'costo_tramite', 'tiempo_estimado',
-                'num_documentos', 'urgencia_score', 'categoria_tramite_encoded', 'rol_usuario_encoded'
-            ]
-        ]
-        y_real = [d['prioridad'] for d in data]
+        """Matriz de confusión, precisión/recall por clase y deriva del modelo activo en su ventana de evaluación"""
         if not self.is_trained:
             self.load_priority_model()
-        y_pred = self.priority_model.predict(X)
-        features_df['prioridad'] = y_real
-        features_df['prioridad_predicha'] = y_pred
-        return features_df[['prioridad', 'prioridad_predicha']].to_dict(orient='records')
+        servicio_modelos.sincronizar(self)
+        return evaluar_modelo(self)
 
 class DocumentMLProcessor:
     """Procesador de ML para análisis de documentos"""
@@ -336,6 +511,7 @@ class DocumentMLProcessor:
             'memoria_descriptiva', 'estudio_suelos', 'declaracion_jurada'
         ]
     
+    @medir_inferencia('documentos.analizar')
     def analyze_document(self, document_info):
         """Analizar documento y detectar tipo automáticamente"""
         filename = document_info.get('nombre_original', '').lower()
@@ -424,3 +600,14 @@ class DocumentMLProcessor:
 # Instancias globales de los procesadores
 solicitud_processor = SolicitudMLProcessor()
 document_processor = DocumentMLProcessor()
+
+def precargar():
+    """Importar la pila de ML y cargar el modelo de antemano (p. ej. en el master de gunicorn con --preload)"""
+    import pandas # type: ignore # noqa: F401
+    import sklearn.ensemble # type: ignore # noqa: F401
+    import sklearn.preprocessing # type: ignore # noqa: F401
+    import joblib # type: ignore # noqa: F401
+    try:
+        solicitud_processor.load_priority_model()
+    except Exception as e:
+        print(f'No se pudo cargar el modelo ML al precargar: {e}')
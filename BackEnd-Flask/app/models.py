@@ -1,7 +1,73 @@
 from app import db
 from datetime import datetime
 from werkzeug.security import generate_password_hash, check_password_hash
+from flask import current_app, has_app_context # type: ignore
+from functools import lru_cache
+from sqlalchemy import types # type: ignore
+from sqlalchemy.ext.compiler import compiles # type: ignore
+from sqlalchemy.sql import expression # type: ignore
 import json
+from app.serializacion import texto_json, construir_campos
+
+# ================================================================================================
+# COLUMNAS JSON
+# ================================================================================================
+
+class _JSONMySQL(types.UserDefinedType):
+    """Tipo JSON de MySQL sin procesamiento en Python (el valor viaja como texto)"""
+    cache_ok = True
+
+    def get_col_spec(self, **kw):
+        return 'JSON'
+
+class TextoJSON(types.TypeDecorator):
+    """
+    Columna JSON nativa en la base (JSON en MySQL, que valida y permite índices sobre
+    columnas generadas; TEXT con json1 en SQLite) que en Python se maneja como texto,
+    para poder insertarlo tal cual en las respuestas (ver app/serializacion.py).
+
+    El texto se valida una vez, al escribirlo: MySQL lo hace en la propia columna y en
+    el resto de bases se comprueba aquí, así que la lectura no vuelve a decodificarlo.
+    """
+    impl = types.Text
+    cache_ok = True
+
+    def load_dialect_impl(self, dialect):
+        if dialect.name == 'mysql':
+            return dialect.type_descriptor(_JSONMySQL())
+        return dialect.type_descriptor(types.Text())
+
+    def process_bind_param(self, value, dialect):
+        if value is not None and dialect.name != 'mysql':
+            json.loads(value)  # ValueError si no es JSON válido: no se guarda
+        return value
+
+class valor_json(expression.FunctionElement):
+    """Valor escalar (texto) de una ruta JSON: valor_json('resultado_ml', '$.estado_sugerido')"""
+    type = types.String()
+    name = 'valor_json'
+    inherit_cache = True
+
+    def __init__(self, columna, ruta):
+        super().__init__(expression.literal_column(columna), expression.literal_column(f"'{ruta}'"))
+
+@compiles(valor_json)
+def _valor_json(elemento, compilador, **kw):
+    return f'json_extract({compilador.process(elemento.clauses, **kw)})'
+
+@compiles(valor_json, 'mysql')
+def _valor_json_mysql(elemento, compilador, **kw):
+    return f'json_unquote(json_extract({compilador.process(elemento.clauses, **kw)}))'
+
+def _metodo_hash():
+    if has_app_context():
+        return current_app.config['PASSWORD_HASH_METODO']
+    return 'scrypt:32768:8:1'
+
+@lru_cache(maxsize=8)
+def _prefijo_hash(metodo):
+    """Prefijo 'metodo:parametros' que werkzeug escribe para un método (completa los valores por defecto)"""
+    return generate_password_hash('', method=metodo, salt_length=1).split('$', 1)[0]
 
 class Usuario(db.Model):
     """Modelo para la tabla usuarios"""
@@ -27,28 +93,35 @@ class Usuario(db.Model):
     acciones_historial = db.relationship('HistorialEstado', backref='realizado_por_usuario')
     
     def set_password(self, password):
-        """Hashear y guardar contraseña"""
-        self.password_hash = generate_password_hash(password)
+        """Hashear y guardar contraseña con el método configurado (PASSWORD_HASH_METODO)"""
+        self.password_hash = generate_password_hash(password, method=_metodo_hash())
     
     def check_password(self, password):
         """Verificar contraseña"""
         return check_password_hash(self.password_hash, password)
     
-    def to_dict(self):
-        """Convertir a diccionario"""
-        return {
-            'id': self.id,
-            'dni': self.dni,
-            'nombres': self.nombres,
-            'apellidos': self.apellidos,
-            'email': self.email,
-            'telefono': self.telefono,
-            'direccion': self.direccion,
-            'rol': self.rol,
-            'estado': self.estado,
-            'fecha_registro': self.fecha_registro.isoformat() if self.fecha_registro else None,
-            'ultima_actividad': self.ultima_actividad.isoformat() if self.ultima_actividad else None
-        }
+    def necesita_rehash(self):
+        """True si el hash guardado usa parámetros distintos de PASSWORD_HASH_METODO"""
+        return self.password_hash.split('$', 1)[0] != _prefijo_hash(_metodo_hash())
+    
+    # Campo -> cómo obtenerlo: to_dict(campos=...) solo evalúa los pedidos
+    _campos_dict = {
+        'id': lambda self, crudo: self.id,
+        'dni': lambda self, crudo: self.dni,
+        'nombres': lambda self, crudo: self.nombres,
+        'apellidos': lambda self, crudo: self.apellidos,
+        'email': lambda self, crudo: self.email,
+        'telefono': lambda self, crudo: self.telefono,
+        'direccion': lambda self, crudo: self.direccion,
+        'rol': lambda self, crudo: self.rol,
+        'estado': lambda self, crudo: self.estado,
+        'fecha_registro': lambda self, crudo: self.fecha_registro.isoformat() if self.fecha_registro else None,
+        'ultima_actividad': lambda self, crudo: self.ultima_actividad.isoformat() if self.ultima_actividad else None,
+    }
+
+    def to_dict(self, campos=None, crudo=False):
+        """Convertir a diccionario (campos: claves a incluir; crudo se acepta por uniformidad, no hay columnas JSON)"""
+        return construir_campos(self, self._campos_dict, campos, crudo)
 
 class Tramite(db.Model):
     """Modelo para la tabla tramites"""
@@ -59,11 +132,11 @@ class Tramite(db.Model):
     nombre = db.Column(db.String(200), nullable=False)
     descripcion = db.Column(db.Text)
     categoria = db.Column(db.Enum('licencias', 'permisos', 'servicios', 'certificados', 'otros'), nullable=False)
-    requisitos = db.Column(db.Text)  # JSON como texto
+    requisitos = db.Column(TextoJSON)  # JSON
     tiempo_estimado_dias = db.Column(db.Integer, default=15)
     costo = db.Column(db.DECIMAL(10, 2), default=0.00)
     prioridad_default = db.Column(db.Enum('baja', 'media', 'alta', 'critica'), default='media')
-    documentos_requeridos = db.Column(db.Text)  # JSON como texto
+    documentos_requeridos = db.Column(TextoJSON)  # JSON
     estado = db.Column(db.Enum('activo', 'inactivo'), default='activo')
     fecha_creacion = db.Column(db.TIMESTAMP, default=datetime.utcnow)
     
@@ -74,7 +147,7 @@ class Tramite(db.Model):
         """Obtener requisitos como lista"""
         try:
             return json.loads(self.requisitos) if self.requisitos else []
-        except:
+        except (TypeError, ValueError):
             return []
     
     def set_requisitos(self, requisitos_list):
@@ -85,29 +158,32 @@ class Tramite(db.Model):
         """Obtener documentos requeridos como lista"""
         try:
             return json.loads(self.documentos_requeridos) if self.documentos_requeridos else []
-        except:
+        except (TypeError, ValueError):
             return []
     
     def set_documentos_requeridos(self, docs_list):
         """Guardar documentos requeridos como JSON"""
         self.documentos_requeridos = json.dumps(docs_list)
     
-    def to_dict(self):
-        """Convertir a diccionario"""
-        return {
-            'id': self.id,
-            'codigo': self.codigo,
-            'nombre': self.nombre,
-            'descripcion': self.descripcion,
-            'categoria': self.categoria,
-            'requisitos': self.get_requisitos(),
-            'tiempo_estimado_dias': self.tiempo_estimado_dias,
-            'costo': float(self.costo) if self.costo else 0.0,
-            'prioridad_default': self.prioridad_default,
-            'documentos_requeridos': self.get_documentos_requeridos(),
-            'estado': self.estado,
-            'fecha_creacion': self.fecha_creacion.isoformat() if self.fecha_creacion else None
-        }
+    # Campo -> cómo obtenerlo: to_dict(campos=...) solo evalúa los pedidos
+    _campos_dict = {
+        'id': lambda self, crudo: self.id,
+        'codigo': lambda self, crudo: self.codigo,
+        'nombre': lambda self, crudo: self.nombre,
+        'descripcion': lambda self, crudo: self.descripcion,
+        'categoria': lambda self, crudo: self.categoria,
+        'requisitos': lambda self, crudo: texto_json(self.requisitos, '[]') if crudo else self.get_requisitos(),
+        'tiempo_estimado_dias': lambda self, crudo: self.tiempo_estimado_dias,
+        'costo': lambda self, crudo: float(self.costo) if self.costo else 0.0,
+        'prioridad_default': lambda self, crudo: self.prioridad_default,
+        'documentos_requeridos': lambda self, crudo: texto_json(self.documentos_requeridos, '[]') if crudo else self.get_documentos_requeridos(),
+        'estado': lambda self, crudo: self.estado,
+        'fecha_creacion': lambda self, crudo: self.fecha_creacion.isoformat() if self.fecha_creacion else None,
+    }
+
+    def to_dict(self, campos=None, crudo=False):
+        """Convertir a diccionario (campos: claves a incluir; crudo: columnas JSON como JSONTexto para la respuesta)"""
+        return construir_campos(self, self._campos_dict, campos, crudo)
 
 class Solicitud(db.Model):
     """Modelo para la tabla solicitudes"""
@@ -124,49 +200,65 @@ class Solicitud(db.Model):
     fecha_limite = db.Column(db.TIMESTAMP)
     fecha_finalizacion = db.Column(db.TIMESTAMP)
     observaciones = db.Column(db.Text)
-    datos_adicionales = db.Column(db.Text)  # JSON como texto
+    datos_adicionales = db.Column(TextoJSON)  # JSON
     puntuacion_ml = db.Column(db.DECIMAL(5, 2))
+    modelo_ml = db.Column(db.String(40))  # 'reglas' o versión del candidato A/B que sirvió prioridad_ml
     procesado_ml = db.Column(db.Boolean, default=False)
     asignado_a = db.Column(db.Integer, db.ForeignKey('usuarios.id'))
+    version = db.Column(db.Integer, nullable=False, default=1)  # Control de concurrencia optimista
+    
+    # Cada UPDATE del ORM incrementa version y falla (StaleDataError) si otro la cambió antes;
+    # los UPDATE de Core (transiciones, prioridad ML) la incrementan explícitamente
+    __mapper_args__ = {'version_id_col': version}
     
     # Relaciones
     documentos = db.relationship('Documento', backref='solicitud')
-    historial = db.relationship('HistorialEstado', backref='solicitud')
+    historial = db.relationship('HistorialEstado', backref='solicitud', order_by='HistorialEstado.fecha_accion')
     
     def get_datos_adicionales(self):
         """Obtener datos adicionales como diccionario"""
         try:
             return json.loads(self.datos_adicionales) if self.datos_adicionales else {}
-        except:
+        except (TypeError, ValueError):
             return {}
     
     def set_datos_adicionales(self, datos_dict):
         """Guardar datos adicionales como JSON"""
         self.datos_adicionales = json.dumps(datos_dict)
     
-    def to_dict(self):
-        """Convertir a diccionario"""
-        return {
-            'id': self.id,
-            'numero_expediente': self.numero_expediente,
-            'usuario_id': self.usuario_id,
-            'tramite_id': self.tramite_id,
-            'estado_actual': self.estado_actual,
-            'prioridad': self.prioridad,
-            'prioridad_ml': self.prioridad_ml,
-            'fecha_solicitud': self.fecha_solicitud.isoformat() if self.fecha_solicitud else None,
-            'fecha_limite': self.fecha_limite.isoformat() if self.fecha_limite else None,
-            'fecha_finalizacion': self.fecha_finalizacion.isoformat() if self.fecha_finalizacion else None,
-            'observaciones': self.observaciones,
-            'datos_adicionales': self.get_datos_adicionales(),
-            'puntuacion_ml': float(self.puntuacion_ml) if self.puntuacion_ml else None,
-            'procesado_ml': self.procesado_ml,
-            'asignado_a': self.asignado_a
-        }
+    # Campo -> cómo obtenerlo: to_dict(campos=...) solo evalúa los pedidos
+    _campos_dict = {
+        'id': lambda self, crudo: self.id,
+        'numero_expediente': lambda self, crudo: self.numero_expediente,
+        'usuario_id': lambda self, crudo: self.usuario_id,
+        'tramite_id': lambda self, crudo: self.tramite_id,
+        'estado_actual': lambda self, crudo: self.estado_actual,
+        'prioridad': lambda self, crudo: self.prioridad,
+        'prioridad_ml': lambda self, crudo: self.prioridad_ml,
+        'fecha_solicitud': lambda self, crudo: self.fecha_solicitud.isoformat() if self.fecha_solicitud else None,
+        'fecha_limite': lambda self, crudo: self.fecha_limite.isoformat() if self.fecha_limite else None,
+        'fecha_finalizacion': lambda self, crudo: self.fecha_finalizacion.isoformat() if self.fecha_finalizacion else None,
+        'observaciones': lambda self, crudo: self.observaciones,
+        'datos_adicionales': lambda self, crudo: texto_json(self.datos_adicionales, '{}') if crudo else self.get_datos_adicionales(),
+        'puntuacion_ml': lambda self, crudo: float(self.puntuacion_ml) if self.puntuacion_ml else None,
+        'modelo_ml': lambda self, crudo: self.modelo_ml,
+        'procesado_ml': lambda self, crudo: self.procesado_ml,
+        'asignado_a': lambda self, crudo: self.asignado_a,
+        'version': lambda self, crudo: self.version,
+    }
+
+    def to_dict(self, campos=None, crudo=False):
+        """Convertir a diccionario (campos: claves a incluir; crudo: columnas JSON como JSONTexto para la respuesta)"""
+        return construir_campos(self, self._campos_dict, campos, crudo)
 
 class Documento(db.Model):
     """Modelo para la tabla documentos"""
     __tablename__ = 'documentos'
+    __table_args__ = (
+        db.Index('idx_documentos_ml_estado', 'ml_estado_sugerido'),
+        db.Index('idx_documentos_ml_tipo', 'ml_tipo_detectado'),
+        db.Index('idx_documentos_almacenamiento', 'almacenamiento'),
+    )
     
     id = db.Column(db.Integer, primary_key=True)
     solicitud_id = db.Column(db.Integer, db.ForeignKey('solicitudes.id'), nullable=False)
@@ -180,44 +272,67 @@ class Documento(db.Model):
     estado_validacion = db.Column(db.Enum('pendiente', 'valido', 'invalido', 'observado'), default='pendiente')
     observaciones_validacion = db.Column(db.Text)
     procesado_ml = db.Column(db.Boolean, default=False)
-    resultado_ml = db.Column(db.Text)  # JSON como texto
+    resultado_ml = db.Column(TextoJSON)  # JSON
     fecha_subida = db.Column(db.TIMESTAMP, default=datetime.utcnow)
     subido_por = db.Column(db.Integer, db.ForeignKey('usuarios.id'), nullable=False)
     
+    # Nivel de almacenamiento: 'activo' (archivo suelto en ruta_archivo) o 'archivado'
+    # (miembro de un paquete comprimido, ver app/almacenamiento.py)
+    almacenamiento = db.Column(db.Enum('activo', 'archivado'), nullable=False, default='activo')
+    paquete = db.Column(db.String(255))
+    paquete_offset = db.Column(db.BigInteger)
+    paquete_longitud = db.Column(db.BigInteger)
+    paquete_compresion = db.Column(db.String(10))  # 'zlib' o 'ninguna'
+    # Si el archivo está en su nivel de almacenamiento: se mantiene al subir, al descargar,
+    # en la verificación de integridad y en la reconciliación (los listados no tocan el disco)
+    archivo_existe = db.Column(db.Boolean, nullable=False, default=True)
+    
+    # Claves de resultado_ml generadas por la base e indexadas (filtros ML sin cargar filas en Python)
+    ml_estado_sugerido = db.Column(db.String(20), db.Computed(valor_json('resultado_ml', '$.estado_sugerido')))
+    ml_tipo_detectado = db.Column(db.String(50), db.Computed(valor_json('resultado_ml', '$.tipo_detectado')))
+    
     def get_resultado_ml(self):
         """Obtener resultado ML como diccionario"""
         try:
             return json.loads(self.resultado_ml) if self.resultado_ml else {}
-        except:
+        except (TypeError, ValueError):
             return {}
     
     def set_resultado_ml(self, resultado_dict):
         """Guardar resultado ML como JSON"""
         self.resultado_ml = json.dumps(resultado_dict)
     
-    def to_dict(self):
-        """Convertir a diccionario"""
-        return {
-            'id': self.id,
-            'solicitud_id': self.solicitud_id,
-            'nombre_archivo': self.nombre_archivo,
-            'nombre_original': self.nombre_original,
-            'tipo_documento': self.tipo_documento,
-            'ruta_archivo': self.ruta_archivo,
-            'tamano_bytes': self.tamano_bytes,
-            'tipo_mime': self.tipo_mime,
-            'hash_archivo': self.hash_archivo,
-            'estado_validacion': self.estado_validacion,
-            'observaciones_validacion': self.observaciones_validacion,
-            'procesado_ml': self.procesado_ml,
-            'resultado_ml': self.get_resultado_ml(),
-            'fecha_subida': self.fecha_subida.isoformat() if self.fecha_subida else None,
-            'subido_por': self.subido_por
-        }
+    # Campo -> cómo obtenerlo: to_dict(campos=...) solo evalúa los pedidos
+    _campos_dict = {
+        'id': lambda self, crudo: self.id,
+        'solicitud_id': lambda self, crudo: self.solicitud_id,
+        'nombre_archivo': lambda self, crudo: self.nombre_archivo,
+        'nombre_original': lambda self, crudo: self.nombre_original,
+        'tipo_documento': lambda self, crudo: self.tipo_documento,
+        'ruta_archivo': lambda self, crudo: self.ruta_archivo,
+        'tamano_bytes': lambda self, crudo: self.tamano_bytes,
+        'tipo_mime': lambda self, crudo: self.tipo_mime,
+        'hash_archivo': lambda self, crudo: self.hash_archivo,
+        'estado_validacion': lambda self, crudo: self.estado_validacion,
+        'observaciones_validacion': lambda self, crudo: self.observaciones_validacion,
+        'procesado_ml': lambda self, crudo: self.procesado_ml,
+        'resultado_ml': lambda self, crudo: texto_json(self.resultado_ml, '{}') if crudo else self.get_resultado_ml(),
+        'fecha_subida': lambda self, crudo: self.fecha_subida.isoformat() if self.fecha_subida else None,
+        'subido_por': lambda self, crudo: self.subido_por,
+        'almacenamiento': lambda self, crudo: self.almacenamiento,
+        'archivo_existe': lambda self, crudo: self.archivo_existe,
+    }
+
+    def to_dict(self, campos=None, crudo=False):
+        """Convertir a diccionario (campos: claves a incluir; crudo: columnas JSON como JSONTexto para la respuesta)"""
+        return construir_campos(self, self._campos_dict, campos, crudo)
 
 class HistorialEstado(db.Model):
     """Modelo para la tabla historial_estado"""
     __tablename__ = 'historial_estado'
+    __table_args__ = (
+        db.Index('idx_historial_solicitud_fecha', 'solicitud_id', 'fecha_accion'),
+    )
     
     id = db.Column(db.Integer, primary_key=True)
     solicitud_id = db.Column(db.Integer, db.ForeignKey('solicitudes.id'), nullable=False)
@@ -227,31 +342,34 @@ class HistorialEstado(db.Model):
     comentarios = db.Column(db.Text)
     realizado_por = db.Column(db.Integer, db.ForeignKey('usuarios.id'), nullable=False)
     automatico = db.Column(db.Boolean, default=False)
-    datos_adicionales = db.Column(db.Text)  # JSON como texto
+    datos_adicionales = db.Column(TextoJSON)  # JSON
     fecha_accion = db.Column(db.TIMESTAMP, default=datetime.utcnow)
     
     def get_datos_adicionales(self):
         """Obtener datos adicionales como diccionario"""
         try:
             return json.loads(self.datos_adicionales) if self.datos_adicionales else {}
-        except:
+        except (TypeError, ValueError):
             return {}
     
     def set_datos_adicionales(self, datos_dict):
         """Guardar datos adicionales como JSON"""
         self.datos_adicionales = json.dumps(datos_dict)
     
-    def to_dict(self):
-        """Convertir a diccionario"""
-        return {
-            'id': self.id,
-            'solicitud_id': self.solicitud_id,
-            'estado_anterior': self.estado_anterior,
-            'estado_nuevo': self.estado_nuevo,
-            'accion': self.accion,
-            'comentarios': self.comentarios,
-            'realizado_por': self.realizado_por,
-            'automatico': self.automatico,
-            'datos_adicionales': self.get_datos_adicionales(),
-            'fecha_accion': self.fecha_accion.isoformat() if self.fecha_accion else None
-        }
+    # Campo -> cómo obtenerlo: to_dict(campos=...) solo evalúa los pedidos
+    _campos_dict = {
+        'id': lambda self, crudo: self.id,
+        'solicitud_id': lambda self, crudo: self.solicitud_id,
+        'estado_anterior': lambda self, crudo: self.estado_anterior,
+        'estado_nuevo': lambda self, crudo: self.estado_nuevo,
+        'accion': lambda self, crudo: self.accion,
+        'comentarios': lambda self, crudo: self.comentarios,
+        'realizado_por': lambda self, crudo: self.realizado_por,
+        'automatico': lambda self, crudo: self.automatico,
+        'datos_adicionales': lambda self, crudo: texto_json(self.datos_adicionales, '{}') if crudo else self.get_datos_adicionales(),
+        'fecha_accion': lambda self, crudo: self.fecha_accion.isoformat() if self.fecha_accion else None,
+    }
+
+    def to_dict(self, campos=None, crudo=False):
+        """Convertir a diccionario (campos: claves a incluir; crudo: columnas JSON como JSONTexto para la respuesta)"""
+        return construir_campos(self, self._campos_dict, campos, crudo)
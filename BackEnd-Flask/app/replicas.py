@@ -0,0 +1,148 @@
+"""
+Réplicas de lectura.
+
+Por defecto todas las consultas van a la base principal (SQLALCHEMY_DATABASE_URI).
+Cada URI de REPLICAS_URIS se registra como un bind de Flask-SQLAlchemy y la sesión
+(SesionEnrutada) envía a una réplica los SELECT ejecutados dentro de
+leer_de_replica() (bloque o decorador): las vistas marcadas con @solo_lectura y la
+extracción de datos de entrenamiento ML. Los flush, INSERT/UPDATE/DELETE y text()
+van siempre a la principal, y después de la primera escritura de una sesión sus
+lecturas también.
+
+Leer lo propio escrito: al confirmar una transacción con escrituras en una petición
+autenticada, las vistas @solo_lectura de ese usuario leen de la principal durante
+REPLICAS_ADHERENCIA_SEGUNDOS (debe superar el retraso de replicación esperado).
+
+Backends de la adherencia:
+- 'memoria': por proceso (desarrollo, tests, un solo worker)
+- 'redis':   compartida entre workers y servidores (requiere redis)
+"""
+from flask import current_app, has_request_context # type: ignore
+from flask_jwt_extended import get_jwt_identity # type: ignore
+from flask_sqlalchemy.session import Session # type: ignore
+from sqlalchemy import event # type: ignore
+from contextlib import contextmanager
+from contextvars import ContextVar
+from functools import wraps
+import random
+import threading
+import time
+
+_destino = ContextVar('replicas_destino', default='principal')
+
+
+class SesionEnrutada(Session):
+    """Sesión de Flask-SQLAlchemy que elige entre la principal y las réplicas por sentencia"""
+
+    def get_bind(self, mapper=None, clause=None, bind=None, **kwargs):
+        if bind is None:
+            if self._flushing or not getattr(clause, 'is_select', False):
+                self.info['escribio'] = True
+            elif _destino.get() == 'replica' and not self.info.get('escribio'):
+                claves = current_app.extensions.get('replicas')
+                if claves:
+                    return self._db.engines[random.choice(claves)]
+        return super().get_bind(mapper=mapper, clause=clause, bind=bind, **kwargs)
+
+
+@event.listens_for(SesionEnrutada, 'after_commit')
+def _adherir_tras_escritura(sesion):
+    if sesion.info.get('escribio'):
+        usuario_id = _usuario_actual()
+        if usuario_id is not None:
+            marcar_escritura(usuario_id)
+
+
+class AdherenciaMemoria:
+    """Usuarios que escribieron hace poco, en memoria del proceso"""
+
+    def __init__(self):
+        self._hasta = {}
+        self._lock = threading.Lock()
+        self._proxima_limpieza = 0
+
+    def marcar(self, usuario_id, segundos):
+        ahora = time.monotonic()
+        with self._lock:
+            self._hasta[usuario_id] = ahora + segundos
+            if ahora >= self._proxima_limpieza:
+                self._hasta = {u: hasta for u, hasta in self._hasta.items() if hasta > ahora}
+                self._proxima_limpieza = ahora + segundos
+
+    def adherido(self, usuario_id):
+        return self._hasta.get(usuario_id, 0) > time.monotonic()
+
+
+class AdherenciaRedis:
+    """Usuarios que escribieron hace poco, como claves de Redis con vencimiento"""
+
+    def __init__(self, url, prefijo='docucontrol:replicas:escritura:'):
+        import redis # type: ignore
+        self._redis = redis.Redis.from_url(url)
+        self._prefijo = prefijo
+
+    def marcar(self, usuario_id, segundos):
+        self._redis.set(f'{self._prefijo}{usuario_id}', 1, px=max(1, int(segundos * 1000)))
+
+    def adherido(self, usuario_id):
+        return bool(self._redis.exists(f'{self._prefijo}{usuario_id}'))
+
+
+BACKENDS = {
+    'memoria': lambda app: AdherenciaMemoria(),
+    'redis': lambda app: AdherenciaRedis(app.config['REPLICAS_REDIS_URL'])
+}
+
+
+def init_app(app):
+    """Registrar las réplicas como binds (antes de db.init_app, que crea los motores)"""
+    claves = [f'replica{i}' for i in range(len(app.config['REPLICAS_URIS']))]
+    if claves:
+        binds = dict(app.config.get('SQLALCHEMY_BINDS') or {})
+        binds.update(zip(claves, app.config['REPLICAS_URIS']))
+        app.config['SQLALCHEMY_BINDS'] = binds
+    app.extensions['replicas'] = claves
+    app.extensions['replicas_adherencia'] = BACKENDS[app.config['REPLICAS_ADHERENCIA_BACKEND']](app)
+
+
+def _usuario_actual():
+    if not has_request_context():
+        return None
+    try:
+        return get_jwt_identity()
+    except RuntimeError:
+        # Vista sin @jwt_required
+        return None
+
+
+def marcar_escritura(usuario_id):
+    """Leer de la principal las próximas vistas @solo_lectura de este usuario"""
+    if current_app.extensions['replicas']:
+        current_app.extensions['replicas_adherencia'].marcar(
+            str(usuario_id), current_app.config['REPLICAS_ADHERENCIA_SEGUNDOS'])
+
+
+@contextmanager
+def leer_de_replica():
+    """Enviar a una réplica los SELECT del bloque o de la función decorada (sin réplicas no cambia nada)"""
+    ficha = _destino.set('replica')
+    try:
+        yield
+    finally:
+        _destino.reset(ficha)
+
+
+def solo_lectura(vista):
+    """
+    Decorador de vistas (después de @jwt_required): sus consultas van a una réplica,
+    salvo que el usuario haya escrito en los últimos REPLICAS_ADHERENCIA_SEGUNDOS.
+    """
+    @wraps(vista)
+    def envoltura(*args, **kwargs):
+        usuario_id = _usuario_actual()
+        if (usuario_id is not None and current_app.extensions['replicas']
+                and current_app.extensions['replicas_adherencia'].adherido(str(usuario_id))):
+            return vista(*args, **kwargs)
+        with leer_de_replica():
+            return vista(*args, **kwargs)
+    return envoltura
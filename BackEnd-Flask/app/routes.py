@@ -1,5 +1,5 @@
-from flask import Blueprint, request, jsonify, current_app, send_file # type: ignore
-from flask_jwt_extended import jwt_required, get_jwt_identity, create_access_token # type: ignore
+from flask import Blueprint, request, jsonify, current_app, send_file, Response # type: ignore
+from flask_jwt_extended import jwt_required, get_jwt_identity, create_access_token, verify_jwt_in_request # type: ignore
 from app import db
 from app.models import Usuario, Tramite, Solicitud, Documento, HistorialEstado
 from werkzeug.utils import secure_filename # type: ignore
@@ -8,6 +8,22 @@ from datetime import datetime, timedelta
 import hashlib
 import json
 from app.ml_utils import solicitud_processor
+from app import servicio_modelos
+from app.servicio_modelos import ErrorManifiesto
+from app.transiciones import aplicar_transiciones
+from app.eventos import publicar_al_confirmar, obtener_backend, canales_usuario, formatear_evento, abrir_stream, cerrar_stream
+from app.tareas import encolar, obtener_cola, tarea_to_dict
+from app.trabajos import calcular_hash_archivo
+from app.metricas import registro as registro_metricas
+from app.serializacion import campos_solicitados
+from app.actividad import registrar_actividad
+from app.admision import limitar, una_vez, respuesta_ocupado
+from app.replicas import solo_lectura, marcar_escritura
+from app.descargas import enviar_documento, ArchivoCorrupto
+from app.vistas_previas import obtener_preview, PreviewOcupada
+from app.almacenamiento import archivo_disponible, preparar_ruta, ruta_fisica
+from app.cargas import (ErrorCarga, iniciar_carga, obtener_carga, escribir_fragmento, finalizar_carga,
+                        cancelar_carga, carga_to_dict)
 
 # Blueprints para organizar las rutas
 main_bp = Blueprint('main', __name__)
@@ -16,6 +32,8 @@ tramites_bp = Blueprint('tramites', __name__)
 solicitudes_bp = Blueprint('solicitudes', __name__)
 documentos_bp = Blueprint('documentos', __name__)
 ml_bp = Blueprint('ml', __name__)
+eventos_bp = Blueprint('eventos', __name__)
+tareas_bp = Blueprint('tareas', __name__)
 
 # ================================================================================================
 # RUTAS PRINCIPALES
@@ -49,6 +67,27 @@ def health_check():
             'timestamp': datetime.utcnow().isoformat()
         }), 500
 
+def _acceso_metricas():
+    """Token de METRICAS_TOKEN (scrapers) o JWT de un usuario admin"""
+    token = current_app.config['METRICAS_TOKEN']
+    if token and request.headers.get('Authorization') == f'Bearer {token}':
+        return True
+    try:
+        verify_jwt_in_request()
+    except Exception:
+        return False
+    usuario = Usuario.query.get(int(get_jwt_identity()))
+    return usuario is not None and usuario.rol == 'admin'
+
+@main_bp.route('/metrics')
+def metrics():
+    """Métricas de latencia, SQL, tamaño de respuesta e inferencia ML (formato Prometheus)"""
+    if not current_app.config['METRICAS_HABILITADAS']:
+        return jsonify({'error': 'Métricas deshabilitadas'}), 404
+    if not current_app.config['METRICAS_ANONIMAS'] and not _acceso_metricas():
+        return jsonify({'error': 'No autorizado'}), 401
+    return Response(registro_metricas.exportar(), mimetype='text/plain; version=0.0.4')
+
 # ================================================================================================
 # RUTAS DE AUTENTICACIÓN
 # ================================================================================================
@@ -86,6 +125,8 @@ def register():
         
         db.session.add(usuario)
         db.session.commit()
+        # Sus primeras lecturas tras iniciar sesión no deben depender del retraso de las réplicas
+        marcar_escritura(usuario.id)
         
         return jsonify({
             'message': 'Usuario registrado exitosamente',
@@ -113,9 +154,13 @@ def login():
         if usuario.estado != 'activo':
             return jsonify({'error': 'Usuario inactivo'}), 401
         
-        # Actualizar última actividad
-        usuario.ultima_actividad = datetime.utcnow()
-        db.session.commit()
+        # Re-hashear si cambiaron los parámetros de PASSWORD_HASH_METODO (solo una vez por usuario)
+        if usuario.necesita_rehash():
+            usuario.set_password(data['password'])
+            db.session.commit()
+        
+        # Actualizar última actividad (se escribe en lote, ver app/actividad.py)
+        registrar_actividad(usuario)
           # Crear token de acceso
         access_token = create_access_token(identity=str(usuario.id))
         
@@ -129,6 +174,7 @@ def login():
 
 @auth_bp.route('/profile', methods=['GET'])
 @jwt_required()
+@solo_lectura
 def get_profile():
     """Obtener perfil del usuario autenticado"""
     try:
@@ -148,16 +194,19 @@ def get_profile():
 # ================================================================================================
 
 @tramites_bp.route('/', methods=['GET'])
+@solo_lectura
 def get_tramites():
     """Obtener lista de trámites disponibles"""
     try:
         tramites = Tramite.query.filter_by(estado='activo').all()
-        return jsonify([tramite.to_dict() for tramite in tramites])
+        campos = campos_solicitados()
+        return jsonify([tramite.to_dict(campos, crudo=True) for tramite in tramites])
         
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
 @tramites_bp.route('/<int:tramite_id>', methods=['GET'])
+@solo_lectura
 def get_tramite(tramite_id):
     """Obtener detalles de un trámite específico"""
     try:
@@ -166,17 +215,19 @@ def get_tramite(tramite_id):
         if not tramite:
             return jsonify({'error': 'Trámite no encontrado'}), 404
         
-        return jsonify(tramite.to_dict())
+        return jsonify(tramite.to_dict(campos_solicitados(), crudo=True))
         
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
 @tramites_bp.route('/categoria/<categoria>', methods=['GET'])
+@solo_lectura
 def get_tramites_por_categoria(categoria):
     """Obtener trámites por categoría"""
     try:
         tramites = Tramite.query.filter_by(categoria=categoria, estado='activo').all()
-        return jsonify([tramite.to_dict() for tramite in tramites])
+        campos = campos_solicitados()
+        return jsonify([tramite.to_dict(campos, crudo=True) for tramite in tramites])
         
     except Exception as e:
         return jsonify({'error': str(e)}), 500
@@ -235,13 +286,15 @@ def crear_solicitud():
         )
         
         db.session.add(historial)
+        publicar_al_confirmar('solicitud.creada', user_id, solicitud_id=solicitud.id, estado='pendiente')
         db.session.commit()
 
-        # Entrenar/actualizar modelo ML automáticamente
+        # Reentrenar el modelo ML en segundo plano (una sola tarea pendiente a la vez; la tarea
+        # se omite si el último entrenamiento es reciente o hay pocas solicitudes nuevas)
         try:
-            solicitud_processor.train_priority_model_from_db()
+            encolar('ml.entrenar_prioridad', {'automatico': True}, clave_unica='ml.entrenar_prioridad.automatico')
         except Exception as ml_error:
-            current_app.logger.warning(f"No se pudo actualizar el modelo ML: {ml_error}")
+            current_app.logger.warning(f"No se pudo encolar la actualización del modelo ML: {ml_error}")
 
         return jsonify({
             'message': 'Solicitud creada exitosamente',
@@ -252,18 +305,150 @@ def crear_solicitud():
         db.session.rollback()
         return jsonify({'error': str(e)}), 500
 
+@solicitudes_bp.route('/masivo', methods=['POST'])
+@jwt_required()
+def crear_solicitudes_masivo():
+    """Crear varias solicitudes en una sola petición (mesas de partes y migraciones)"""
+    try:
+        user_id = int(get_jwt_identity())
+        usuario = Usuario.query.get(user_id)
+        if not usuario:
+            return jsonify({'error': 'Usuario no válido'}), 401
+
+        data = request.get_json() or {}
+        items = data.get('solicitudes')
+        if not isinstance(items, list) or not items:
+            return jsonify({'error': 'Se requiere una lista de solicitudes'}), 400
+
+        limite = current_app.config['BULK_SOLICITUDES_MAX']
+        if len(items) > limite:
+            return jsonify({'error': f'Máximo {limite} solicitudes por carga'}), 400
+
+        # Solo el personal puede registrar solicitudes a nombre de otros usuarios
+        es_personal = usuario.rol in ['administrativo', 'supervisor', 'admin']
+
+        # Validar trámites y usuarios con una sola consulta IN cada uno
+        tramite_ids = {item.get('tramite_id') for item in items
+                       if isinstance(item, dict) and isinstance(item.get('tramite_id'), int)}
+        tramites = {t.id: t for t in Tramite.query.filter(Tramite.id.in_(tramite_ids))} if tramite_ids else {}
+
+        usuario_ids = {item.get('usuario_id') for item in items
+                       if isinstance(item, dict) and isinstance(item.get('usuario_id'), int)}
+        roles = dict(
+            db.session.query(Usuario.id, Usuario.rol).filter(Usuario.id.in_(usuario_ids)).all()
+        ) if es_personal and usuario_ids else {}
+        roles[user_id] = usuario.rol
+
+        import random
+        ahora = datetime.utcnow()
+        timestamp = datetime.now().strftime('%Y%m%d%H%M%S')
+        resultados = []
+        filas = []
+        numeros_usados = set()
+
+        for indice, item in enumerate(items):
+            if not isinstance(item, dict) or 'tramite_id' not in item:
+                resultados.append({'indice': indice, 'estado': 'error', 'error': 'ID del trámite es requerido'})
+                continue
+
+            tramite = tramites.get(item['tramite_id'])
+            if not tramite:
+                resultados.append({'indice': indice, 'estado': 'error', 'error': 'Trámite no encontrado'})
+                continue
+
+            propietario_id = item.get('usuario_id', user_id)
+            if propietario_id != user_id and not es_personal:
+                resultados.append({'indice': indice, 'estado': 'error', 'error': 'Sin permisos para crear solicitudes de otros usuarios'})
+                continue
+            if propietario_id not in roles:
+                resultados.append({'indice': indice, 'estado': 'error', 'error': 'Usuario no encontrado'})
+                continue
+
+            # Número de expediente único dentro del lote
+            numero_expediente = f"{tramite.codigo}-{timestamp}-{random.randint(100000, 999999)}"
+            while numero_expediente in numeros_usados:
+                numero_expediente = f"{tramite.codigo}-{timestamp}-{random.randint(100000, 999999)}"
+            numeros_usados.add(numero_expediente)
+
+            filas.append({
+                'numero_expediente': numero_expediente,
+                'usuario_id': propietario_id,
+                'tramite_id': tramite.id,
+                'prioridad': tramite.prioridad_default,
+                'fecha_solicitud': ahora,
+                'fecha_limite': ahora + timedelta(days=tramite.tiempo_estimado_dias),
+                'observaciones': item.get('observaciones'),
+                'datos_adicionales': json.dumps(item['datos_adicionales']) if 'datos_adicionales' in item else None
+            })
+            resultados.append({'indice': indice, 'estado': 'creada', 'numero_expediente': numero_expediente})
+
+        if not filas:
+            return jsonify({
+                'message': 'No se creó ninguna solicitud',
+                'creadas': 0,
+                'errores': len(resultados),
+                'resultados': resultados
+            }), 400
+
+        # Insertar solicitudes e historial con executemany en una sola transacción
+        db.session.execute(Solicitud.__table__.insert(), filas)
+        ids = dict(
+            db.session.query(Solicitud.numero_expediente, Solicitud.id)
+            .filter(Solicitud.numero_expediente.in_(numeros_usados)).all()
+        )
+        db.session.execute(HistorialEstado.__table__.insert(), [{
+            'solicitud_id': ids[fila['numero_expediente']],
+            'estado_nuevo': 'pendiente',
+            'accion': 'creacion',
+            'comentarios': 'Solicitud creada por carga masiva',
+            'realizado_por': user_id,
+            'fecha_accion': ahora
+        } for fila in filas])
+        for fila in filas:
+            publicar_al_confirmar('solicitud.creada', fila['usuario_id'],
+                                  solicitud_id=ids[fila['numero_expediente']], estado='pendiente')
+        db.session.commit()
+
+        for resultado in resultados:
+            if resultado['estado'] == 'creada':
+                resultado['id'] = ids[resultado['numero_expediente']]
+
+        # Una sola pasada de puntuación ML para todo el lote, en segundo plano
+        tarea_id = None
+        try:
+            tarea_id = encolar('ml.puntuar_lote', {'solicitud_ids': list(ids.values())},
+                               prioridad=10, usuario_id=user_id)
+        except Exception as ml_error:
+            current_app.logger.warning(f"No se pudo encolar la puntuación ML del lote: {ml_error}")
+
+        return jsonify({
+            'message': f'Se crearon {len(filas)} solicitudes',
+            'creadas': len(filas),
+            'errores': len(resultados) - len(filas),
+            'resultados': resultados,
+            'tarea_ml_id': tarea_id
+        }), 201
+
+    except Exception as e:
+        db.session.rollback()
+        return jsonify({'error': str(e)}), 500
+
 @solicitudes_bp.route('/mis-solicitudes', methods=['GET'])
 @jwt_required()
+@solo_lectura
 def get_mis_solicitudes():
     """Obtener solicitudes del usuario autenticado"""
     try:
         user_id = int(get_jwt_identity())
         solicitudes = Solicitud.query.filter_by(usuario_id=user_id).all()
+        campos = campos_solicitados()
         
         resultado = []
         for solicitud in solicitudes:
-            solicitud_dict = solicitud.to_dict()
-            solicitud_dict['tramite'] = solicitud.tramite.to_dict()
+            solicitud_dict = solicitud.to_dict(campos, crudo=True)
+            # El trámite solo se carga si se pide (evita una consulta por solicitud)
+            if campos is None or 'tramite' in campos:
+                solicitud_dict['tramite'] = solicitud.tramite.to_dict(crudo=True)
             resultado.append(solicitud_dict)
         
         return jsonify(resultado)
@@ -273,6 +458,7 @@ def get_mis_solicitudes():
 
 @solicitudes_bp.route('/<int:solicitud_id>', methods=['GET'])
 @jwt_required()
+@solo_lectura
 def get_solicitud(solicitud_id):
     """Obtener detalles de una solicitud específica"""
     try:
@@ -287,17 +473,216 @@ def get_solicitud(solicitud_id):
         if usuario.rol == 'ciudadano' and solicitud.usuario_id != user_id:
             return jsonify({'error': 'Sin permisos para acceder a esta solicitud'}), 403
         
-        solicitud_dict = solicitud.to_dict()
-        solicitud_dict['tramite'] = solicitud.tramite.to_dict()
-        solicitud_dict['usuario'] = solicitud.usuario.to_dict()
-        solicitud_dict['documentos'] = [doc.to_dict() for doc in solicitud.documentos]
-        solicitud_dict['historial'] = [hist.to_dict() for hist in solicitud.historial]
+        campos = campos_solicitados()
+        solicitud_dict = solicitud.to_dict(campos, crudo=True)
+        if campos is None or 'tramite' in campos:
+            solicitud_dict['tramite'] = solicitud.tramite.to_dict(crudo=True)
+        if campos is None or 'usuario' in campos:
+            solicitud_dict['usuario'] = solicitud.usuario.to_dict()
+        if campos is None or 'documentos' in campos:
+            solicitud_dict['documentos'] = [doc.to_dict(crudo=True) for doc in solicitud.documentos]
+        if campos is None or 'historial' in campos:
+            solicitud_dict['historial'] = [hist.to_dict(crudo=True) for hist in solicitud.historial]
         
         return jsonify(solicitud_dict)
         
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
+def _historial_paginado(solicitud_id, columnas, formatear):
+    """
+    Leer una página del historial en el orden del índice (solicitud_id, fecha_accion)
+    con ETag basado en la última fecha_accion; responde 304 si el cliente ya la tiene.
+    """
+    user_id = int(get_jwt_identity())
+    usuario = Usuario.query.get(user_id)
+
+    propietario_id = db.session.query(Solicitud.usuario_id).filter(Solicitud.id == solicitud_id).scalar()
+    if propietario_id is None:
+        return jsonify({'error': 'Solicitud no encontrada'}), 404
+
+    if usuario.rol == 'ciudadano' and propietario_id != user_id:
+        return jsonify({'error': 'Sin permisos para acceder a esta solicitud'}), 403
+
+    page = max(request.args.get('page', 1, type=int), 1)
+    per_page = min(max(request.args.get('per_page', 50, type=int), 1), 200)
+    datos = request.args.get('datos', '')
+    # datos_adicionales solo se lee y decodifica si se pidió (?datos=clave1,clave2 o ?datos=*)
+    claves = [c for c in datos.split(',') if c]
+    if claves:
+        columnas = [*columnas, HistorialEstado.datos_adicionales]
+
+    # Resumen servido desde el índice: sirve para el ETag y para el total
+    ultima_fecha, total = db.session.query(
+        db.func.max(HistorialEstado.fecha_accion),
+        db.func.count(HistorialEstado.id)
+    ).filter(HistorialEstado.solicitud_id == solicitud_id).one()
+
+    etag = hashlib.sha1(
+        f"{solicitud_id}:{ultima_fecha}:{total}:{page}:{per_page}:{datos}:{request.endpoint}".encode()
+    ).hexdigest()
+    if request.if_none_match.contains_weak(etag):
+        respuesta = current_app.response_class(status=304)
+        respuesta.set_etag(etag, weak=True)
+        return respuesta
+
+    filas = db.session.query(*columnas) \
+        .select_from(HistorialEstado) \
+        .outerjoin(Usuario, HistorialEstado.realizado_por == Usuario.id) \
+        .filter(HistorialEstado.solicitud_id == solicitud_id) \
+        .order_by(HistorialEstado.solicitud_id, HistorialEstado.fecha_accion, HistorialEstado.id) \
+        .offset((page - 1) * per_page) \
+        .limit(per_page) \
+        .all()
+
+    items = []
+    for fila in filas:
+        item = formatear(fila)
+        if claves:
+            try:
+                extra = json.loads(fila.datos_adicionales) if fila.datos_adicionales else {}
+            except (TypeError, ValueError):
+                extra = {}
+            item['datos_adicionales'] = extra if '*' in claves else {c: extra.get(c) for c in claves}
+        items.append(item)
+
+    respuesta = jsonify({
+        'items': items,
+        'total': total,
+        'page': page,
+        'per_page': per_page,
+        'pages': (total + per_page - 1) // per_page
+    })
+    respuesta.set_etag(etag, weak=True)
+    respuesta.headers['Cache-Control'] = 'private, no-cache'
+    return respuesta
+
+@solicitudes_bp.route('/<int:solicitud_id>/historial', methods=['GET'])
+@jwt_required()
+@solo_lectura
+def get_historial_solicitud(solicitud_id):
+    """Historial paginado de acciones sobre una solicitud"""
+    try:
+        def formatear(fila):
+            return {
+                'id': fila.id,
+                'solicitud_id': solicitud_id,
+                'estado_anterior': fila.estado_anterior,
+                'estado_nuevo': fila.estado_nuevo,
+                'accion': fila.accion,
+                'comentarios': fila.comentarios,
+                'realizado_por': fila.realizado_por,
+                'usuario': f"{fila.nombres} {fila.apellidos}" if fila.nombres else None,
+                'automatico': fila.automatico,
+                'fecha_accion': fila.fecha_accion.isoformat() if fila.fecha_accion else None
+            }
+
+        return _historial_paginado(solicitud_id, [
+            HistorialEstado.id, HistorialEstado.estado_anterior, HistorialEstado.estado_nuevo,
+            HistorialEstado.accion, HistorialEstado.comentarios, HistorialEstado.realizado_por,
+            HistorialEstado.automatico, HistorialEstado.fecha_accion, Usuario.nombres, Usuario.apellidos
+        ], formatear)
+
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+@solicitudes_bp.route('/<int:solicitud_id>/timeline', methods=['GET'])
+@jwt_required()
+@solo_lectura
+def get_timeline_solicitud(solicitud_id):
+    """Línea de tiempo compacta de estados de una solicitud"""
+    try:
+        def formatear(fila):
+            return {
+                'id': fila.id,
+                'estado': fila.estado_nuevo,
+                'estado_anterior': fila.estado_anterior,
+                'accion': fila.accion,
+                'fecha': fila.fecha_accion.isoformat() if fila.fecha_accion else None,
+                'usuario': f"{fila.nombres} {fila.apellidos}" if fila.nombres else None,
+                'comentario': fila.comentarios,
+                'automatico': fila.automatico
+            }
+
+        return _historial_paginado(solicitud_id, [
+            HistorialEstado.id, HistorialEstado.estado_anterior, HistorialEstado.estado_nuevo,
+            HistorialEstado.accion, HistorialEstado.comentarios, HistorialEstado.automatico,
+            HistorialEstado.fecha_accion, Usuario.nombres, Usuario.apellidos
+        ], formatear)
+
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+@solicitudes_bp.route('/<int:solicitud_id>/estado', methods=['PATCH'])
+@jwt_required()
+def actualizar_estado_solicitud(solicitud_id):
+    """Cambiar el estado de una solicitud validando la transición y la versión"""
+    try:
+        user_id = int(get_jwt_identity())
+        usuario = Usuario.query.get(user_id)
+        if usuario.rol not in ['administrativo', 'supervisor', 'admin']:
+            return jsonify({'error': 'Sin permisos para cambiar el estado de solicitudes'}), 403
+
+        data = request.get_json() or {}
+        if 'estado' not in data:
+            return jsonify({'error': 'Estado es requerido'}), 400
+
+        cambio = {'solicitud_id': solicitud_id, 'estado': data['estado'], 'comentario': data.get('comentario')}
+        if 'version' in data:
+            cambio['version'] = data['version']
+        if 'asignado_a' in data:
+            cambio['asignado_a'] = data['asignado_a']
+
+        resultado = aplicar_transiciones([cambio], user_id)[0]
+        if resultado['estado'] == 'conflicto':
+            return jsonify({'error': resultado['error']}), 409
+        if resultado['estado'] != 'aplicado':
+            codigo = 404 if resultado['error'] == 'Solicitud no encontrada' else 400
+            return jsonify({'error': resultado['error']}), codigo
+
+        solicitud = Solicitud.query.get(solicitud_id)
+        return jsonify({
+            'message': 'Estado actualizado exitosamente',
+            'solicitud': solicitud.to_dict()
+        })
+
+    except Exception as e:
+        db.session.rollback()
+        return jsonify({'error': str(e)}), 500
+
+@solicitudes_bp.route('/estado', methods=['PATCH'])
+@jwt_required()
+def actualizar_estado_solicitudes_lote():
+    """Cambiar estado y/o reasignar varias solicitudes en una sola transacción (supervisores)"""
+    try:
+        user_id = int(get_jwt_identity())
+        usuario = Usuario.query.get(user_id)
+        if usuario.rol not in ['supervisor', 'admin']:
+            return jsonify({'error': 'Sin permisos para cambios de estado en lote'}), 403
+
+        data = request.get_json() or {}
+        cambios = data.get('cambios')
+        if not isinstance(cambios, list) or not cambios:
+            return jsonify({'error': 'Se requiere una lista de cambios'}), 400
+
+        limite = current_app.config['BULK_TRANSICIONES_MAX']
+        if len(cambios) > limite:
+            return jsonify({'error': f'Máximo {limite} cambios por lote'}), 400
+
+        resultados = aplicar_transiciones(cambios, user_id)
+        aplicados = sum(1 for r in resultados if r['estado'] == 'aplicado')
+
+        return jsonify({
+            'message': f'Se aplicaron {aplicados} cambios',
+            'aplicados': aplicados,
+            'errores': len(resultados) - aplicados,
+            'resultados': resultados
+        })
+
+    except Exception as e:
+        db.session.rollback()
+        return jsonify({'error': str(e)}), 500
+
 # ================================================================================================
 # RUTAS DE DOCUMENTOS
 # ================================================================================================
@@ -309,6 +694,7 @@ def allowed_file(filename):
 
 @documentos_bp.route('/subir/<int:solicitud_id>', methods=['POST'])
 @jwt_required()
+@limitar('documentos.subir', concurrencia=True)
 def subir_documento(solicitud_id):
     """Subir documento para una solicitud"""
     try:
@@ -356,8 +742,8 @@ def subir_documento(solicitud_id):
         random_suffix = random.randint(1000, 9999)
         nombre_archivo = f"{solicitud_id}_{timestamp}_{random_suffix}_{filename}"
         
-        # Ruta completa del archivo
-        ruta_archivo = os.path.join(upload_folder, nombre_archivo)
+        # Ruta del archivo: relativa a UPLOAD_FOLDER en la base, repartida en subdirectorios en disco
+        ruta_relativa, ruta_archivo = preparar_ruta(nombre_archivo)
         
         # Guardar archivo en el sistema de archivos
         try:
@@ -373,8 +759,7 @@ def subir_documento(solicitud_id):
         
         # Calcular hash del archivo para verificar integridad
         try:
-            with open(ruta_archivo, 'rb') as f:
-                hash_archivo = hashlib.sha256(f.read()).hexdigest()
+            hash_archivo = calcular_hash_archivo(ruta_archivo)
         except Exception as hash_error:
             current_app.logger.error(f"Error al calcular hash: {hash_error}")
             # Eliminar archivo si no se puede calcular el hash
@@ -392,7 +777,7 @@ def subir_documento(solicitud_id):
             nombre_archivo=nombre_archivo,
             nombre_original=filename,
             tipo_documento=tipo_documento,
-            ruta_archivo=ruta_archivo,
+            ruta_archivo=ruta_relativa,
             tamano_bytes=tamano_bytes,
             tipo_mime=tipo_mime,
             hash_archivo=hash_archivo,
@@ -401,6 +786,9 @@ def subir_documento(solicitud_id):
         
         try:
             db.session.add(documento)
+            db.session.flush()
+            publicar_al_confirmar('documento.nuevo', solicitud.usuario_id, solicitud_id=solicitud_id,
+                                  documento_id=documento.id, nombre=documento.nombre_original)
             db.session.commit()
             current_app.logger.info(f"Documento registrado en BD: ID {documento.id}")
         except Exception as db_error:
@@ -411,6 +799,12 @@ def subir_documento(solicitud_id):
             current_app.logger.error(f"Error en base de datos: {db_error}")
             return jsonify({'error': f'Error al guardar en base de datos: {str(db_error)}'}), 500
         
+        # Análisis ML del documento en segundo plano
+        try:
+            encolar('documentos.analizar', {'documento_id': documento.id}, prioridad=5, usuario_id=user_id)
+        except Exception as ml_error:
+            current_app.logger.warning(f"No se pudo encolar el análisis del documento: {ml_error}")
+        
         return jsonify({
             'message': 'Documento subido exitosamente',
             'documento': documento.to_dict()
@@ -421,8 +815,130 @@ def subir_documento(solicitud_id):
         current_app.logger.error(f"Error general al subir documento: {e}")
         return jsonify({'error': f'Error interno del servidor: {str(e)}'}), 500
 
+def _error_carga(error):
+    return jsonify({'error': str(error), **error.datos}), error.codigo
+
+@documentos_bp.route('/cargas/<int:solicitud_id>', methods=['POST'])
+@jwt_required()
+@limitar('documentos.subir')
+def iniciar_carga_documento(solicitud_id):
+    """
+    Iniciar una subida por fragmentos (archivos grandes, reanudable).
+    Body: {nombre, tamano, tipo_documento?, tipo_mime?}
+    """
+    try:
+        user_id = int(get_jwt_identity())
+        solicitud = Solicitud.query.get(solicitud_id)
+        if not solicitud:
+            return jsonify({'error': 'Solicitud no encontrada'}), 404
+        usuario = Usuario.query.get(user_id)
+        if not usuario:
+            return jsonify({'error': 'Usuario no válido'}), 401
+        if usuario.rol == 'ciudadano' and solicitud.usuario_id != user_id:
+            return jsonify({'error': 'Sin permisos para subir documentos a esta solicitud'}), 403
+        
+        data = request.get_json(silent=True) or {}
+        if not data.get('nombre') or not allowed_file(data['nombre']):
+            return jsonify({
+                'error': f'Tipo de archivo no permitido. Extensiones permitidas: {", ".join(current_app.config["ALLOWED_EXTENSIONS"])}'
+            }), 400
+        
+        carga = iniciar_carga(solicitud_id, user_id, data['nombre'], data.get('tamano'),
+                              data.get('tipo_documento', 'general'), data.get('tipo_mime'))
+        return jsonify({'carga': carga_to_dict(carga)}), 201
+    except ErrorCarga as e:
+        return _error_carga(e)
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+@documentos_bp.route('/cargas/<carga_id>', methods=['GET'])
+@jwt_required()
+def estado_carga_documento(carga_id):
+    """Bytes recibidos de una carga, para reanudarla tras un corte"""
+    try:
+        return jsonify({'carga': carga_to_dict(obtener_carga(carga_id, int(get_jwt_identity())))})
+    except ErrorCarga as e:
+        return _error_carga(e)
+
+@documentos_bp.route('/cargas/<carga_id>', methods=['PUT'])
+@jwt_required()
+@limitar('documentos.fragmento', concurrencia=True)
+def fragmento_carga_documento(carga_id):
+    """Recibir un fragmento en bruto (application/octet-stream) en la posición ?offset="""
+    try:
+        offset = request.args.get('offset', type=int)
+        if offset is None or offset < 0:
+            return jsonify({'error': 'Parámetro offset requerido'}), 400
+        carga = escribir_fragmento(carga_id, int(get_jwt_identity()), offset, request.stream,
+                                   request.content_length)
+        return jsonify({'carga': carga_to_dict(carga)})
+    except ErrorCarga as e:
+        return _error_carga(e)
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+@documentos_bp.route('/cargas/<carga_id>', methods=['DELETE'])
+@jwt_required()
+def cancelar_carga_documento(carga_id):
+    """Cancelar una carga y borrar lo recibido"""
+    try:
+        cancelar_carga(carga_id, int(get_jwt_identity()))
+        return jsonify({'message': 'Carga cancelada', 'carga_id': carga_id})
+    except ErrorCarga as e:
+        return _error_carga(e)
+
+@documentos_bp.route('/cargas/<carga_id>/finalizar', methods=['POST'])
+@jwt_required()
+def finalizar_carga_documento(carga_id):
+    """Completar la carga: mover el archivo a uploads y crear el documento. Body opcional: {sha256}"""
+    try:
+        user_id = int(get_jwt_identity())
+        data = request.get_json(silent=True) or {}
+        metadata, nombre_archivo, ruta_relativa, ruta_archivo, hash_archivo = finalizar_carga(
+            carga_id, user_id, data.get('sha256'))
+        
+        solicitud = Solicitud.query.get(metadata['solicitud_id'])
+        documento = Documento(
+            solicitud_id=metadata['solicitud_id'],
+            nombre_archivo=nombre_archivo,
+            nombre_original=metadata['nombre'],
+            tipo_documento=metadata['tipo_documento'],
+            ruta_archivo=ruta_relativa,
+            tamano_bytes=metadata['tamano'],
+            tipo_mime=metadata['tipo_mime'],
+            hash_archivo=hash_archivo,
+            subido_por=user_id
+        )
+        try:
+            db.session.add(documento)
+            db.session.flush()
+            publicar_al_confirmar('documento.nuevo', solicitud.usuario_id, solicitud_id=solicitud.id,
+                                  documento_id=documento.id, nombre=documento.nombre_original)
+            db.session.commit()
+        except Exception:
+            db.session.rollback()
+            if os.path.exists(ruta_archivo):
+                os.remove(ruta_archivo)
+            raise
+        
+        try:
+            encolar('documentos.analizar', {'documento_id': documento.id}, prioridad=5, usuario_id=user_id)
+        except Exception as ml_error:
+            current_app.logger.warning(f"No se pudo encolar el análisis del documento: {ml_error}")
+        
+        return jsonify({
+            'message': 'Documento subido exitosamente',
+            'documento': documento.to_dict()
+        }), 201
+    except ErrorCarga as e:
+        return _error_carga(e)
+    except Exception as e:
+        current_app.logger.error(f"Error al finalizar carga {carga_id}: {e}")
+        return jsonify({'error': f'Error interno del servidor: {str(e)}'}), 500
+
 @documentos_bp.route('/<int:documento_id>', methods=['GET'])
 @jwt_required()
+@solo_lectura
 def obtener_documento(documento_id):
     """Obtener información de un documento específico"""
     try:
@@ -437,8 +953,8 @@ def obtener_documento(documento_id):
         if usuario.rol == 'ciudadano' and documento.solicitud.usuario_id != user_id:
             return jsonify({'error': 'Sin permisos para acceder a este documento'}), 403
         
-        # Verificar que el archivo físico existe
-        if not os.path.exists(documento.ruta_archivo):
+        # Verificar que el archivo físico existe (estado guardado, sin consultar el disco)
+        if not documento.archivo_existe:
             return jsonify({
                 'error': 'Archivo físico no encontrado',
                 'documento': documento.to_dict()
@@ -452,8 +968,47 @@ def obtener_documento(documento_id):
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
+@documentos_bp.route('/', methods=['GET'])
+@jwt_required()
+@solo_lectura
+def listar_documentos():
+    """Listar documentos filtrando por el resultado ML (columnas generadas e indexadas) y estado"""
+    try:
+        user_id = int(get_jwt_identity())
+        usuario = Usuario.query.get(user_id)
+        if usuario.rol not in ['administrativo', 'supervisor', 'admin']:
+            return jsonify({'error': 'Sin permisos para listar documentos'}), 403
+        
+        page = max(request.args.get('page', 1, type=int), 1)
+        per_page = min(max(request.args.get('per_page', 50, type=int), 1), 200)
+        
+        consulta = Documento.query
+        if request.args.get('estado_sugerido'):
+            consulta = consulta.filter(Documento.ml_estado_sugerido == request.args['estado_sugerido'])
+        if request.args.get('tipo_detectado'):
+            consulta = consulta.filter(Documento.ml_tipo_detectado == request.args['tipo_detectado'])
+        if request.args.get('estado_validacion'):
+            consulta = consulta.filter(Documento.estado_validacion == request.args['estado_validacion'])
+        if request.args.get('solicitud_id', type=int):
+            consulta = consulta.filter(Documento.solicitud_id == request.args.get('solicitud_id', type=int))
+        
+        total = consulta.count()
+        documentos = consulta.order_by(Documento.id.desc()).offset((page - 1) * per_page).limit(per_page).all()
+        campos = campos_solicitados()
+        
+        return jsonify({
+            'documentos': [doc.to_dict(campos, crudo=True) for doc in documentos],
+            'total': total,
+            'page': page,
+            'per_page': per_page
+        })
+        
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
 @documentos_bp.route('/solicitud/<int:solicitud_id>', methods=['GET'])
 @jwt_required()
+@solo_lectura
 def obtener_documentos_solicitud(solicitud_id):
     """Obtener todos los documentos de una solicitud"""
     try:
@@ -468,13 +1023,14 @@ def obtener_documentos_solicitud(solicitud_id):
         if usuario.rol == 'ciudadano' and solicitud.usuario_id != user_id:
             return jsonify({'error': 'Sin permisos para acceder a esta solicitud'}), 403
         
-        documentos = Documento.query.filter_by(solicitud_id=solicitud_id).all()
+        consulta = Documento.query.filter_by(solicitud_id=solicitud_id)
+        if request.args.get('estado_sugerido'):
+            consulta = consulta.filter(Documento.ml_estado_sugerido == request.args['estado_sugerido'])
+        documentos = consulta.all()
         
-        documentos_data = []
-        for doc in documentos:
-            doc_data = doc.to_dict()
-            doc_data['archivo_existe'] = os.path.exists(doc.ruta_archivo)
-            documentos_data.append(doc_data)
+        # archivo_existe es una columna: el listado no hace ninguna llamada al sistema de archivos
+        campos = campos_solicitados()
+        documentos_data = [doc.to_dict(campos, crudo=True) for doc in documentos]
         
         return jsonify({
             'documentos': documentos_data,
@@ -500,30 +1056,57 @@ def descargar_documento(documento_id):
         if usuario.rol == 'ciudadano' and documento.solicitud.usuario_id != user_id:
             return jsonify({'error': 'Sin permisos para descargar este documento'}), 403
         
-        # Verificar que el archivo existe
-        if not os.path.exists(documento.ruta_archivo):
+        # Range, ETag (hash del archivo) e If-None-Match/If-Modified-Since; ?inline=true para visores
+        try:
+            return enviar_documento(documento, adjunto=request.args.get('inline', '').lower() not in ('true', '1'))
+        except FileNotFoundError:
+            if documento.archivo_existe:
+                documento.archivo_existe = False
+                db.session.commit()
             return jsonify({'error': 'Archivo físico no encontrado'}), 404
+        except ArchivoCorrupto as corrupto:
+            current_app.logger.warning(f"Archivo del documento {documento_id} no coincide: {corrupto}")
+            return jsonify({'error': 'Archivo corrupto o modificado'}), 422
         
-        # Verificar integridad del archivo (opcional)
-        try:
-            with open(documento.ruta_archivo, 'rb') as f:
-                hash_actual = hashlib.sha256(f.read()).hexdigest()
-            
-            if hash_actual != documento.hash_archivo:
-                current_app.logger.warning(f"Hash del archivo {documento_id} no coincide")
-                return jsonify({'error': 'Archivo corrupto o modificado'}), 422
-        except Exception as hash_error:
-            current_app.logger.error(f"Error verificando hash: {hash_error}")
+    except Exception as e:
+        current_app.logger.error(f"Error descargando documento: {e}")
+        return jsonify({'error': str(e)}), 500
+
+@documentos_bp.route('/<int:documento_id>/vista-previa', methods=['GET'])
+@jwt_required()
+def vista_previa_documento(documento_id):
+    """Miniatura (?tamano=miniatura, por defecto) o primera página (?tamano=pagina) de un jpg/png/pdf"""
+    try:
+        user_id = int(get_jwt_identity())
+        usuario = Usuario.query.get(user_id)
         
-        return send_file(
-            documento.ruta_archivo,
-            as_attachment=True,
-            download_name=documento.nombre_original,
-            mimetype=documento.tipo_mime
-        )
+        documento = Documento.query.get(documento_id)
+        if not documento:
+            return jsonify({'error': 'Documento no encontrado'}), 404
+        if usuario.rol == 'ciudadano' and documento.solicitud.usuario_id != user_id:
+            return jsonify({'error': 'Sin permisos para ver este documento'}), 403
+        
+        variante = request.args.get('tamano', 'miniatura')
+        if variante not in current_app.config['PREVIEWS_TAMANOS']:
+            return jsonify({'error': f"tamano debe ser uno de: {', '.join(current_app.config['PREVIEWS_TAMANOS'])}"}), 400
+        if not archivo_disponible(documento):
+            return jsonify({'error': 'Archivo físico no encontrado'}), 404
+        
+        try:
+            ruta, tipo = obtener_preview(documento, variante)
+        except PreviewOcupada:
+            return respuesta_ocupado()
+        if ruta is None:
+            return jsonify({'error': 'Vista previa no disponible para este documento'}), 404
+        
+        # La vista previa depende solo del contenido (hash), así que puede guardarse un día
+        respuesta = send_file(ruta, mimetype=tipo, etag=f'{documento.hash_archivo}-{variante}',
+                              conditional=True, max_age=86400)
+        respuesta.headers['Cache-Control'] = 'private, max-age=86400'
+        return respuesta
         
     except Exception as e:
-        current_app.logger.error(f"Error descargando documento: {e}")
+        current_app.logger.error(f"Error generando vista previa: {e}")
         return jsonify({'error': str(e)}), 500
 
 @documentos_bp.route('/<int:documento_id>', methods=['DELETE'])
@@ -542,11 +1125,12 @@ def eliminar_documento(documento_id):
         if not documento:
             return jsonify({'error': 'Documento no encontrado'}), 404
         
-        # Eliminar archivo físico si existe
-        if os.path.exists(documento.ruta_archivo):
+        # Eliminar archivo físico si existe (los bytes de un documento archivado quedan en su paquete)
+        ruta_archivo = ruta_fisica(documento.ruta_archivo)
+        if documento.almacenamiento == 'activo' and os.path.exists(ruta_archivo):
             try:
-                os.remove(documento.ruta_archivo)
-                current_app.logger.info(f"Archivo físico eliminado: {documento.ruta_archivo}")
+                os.remove(ruta_archivo)
+                current_app.logger.info(f"Archivo físico eliminado: {ruta_archivo}")
             except Exception as delete_error:
                 current_app.logger.error(f"Error eliminando archivo físico: {delete_error}")
         
@@ -565,6 +1149,7 @@ def eliminar_documento(documento_id):
 
 @documentos_bp.route('/verificar-integridad', methods=['POST'])
 @jwt_required()
+@limitar('documentos.integridad')
 def verificar_integridad_documentos():
     """Verificar la integridad de todos los documentos"""
     try:
@@ -575,47 +1160,38 @@ def verificar_integridad_documentos():
         if usuario.rol not in ['admin', 'supervisor']:
             return jsonify({'error': 'Sin permisos para verificar integridad'}), 403
         
-        documentos = Documento.query.all()
-        resultados = {
-            'total_documentos': len(documentos),
-            'archivos_faltantes': [],
-            'hashes_incorrectos': [],
-            'documentos_validos': 0
-        }
-        
-        for documento in documentos:
-            # Verificar que el archivo existe
-            if not os.path.exists(documento.ruta_archivo):
-                resultados['archivos_faltantes'].append({
-                    'id': documento.id,
-                    'nombre': documento.nombre_original,
-                    'ruta': documento.ruta_archivo
-                })
-                continue
-            
-            # Verificar hash
-            try:
-                with open(documento.ruta_archivo, 'rb') as f:
-                    hash_actual = hashlib.sha256(f.read()).hexdigest()
-                
-                if hash_actual != documento.hash_archivo:
-                    resultados['hashes_incorrectos'].append({
-                        'id': documento.id,
-                        'nombre': documento.nombre_original,
-                        'hash_esperado': documento.hash_archivo,
-                        'hash_actual': hash_actual
-                    })
-                else:
-                    resultados['documentos_validos'] += 1
-                    
-            except Exception as hash_error:
-                resultados['hashes_incorrectos'].append({
-                    'id': documento.id,
-                    'nombre': documento.nombre_original,
-                    'error': str(hash_error)
-                })
-        
-        return jsonify(resultados)
+        tarea_id = encolar('documentos.verificar_integridad', clave_unica='documentos.verificar_integridad',
+                           usuario_id=user_id, compartir_en_curso=True)
+        return jsonify({
+            'message': 'Verificación de integridad encolada',
+            'tarea': tarea_to_dict(obtener_cola().obtener(tarea_id))
+        }), 202
+        
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+@documentos_bp.route('/archivar', methods=['POST'])
+@jwt_required()
+@limitar('documentos.archivar')
+def archivar_documentos():
+    """Pasar a paquetes comprimidos los documentos de solicitudes finalizadas hace más de ?dias= días"""
+    try:
+        user_id = int(get_jwt_identity())
+        usuario = Usuario.query.get(user_id)
+        
+        if usuario.rol not in ['admin', 'supervisor']:
+            return jsonify({'error': 'Sin permisos para archivar documentos'}), 403
+        
+        dias = request.args.get('dias', type=int)
+        if dias is not None and dias < 0:
+            return jsonify({'error': 'dias debe ser un entero no negativo'}), 400
+        
+        tarea_id = encolar('documentos.archivar', {'dias': dias}, clave_unica='documentos.archivar',
+                           usuario_id=user_id, compartir_en_curso=True)
+        return jsonify({
+            'message': 'Archivado de documentos encolado',
+            'tarea': tarea_to_dict(obtener_cola().obtener(tarea_id))
+        }), 202
         
     except Exception as e:
         return jsonify({'error': str(e)}), 500
@@ -626,6 +1202,7 @@ def verificar_integridad_documentos():
 
 @ml_bp.route('/procesar-solicitudes', methods=['POST'])
 @jwt_required()
+@limitar('ml.procesar')
 def procesar_solicitudes_ml():
     """Procesar solicitudes pendientes con Machine Learning"""
     try:
@@ -636,39 +1213,19 @@ def procesar_solicitudes_ml():
         if usuario.rol not in ['administrativo', 'supervisor', 'admin']:
             return jsonify({'error': 'Sin permisos para ejecutar procesamiento ML'}), 403
         
-        # Obtener solicitudes pendientes de procesamiento
-        solicitudes_pendientes = Solicitud.query.filter_by(procesado_ml=False).all()
-        
-        procesadas = 0
-        for solicitud in solicitudes_pendientes:
-            # Aquí iría la lógica de ML real
-            # Por ahora, asignamos prioridad basada en tipo de trámite
-            if solicitud.tramite.categoria == 'licencias':
-                solicitud.prioridad_ml = 'alta'
-                solicitud.puntuacion_ml = 85.0
-            elif solicitud.tramite.categoria == 'certificados':
-                solicitud.prioridad_ml = 'media'
-                solicitud.puntuacion_ml = 65.0
-            else:
-                solicitud.prioridad_ml = 'baja'
-                solicitud.puntuacion_ml = 45.0
-            
-            solicitud.procesado_ml = True
-            procesadas += 1
-        
-        db.session.commit()
-        
+        tarea_id = encolar('ml.procesar_pendientes', clave_unica='ml.procesar_pendientes',
+                           prioridad=5, usuario_id=user_id)
         return jsonify({
-            'message': f'Se procesaron {procesadas} solicitudes con ML',
-            'solicitudes_procesadas': procesadas
-        })
+            'message': 'Procesamiento ML encolado',
+            'tarea': tarea_to_dict(obtener_cola().obtener(tarea_id))
+        }), 202
         
     except Exception as e:
-        db.session.rollback()
         return jsonify({'error': str(e)}), 500
 
 @ml_bp.route('/estadisticas', methods=['GET'])
 @jwt_required()
+@solo_lectura
 def get_estadisticas_ml():
     """Obtener estadísticas del sistema ML"""
     try:
@@ -685,12 +1242,21 @@ def get_estadisticas_ml():
             Solicitud.prioridad_ml.isnot(None)
         ).group_by(Solicitud.prioridad_ml).all()
         
+        # Resultado del análisis de documentos, agregado en la base sobre la columna generada
+        estados_documentos = db.session.query(
+            Documento.ml_estado_sugerido,
+            db.func.count(Documento.id)
+        ).filter(
+            Documento.ml_estado_sugerido.isnot(None)
+        ).group_by(Documento.ml_estado_sugerido).all()
+        
         return jsonify({
             'total_solicitudes': total_solicitudes,
             'procesadas_ml': procesadas_ml,
             'pendientes_ml': pendientes_ml,
             'porcentaje_procesado': round((procesadas_ml / total_solicitudes * 100), 2) if total_solicitudes > 0 else 0,
-            'distribucion_prioridades': dict(prioridades)
+            'distribucion_prioridades': dict(prioridades),
+            'documentos_por_estado_sugerido': dict(estados_documentos)
         })
         
     except Exception as e:
@@ -698,6 +1264,7 @@ def get_estadisticas_ml():
 
 @ml_bp.route('/entrenar-modelo-prioridad', methods=['POST'])
 @jwt_required()
+@limitar('ml.entrenar')
 def entrenar_modelo_prioridad():
     """Entrenar el modelo ML de prioridad con datos históricos"""
     try:
@@ -705,36 +1272,214 @@ def entrenar_modelo_prioridad():
         usuario = Usuario.query.get(user_id)
         if usuario.rol not in ['administrativo', 'supervisor', 'admin']:
             return jsonify({'error': 'Sin permisos para entrenar el modelo ML'}), 403
-        resultado = solicitud_processor.train_priority_model_from_db()
-        return jsonify(resultado)
+        # Peticiones simultáneas comparten el entrenamiento pendiente o en curso
+        tarea_id = encolar('ml.entrenar_prioridad', {'usuario_id': user_id}, clave_unica='ml.entrenar_prioridad',
+                           prioridad=5, usuario_id=user_id, compartir_en_curso=True)
+        return jsonify({
+            'message': 'Entrenamiento del modelo encolado',
+            'tarea': tarea_to_dict(obtener_cola().obtener(tarea_id))
+        }), 202
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
 @ml_bp.route('/comparacion-prioridad', methods=['GET'])
 @jwt_required()
+@solo_lectura
 def comparacion_prioridad():
-    """Obtener datos de comparación entre prioridad real y predicha para gráficos"""
+    """Evaluación del modelo de prioridad: matriz de confusión, precisión/recall por clase y deriva"""
     try:
         user_id = int(get_jwt_identity())
         usuario = Usuario.query.get(user_id)
         if usuario.rol not in ['administrativo', 'supervisor', 'admin']:
             return jsonify({'error': 'Sin permisos para ver comparación ML'}), 403
-        data = solicitud_processor.get_priority_comparison_data()
-        print('DEBUG comparacion_prioridad data:', data)  # <-- Log para depuración
+        # Peticiones simultáneas comparten un único cálculo
+        data = una_vez('ml.comparacion_prioridad', solicitud_processor.get_priority_comparison_data)
+        current_app.logger.debug(f"comparacion_prioridad: {data['ventana']['evaluadas']} evaluadas")
         return jsonify({'data': data})
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
+def _supervisor_actual():
+    """Id del usuario si puede gestionar versiones del modelo (supervisor o admin), si no None"""
+    user_id = int(get_jwt_identity())
+    usuario = Usuario.query.get(user_id)
+    return user_id if usuario and usuario.rol in ['supervisor', 'admin'] else None
+
+def _respuesta_manifiesto(manifiesto):
+    return jsonify({
+        'manifiesto': manifiesto,
+        'versiones': servicio_modelos.versiones_disponibles(),
+        # Comparaciones en sombra de este proceso, por versión del candidato
+        'sombra': registro_metricas.resumen_sombra()
+    })
+
+@ml_bp.route('/modelos', methods=['GET'])
+@jwt_required()
+def obtener_modelos():
+    """Manifiesto de modelos de prioridad (activo, candidato, historial) y versiones disponibles"""
+    if _supervisor_actual() is None:
+        return jsonify({'error': 'Sin permisos para gestionar modelos ML'}), 403
+    return _respuesta_manifiesto(servicio_modelos.leer_manifiesto())
+
+@ml_bp.route('/modelos/candidato', methods=['POST'])
+@jwt_required()
+def fijar_candidato_modelo():
+    """Poner una versión como candidata: {"version", "modo": "sombra"|"ab", "fraccion", "muestreo"}"""
+    user_id = _supervisor_actual()
+    if user_id is None:
+        return jsonify({'error': 'Sin permisos para gestionar modelos ML'}), 403
+    data = request.get_json(silent=True) or {}
+    try:
+        manifiesto = servicio_modelos.fijar_candidato(
+            data.get('version'), data.get('modo', 'sombra'), float(data.get('fraccion', 0.1)),
+            float(data.get('muestreo', 1.0)), usuario_id=user_id)
+    except (ErrorManifiesto, TypeError, ValueError) as e:
+        return jsonify({'error': str(e)}), 400
+    return _respuesta_manifiesto(manifiesto)
+
+@ml_bp.route('/modelos/candidato', methods=['DELETE'])
+@jwt_required()
+def descartar_candidato_modelo():
+    """Dejar de evaluar el candidato actual"""
+    user_id = _supervisor_actual()
+    if user_id is None:
+        return jsonify({'error': 'Sin permisos para gestionar modelos ML'}), 403
+    try:
+        return _respuesta_manifiesto(servicio_modelos.descartar_candidato(user_id))
+    except ErrorManifiesto as e:
+        return jsonify({'error': str(e)}), 409
+
+@ml_bp.route('/modelos/promover', methods=['POST'])
+@jwt_required()
+def promover_modelo():
+    """El candidato pasa a ser el modelo activo en todos los procesos"""
+    user_id = _supervisor_actual()
+    if user_id is None:
+        return jsonify({'error': 'Sin permisos para gestionar modelos ML'}), 403
+    try:
+        return _respuesta_manifiesto(servicio_modelos.promover(user_id))
+    except ErrorManifiesto as e:
+        return jsonify({'error': str(e)}), 409
+
+@ml_bp.route('/modelos/revertir', methods=['POST'])
+@jwt_required()
+def revertir_modelo():
+    """Volver al modelo activo anterior"""
+    user_id = _supervisor_actual()
+    if user_id is None:
+        return jsonify({'error': 'Sin permisos para gestionar modelos ML'}), 403
+    try:
+        return _respuesta_manifiesto(servicio_modelos.revertir(user_id))
+    except ErrorManifiesto as e:
+        return jsonify({'error': str(e)}), 409
+
 # Elimina el decorador que causa error y usa una bandera global para cargar solo una vez
 modelo_ml_cargado = False
 
-@ml_bp.before_app_request
-def cargar_modelo_ml_si_es_necesario():
+def _cargar_modelo_ml():
     global modelo_ml_cargado
+    # Se vuelve a comprobar: una petición que vio la bandera en False puede llegar
+    # cuando la carga anterior ya terminó
+    if not modelo_ml_cargado:
+        solicitud_processor.load_priority_model()
+        print('Modelo y label encoders de prioridad ML cargados correctamente.')
+        modelo_ml_cargado = True
+
+# Solo antes de las rutas de ML: el resto de la API no necesita cargar la pila de ML
+@ml_bp.before_request
+def cargar_modelo_ml_si_es_necesario():
     if not modelo_ml_cargado:
         try:
-            solicitud_processor.load_priority_model()
-            print('Modelo y label encoders de prioridad ML cargados correctamente.')
-            modelo_ml_cargado = True
+            # Las peticiones concurrentes esperan a una sola carga en vez de repetirla
+            una_vez('ml.cargar_modelo', _cargar_modelo_ml)
         except Exception as e:
             print(f'No se pudo cargar el modelo ML al iniciar: {e}')
+
+# ================================================================================================
+# RUTAS DE EVENTOS EN TIEMPO REAL (SSE)
+# ================================================================================================
+
+@eventos_bp.route('/stream', methods=['GET'])
+@jwt_required(locations=['headers', 'query_string'])
+def stream_eventos():
+    """
+    Stream Server-Sent Events con los cambios de estado, documentos nuevos y resultados ML
+    de las solicitudes visibles para el usuario. EventSource no permite cabeceras, por eso
+    también se acepta el token en ?jwt=.
+    """
+    user_id = int(get_jwt_identity())
+    usuario = Usuario.query.get(user_id)
+    if not usuario:
+        return jsonify({'error': 'Usuario no válido'}), 401
+
+    # Cada stream abierto retiene un hilo del worker: se acota por proceso (el cliente reconecta tras Retry-After)
+    if not abrir_stream(current_app.config['SSE_MAX_CONEXIONES']):
+        return respuesta_ocupado()
+
+    ultimo_id = request.headers.get('Last-Event-ID', type=int)
+    suscripcion = obtener_backend().suscribir(canales_usuario(user_id, usuario.rol), ultimo_id=ultimo_id)
+    heartbeat = current_app.config['SSE_HEARTBEAT_SEGUNDOS']
+
+    # El generador no usa la sesión de BD: la conexión se libera al terminar la vista
+    def generar():
+        try:
+            yield 'retry: 5000\n\n'
+            while True:
+                recibido = suscripcion.obtener(timeout=heartbeat)
+                if recibido is None:
+                    yield ': ping\n\n'
+                    continue
+                yield formatear_evento(*recibido)
+        finally:
+            suscripcion.cerrar()
+
+    respuesta = Response(generar(), mimetype='text/event-stream', headers={
+        'Cache-Control': 'no-cache',
+        'X-Accel-Buffering': 'no'
+    })
+    # call_on_close se ejecuta aunque el generador no llegue a empezar
+    respuesta.call_on_close(cerrar_stream)
+    return respuesta
+
+# ================================================================================================
+# RUTAS DE TAREAS EN SEGUNDO PLANO
+# ================================================================================================
+
+@tareas_bp.route('/<int:tarea_id>', methods=['GET'])
+@jwt_required()
+def obtener_tarea(tarea_id):
+    """Estado y resultado de una tarea en segundo plano"""
+    try:
+        user_id = int(get_jwt_identity())
+        usuario = Usuario.query.get(user_id)
+        
+        datos = obtener_cola().obtener(tarea_id)
+        if not datos:
+            return jsonify({'error': 'Tarea no encontrada'}), 404
+        
+        # El personal ve todas las tareas; el resto solo las propias
+        if usuario.rol not in ['administrativo', 'supervisor', 'admin'] and datos['usuario_id'] != user_id:
+            return jsonify({'error': 'Sin permisos para ver esta tarea'}), 403
+        
+        return jsonify(tarea_to_dict(datos))
+        
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+@tareas_bp.route('/', methods=['GET'])
+@jwt_required()
+def listar_tareas():
+    """Listar las tareas recientes (propias, o todas para el personal)"""
+    try:
+        user_id = int(get_jwt_identity())
+        usuario = Usuario.query.get(user_id)
+        
+        estado = request.args.get('estado')
+        limite = min(request.args.get('limite', 50, type=int), 200)
+        usuario_filtro = None if usuario.rol in ['administrativo', 'supervisor', 'admin'] else user_id
+        
+        tareas = obtener_cola().listar(usuario_id=usuario_filtro, estado=estado, limite=limite)
+        return jsonify([tarea_to_dict(t) for t in tareas])
+        
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
@@ -0,0 +1,113 @@
+"""
+Serialización JSON de las respuestas.
+
+- Usa orjson si está instalado (mucho más rápido que json de la biblioteca estándar)
+  y json en caso contrario; se instala como proveedor JSON de Flask, así que
+  jsonify() lo usa en todas las rutas.
+- JSONTexto: columnas que ya guardan JSON como texto (requisitos, datos_adicionales,
+  resultado_ml...) se insertan tal cual en la respuesta, sin construir el objeto en
+  Python ni volver a serializarlo (el texto se valida al escribirlo, no al leerlo).
+  Los modelos lo devuelven con to_dict(crudo=True).
+- campos_solicitados(): lee ?fields=a,b,c para que los listados solo serialicen
+  las columnas que muestran.
+"""
+from flask import request # type: ignore
+from flask.json.provider import DefaultJSONProvider # type: ignore
+import json
+import re
+import secrets
+
+try:
+    import orjson # type: ignore
+except ImportError:  # pragma: no cover - orjson es opcional
+    orjson = None
+
+
+class JSONTexto:
+    """Texto JSON ya válido que se inserta sin volver a parsearlo"""
+    __slots__ = ('texto',)
+
+    def __init__(self, texto):
+        self.texto = texto
+
+
+def texto_json(texto, vacio):
+    """JSONTexto de una columna JSON-en-texto; vacío si no hay valor o no es un objeto/lista JSON"""
+    if texto:
+        # Las columnas TextoJSON se validan al escribir (ver app/models.py), así que basta
+        # una comprobación barata del tipo para insertarlas sin decodificar
+        limpio = texto.strip()
+        if limpio[:1] in ('{', '[') and limpio[-1:] in ('}', ']'):
+            return JSONTexto(limpio)
+    return JSONTexto(vacio)
+
+
+def construir_campos(objeto, obtener, campos, crudo=False):
+    """Diccionario con las claves pedidas (None = todas); obtener: campo -> función(objeto, crudo)
+
+    Solo se evalúan los campos pedidos, así ?fields= no paga conversiones (ni cargas
+    de columnas diferidas) de las claves que luego se descartarían.
+    """
+    if campos is None:
+        return {clave: valor(objeto, crudo) for clave, valor in obtener.items()}
+    return {clave: valor(objeto, crudo) for clave, valor in obtener.items() if clave in campos}
+
+
+def campos_solicitados(parametro='fields'):
+    """Conjunto de campos pedidos en ?fields=a,b,c (None si no se indicó)"""
+    valor = request.args.get(parametro)
+    if not valor:
+        return None
+    return {campo.strip() for campo in valor.split(',') if campo.strip()}
+
+
+def dumps(datos, default, sort_keys=False, indent=None, ensure_ascii=True):
+    """Serializar a str insertando los JSONTexto tal cual"""
+    crudos = []
+    marca = secrets.token_hex(8)
+
+    def _default(o):
+        if isinstance(o, JSONTexto):
+            # Marcador único por llamada que luego se reemplaza por el texto original
+            crudos.append(o.texto)
+            return f'\x00{marca}:{len(crudos) - 1}\x00'
+        return default(o)
+
+    if orjson is not None:
+        # Las fechas pasan por default() para mantener el formato de Flask
+        opciones = orjson.OPT_PASSTHROUGH_DATETIME | orjson.OPT_NON_STR_KEYS
+        if sort_keys:
+            opciones |= orjson.OPT_SORT_KEYS
+        if indent:
+            opciones |= orjson.OPT_INDENT_2
+        texto = orjson.dumps(datos, default=_default, option=opciones).decode()
+    else:
+        texto = json.dumps(datos, default=_default, sort_keys=sort_keys, indent=indent, ensure_ascii=ensure_ascii,
+                           separators=(',', ':') if indent is None else None)
+
+    if not crudos:
+        return texto
+    patron = re.compile(r'"\\u0000' + marca + r':(\d+)\\u0000"')
+    return patron.sub(lambda m: crudos[int(m.group(1))], texto)
+
+
+class ProveedorJSON(DefaultJSONProvider):
+    """Proveedor JSON de Flask con backend rápido y soporte de JSONTexto"""
+
+    def dumps(self, obj, **kwargs):
+        return dumps(obj, default=kwargs.pop('default', self.default),
+                     sort_keys=kwargs.pop('sort_keys', self.sort_keys), indent=kwargs.pop('indent', None),
+                     ensure_ascii=kwargs.pop('ensure_ascii', self.ensure_ascii))
+
+    def response(self, *args, **kwargs):
+        obj = self._prepare_response_obj(args, kwargs)
+        indent = 2 if self.compact is False or (self.compact is None and self._app.debug) else None
+        return self._app.response_class(
+            dumps(obj, default=self.default, sort_keys=self.sort_keys, indent=indent,
+                  ensure_ascii=self.ensure_ascii) + '\n',
+            mimetype=self.mimetype
+        )
+
+
+def init_app(app):
+    app.json = ProveedorJSON(app)
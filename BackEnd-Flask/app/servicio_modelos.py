@@ -0,0 +1,421 @@
+"""
+Servicio del modelo de prioridad por manifiesto: modelo activo, candidato en sombra o A/B,
+promoción y reversión.
+
+El manifiesto (model_versions/manifiesto.json) decide qué versión sirve cada proceso:
+
+    {"activo": "20250604_114559",
+     "candidato": {"version": "20250610_090000", "modo": "sombra", "fraccion": 0.1, "muestreo": 1.0},
+     "anteriores": ["20250501_080000"],
+     "historial": [{"accion": "promover", "version": "...", "usuario_id": 1, "fecha": "..."}]}
+
+- sombra: lo servido no cambia; el candidato predice lo mismo en un hilo aparte (cola
+  acotada a MAX_PENDIENTES_SOMBRA lotes, una fracción `muestreo` de las llamadas) y
+  se registran los desacuerdos y su latencia. En el camino crítico solo queda encolar,
+  y ese tiempo se mide (docucontrol_sombra_sobrecosto_segundos).
+- ab: el candidato sirve una fracción `fraccion` de las solicitudes, elegida por hash
+  del id (estable entre llamadas).
+
+Hay dos caminos de servicio con referencias distintas, y las métricas de sombra se
+etiquetan por `origen`:
+- 'procesar': la puntuación por lotes (process_solicitudes, la que guarda prioridad_ml)
+  usa reglas de negocio; el candidato se compara con las reglas o, en ab, sustituye
+  a las reglas en su fracción (el resultado indica en 'modelo' quién lo sirvió).
+- 'predecir': predict_priority usa el modelo activo; el candidato se compara con él
+  o, en ab, lo sustituye en su fracción.
+
+Promover deja al candidato como activo y apila el anterior; revertir vuelve al último
+apilado. Las modificaciones (web y workers de tareas) se serializan entre procesos con
+un archivo de candado creado en exclusiva, como las cargas por fragmentos. Cada proceso relee el manifiesto cuando cambia (como mucho cada
+REVISAR_SEGUNDOS), así que una promoción llega a todos los workers sin reiniciarlos.
+Sin manifiesto se sirve la versión más reciente de model_versions, como antes.
+"""
+from app.metricas import registro as registro_metricas
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from datetime import datetime
+import glob
+import json
+import logging
+import os
+import random
+import threading
+import time
+import zlib
+
+DIRECTORIO_VERSIONES = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'model_versions')
+RUTA_MANIFIESTO = os.path.join(DIRECTORIO_VERSIONES, 'manifiesto.json')
+RUTA_CANDADO = RUTA_MANIFIESTO + '.lock'
+CANDADO_ESPERA_SEGUNDOS = 10
+CANDADO_VENCIDO_SEGUNDOS = 60  # Candado de un proceso que murió a mitad de una modificación
+REVISAR_SEGUNDOS = 5
+MAX_PENDIENTES_SOMBRA = 2  # Lotes en espera del hilo de sombra; los que no caben se descartan
+MAX_HISTORIAL = 50
+MODOS = ('sombra', 'ab')
+
+logger_sombra = logging.getLogger('docucontrol.sombra')
+_lock_manifiesto = threading.Lock()
+
+
+class ErrorManifiesto(Exception):
+    """Operación de manifiesto no válida (versión inexistente, sin candidato, nada que revertir)"""
+
+
+# ------------------------------------------------------------------------------------------------
+# Manifiesto
+# ------------------------------------------------------------------------------------------------
+
+def usar_directorio(directorio):
+    """Guardar versiones, evaluaciones y manifiesto en otro directorio (benchmarks, pruebas)"""
+    global DIRECTORIO_VERSIONES, RUTA_MANIFIESTO, RUTA_CANDADO
+    DIRECTORIO_VERSIONES = os.path.abspath(directorio)
+    RUTA_MANIFIESTO = os.path.join(DIRECTORIO_VERSIONES, 'manifiesto.json')
+    RUTA_CANDADO = RUTA_MANIFIESTO + '.lock'
+
+
+def ruta_version(version):
+    return os.path.join(DIRECTORIO_VERSIONES, f'priority_model_{version}.joblib')
+
+
+def version_de_ruta(ruta):
+    """Versión de un archivo priority_model_<version>.joblib de model_versions (None si es otro archivo)"""
+    nombre = os.path.basename(ruta)
+    if os.path.samefile(os.path.dirname(os.path.abspath(ruta)), DIRECTORIO_VERSIONES) \
+            and nombre.startswith('priority_model_') and nombre.endswith('.joblib'):
+        return nombre[len('priority_model_'):-len('.joblib')]
+    return None
+
+
+def versiones_disponibles():
+    return sorted(version_de_ruta(ruta)
+                  for ruta in glob.glob(os.path.join(DIRECTORIO_VERSIONES, 'priority_model_*.joblib')))
+
+
+def leer_manifiesto():
+    try:
+        with open(RUTA_MANIFIESTO, encoding='utf-8') as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return None
+
+
+def _guardar_manifiesto(manifiesto):
+    os.makedirs(DIRECTORIO_VERSIONES, exist_ok=True)
+    temporal = f'{RUTA_MANIFIESTO}.{os.getpid()}.tmp'
+    with open(temporal, 'w', encoding='utf-8') as f:
+        json.dump(manifiesto, f, indent=2)
+    os.replace(temporal, RUTA_MANIFIESTO)
+
+
+@contextmanager
+def _candado_manifiesto():
+    """Candado entre hilos y entre procesos (archivo creado en exclusiva, portable, sin fcntl)"""
+    with _lock_manifiesto:
+        os.makedirs(DIRECTORIO_VERSIONES, exist_ok=True)
+        limite = time.monotonic() + CANDADO_ESPERA_SEGUNDOS
+        while True:
+            try:
+                os.close(os.open(RUTA_CANDADO, os.O_CREAT | os.O_EXCL | os.O_WRONLY))
+                break
+            except FileExistsError:
+                pass
+            try:
+                vencido = time.time() - os.path.getmtime(RUTA_CANDADO) > CANDADO_VENCIDO_SEGUNDOS
+            except OSError:
+                continue  # Se liberó entre el intento y la comprobación
+            if vencido:
+                try:
+                    os.remove(RUTA_CANDADO)
+                except OSError:
+                    pass
+            elif time.monotonic() > limite:
+                raise ErrorManifiesto('El manifiesto está bloqueado por otra operación; reintente')
+            else:
+                time.sleep(0.05)
+        try:
+            yield
+        finally:
+            os.remove(RUTA_CANDADO)
+
+
+def _modificar(accion, usuario_id, cambio, registrando=None):
+    """
+    Leer, aplicar cambio(manifiesto) y guardar con una entrada de historial, todo con el
+    candado tomado. cambio devuelve la versión que se anota en el historial.
+    """
+    with _candado_manifiesto():
+        manifiesto = leer_manifiesto()
+        if manifiesto is None:
+            # Sin manifiesto se servía la versión más reciente (sin contar la que se está registrando)
+            versiones = [v for v in versiones_disponibles() if v != registrando]
+            manifiesto = {'activo': versiones[-1] if versiones else None, 'candidato': None,
+                          'anteriores': [], 'historial': []}
+        version = cambio(manifiesto)
+        manifiesto['historial'] = (manifiesto['historial'] + [{
+            'accion': accion, 'version': version, 'usuario_id': usuario_id,
+            'fecha': datetime.utcnow().isoformat()
+        }])[-MAX_HISTORIAL:]
+        _guardar_manifiesto(manifiesto)
+        return manifiesto
+
+
+def _poner_candidato(manifiesto, version, modo, fraccion, muestreo):
+    if version not in versiones_disponibles():
+        raise ErrorManifiesto(f'No existe la versión de modelo {version}')
+    if manifiesto['activo'] is None or manifiesto['activo'] == version:
+        # Primer modelo (o el mismo): no hay con qué compararlo
+        manifiesto['activo'], manifiesto['candidato'] = version, None
+    else:
+        manifiesto['candidato'] = {'version': version, 'modo': modo, 'fraccion': fraccion, 'muestreo': muestreo}
+    return version
+
+
+def fijar_candidato(version, modo='sombra', fraccion=0.1, muestreo=1.0, usuario_id=None):
+    if modo not in MODOS:
+        raise ErrorManifiesto(f'Modo no válido: {modo} (use {" o ".join(MODOS)})')
+    if not (0 <= fraccion <= 1 and 0 <= muestreo <= 1):
+        raise ErrorManifiesto('fraccion y muestreo deben estar entre 0 y 1')
+    return _modificar('candidato', usuario_id,
+                      lambda manifiesto: _poner_candidato(manifiesto, version, modo, fraccion, muestreo),
+                      registrando=version)
+
+
+def descartar_candidato(usuario_id=None):
+    def cambio(manifiesto):
+        if not manifiesto.get('candidato'):
+            raise ErrorManifiesto('No hay un modelo candidato')
+        version = manifiesto['candidato']['version']
+        manifiesto['candidato'] = None
+        return version
+    return _modificar('descartar', usuario_id, cambio)
+
+
+def promover(usuario_id=None):
+    """El candidato pasa a activo; el activo anterior queda apilado para revertir"""
+    def cambio(manifiesto):
+        if not manifiesto.get('candidato'):
+            raise ErrorManifiesto('No hay un modelo candidato para promover')
+        if manifiesto['activo']:
+            manifiesto['anteriores'].append(manifiesto['activo'])
+        manifiesto['activo'], manifiesto['candidato'] = manifiesto['candidato']['version'], None
+        return manifiesto['activo']
+    return _modificar('promover', usuario_id, cambio)
+
+
+def revertir(usuario_id=None):
+    """Volver al último activo apilado (el candidato, si lo hay, se descarta)"""
+    def cambio(manifiesto):
+        anteriores = [v for v in manifiesto['anteriores'] if v in versiones_disponibles()]
+        if not anteriores:
+            raise ErrorManifiesto('No hay una versión anterior a la que volver')
+        manifiesto['activo'], manifiesto['candidato'] = anteriores.pop(), None
+        manifiesto['anteriores'] = anteriores
+        return manifiesto['activo']
+    return _modificar('revertir', usuario_id, cambio)
+
+
+def _retener(manifiesto, conservar):
+    """Borrar los archivos de las versiones que ya no se sirven, evalúan ni sirven para revertir"""
+    manifiesto['anteriores'] = manifiesto['anteriores'][-conservar:] if conservar else []
+    en_uso = {manifiesto['activo'], (manifiesto.get('candidato') or {}).get('version'), *manifiesto['anteriores']}
+    libres = [v for v in versiones_disponibles() if v not in en_uso]
+    for version in libres[:max(0, len(libres) - conservar)]:
+        for patron in (f'priority_model_{version}.joblib', f'priority_label_encoders_{version}.joblib',
+                       f'priority_eval_{version}.json'):
+            try:
+                os.remove(os.path.join(DIRECTORIO_VERSIONES, patron))
+            except FileNotFoundError:
+                pass
+        logger_sombra.info(f'Versión de modelo {version} eliminada (retención)')
+
+
+def registrar_entrenado(version, etiquetadas, conservar, usuario_id=None):
+    """
+    Un modelo recién entrenado entra como candidato en sombra (o como activo si es el
+    primero); se anota el entrenamiento y se aplica la retención de versiones.
+    """
+    def cambio(manifiesto):
+        _poner_candidato(manifiesto, version, 'sombra', 0.1, 1.0)
+        manifiesto['ultimo_entrenamiento'] = {
+            'version': version, 'fecha': datetime.utcnow().isoformat(), 'etiquetadas': etiquetadas
+        }
+        _retener(manifiesto, conservar)
+        return version
+    return _modificar('entrenado', usuario_id, cambio, registrando=version)
+
+
+def reentreno_pendiente(etiquetadas, min_segundos, min_nuevas):
+    """Si un reentrenamiento automático toca ya (tiempo y solicitudes nuevas desde el último)"""
+    ultimo = (leer_manifiesto() or {}).get('ultimo_entrenamiento')
+    if not ultimo:
+        return True
+    transcurrido = (datetime.utcnow() - datetime.fromisoformat(ultimo['fecha'])).total_seconds()
+    return transcurrido >= min_segundos and etiquetadas - ultimo['etiquetadas'] >= min_nuevas
+
+
+def version_activa():
+    """Versión que debe servirse: la del manifiesto o, sin manifiesto, la más reciente"""
+    manifiesto = leer_manifiesto()
+    if manifiesto and manifiesto.get('activo'):
+        return manifiesto['activo']
+    versiones = versiones_disponibles()
+    return versiones[-1] if versiones else None
+
+
+# ------------------------------------------------------------------------------------------------
+# Sincronización de cada proceso con el manifiesto
+# ------------------------------------------------------------------------------------------------
+
+def sincronizar(procesador):
+    """Cargar el activo y el candidato del manifiesto si cambió (como mucho cada REVISAR_SEGUNDOS)"""
+    ahora = time.monotonic()
+    if ahora < procesador._manifiesto_revisar or not procesador._manifiesto_lock.acquire(blocking=False):
+        return
+    try:
+        procesador._manifiesto_revisar = ahora + REVISAR_SEGUNDOS
+        try:
+            firma = os.stat(RUTA_MANIFIESTO).st_mtime_ns
+        except FileNotFoundError:
+            firma = None
+        if firma == procesador._manifiesto_firma:
+            return
+        manifiesto = leer_manifiesto() if firma is not None else None
+        if manifiesto and procesador.is_trained and manifiesto.get('activo') \
+                and procesador.version_modelo != manifiesto['activo']:
+            procesador.load_priority_model(ruta_version(manifiesto['activo']))
+        candidato = (manifiesto or {}).get('candidato')
+        if candidato is None:
+            procesador.candidato = None
+        elif procesador.candidato is None or procesador.candidato.version_modelo != candidato['version']:
+            modelo = type(procesador)()
+            modelo.load_priority_model(ruta_version(candidato['version']))
+            procesador.candidato = modelo
+        procesador.candidato_config = candidato
+        procesador._manifiesto_firma = firma
+    except Exception as e:
+        logger_sombra.warning(f'No se pudo aplicar el manifiesto de modelos: {e}')
+    finally:
+        procesador._manifiesto_lock.release()
+
+
+# ------------------------------------------------------------------------------------------------
+# Predicción servida, A/B y sombra
+# ------------------------------------------------------------------------------------------------
+
+def _cubeta(solicitud):
+    """Valor estable en [0, 1) por solicitud para repartir el A/B"""
+    clave = solicitud.get('id')
+    if clave is None:
+        return random.random()
+    return zlib.crc32(str(clave).encode()) / 2 ** 32
+
+
+def predecir_medido(modelo, solicitudes_data, rol):
+    inicio = time.perf_counter()
+    predicciones = modelo._predecir(solicitudes_data)
+    registro_metricas.registrar_modelo(modelo.version_modelo, rol, time.perf_counter() - inicio)
+    return predicciones
+
+
+def _al_candidato(solicitudes_data, fraccion):
+    import numpy as np # type: ignore
+    return np.array([_cubeta(s) < fraccion for s in solicitudes_data], dtype=bool)
+
+
+def servir_lote(procesador, solicitudes_data, resultados):
+    """
+    Aplicar el candidato a la puntuación por lotes de reglas: en modo ab sirve la prioridad
+    de su fracción de solicitudes; en modo sombra se compara con las reglas aparte.
+    El modelo solo predice la clase, así que las filas que sirve quedan sin puntuacion_ml
+    (la de las reglas contradiría su prioridad) y con 'modelo' = su versión.
+    """
+    candidato, config = procesador.candidato, procesador.candidato_config or {}
+    if candidato is None:
+        return resultados
+    if config.get('modo') != 'ab':
+        sombra.enviar(candidato, config, solicitudes_data, [r['prioridad_ml'] for r in resultados], 'procesar')
+        return resultados
+    al_candidato = _al_candidato(solicitudes_data, config.get('fraccion', 0))
+    if al_candidato.any():
+        elegidos = [i for i, elegida in enumerate(al_candidato) if elegida]
+        try:
+            predichas = predecir_medido(candidato, [solicitudes_data[i] for i in elegidos], 'candidato').tolist()
+        except Exception as e:
+            # Un candidato que falla no debe impedir la puntuación: se quedan las reglas
+            registro_metricas.registrar_sombra(candidato.version_modelo, 'procesar', 'errores', 1)
+            logger_sombra.warning(f'procesar: error del candidato {candidato.version_modelo} en A/B: {e}')
+            return resultados
+        for i, prioridad in zip(elegidos, predichas):
+            resultados[i]['prioridad_ml'] = prioridad
+            resultados[i]['puntuacion_ml'] = None
+            resultados[i]['modelo'] = candidato.version_modelo
+    return resultados
+
+
+def servir_prediccion(procesador, solicitudes_data):
+    """Predicciones servidas según el manifiesto: activo (+ candidato en sombra) o reparto A/B"""
+    import numpy as np # type: ignore
+    candidato, config = procesador.candidato, procesador.candidato_config or {}
+    if candidato is not None and config.get('modo') == 'ab':
+        al_candidato = _al_candidato(solicitudes_data, config.get('fraccion', 0))
+        predicciones = np.empty(len(solicitudes_data), dtype=object)
+        for modelo, mascara, rol in ((procesador, ~al_candidato, 'activo'), (candidato, al_candidato, 'candidato')):
+            if mascara.any():
+                parte = [s for s, elegida in zip(solicitudes_data, mascara) if elegida]
+                predicciones[mascara] = predecir_medido(modelo, parte, rol)
+        return predicciones
+    predicciones = predecir_medido(procesador, solicitudes_data, 'activo')
+    if candidato is not None:
+        sombra.enviar(candidato, config, solicitudes_data, predicciones, 'predecir')
+    return predicciones
+
+
+class Sombra:
+    """Predicciones del candidato en un hilo aparte, con cola acotada y muestreo"""
+
+    def __init__(self, max_pendientes=MAX_PENDIENTES_SOMBRA):
+        self.max_pendientes = max_pendientes
+        self._pendientes = 0
+        self._ejecutor = None
+        self._lock = threading.Lock()
+
+    def enviar(self, candidato, config, solicitudes_data, servidas, origen):
+        """Encolar la comparación; devuelve False si se omitió (muestreo) o se descartó (cola llena)"""
+        inicio = time.perf_counter()
+        try:
+            if random.random() >= config.get('muestreo', 1.0):
+                return False
+            with self._lock:
+                if self._pendientes >= self.max_pendientes:
+                    registro_metricas.registrar_sombra(candidato.version_modelo, origen, 'descartadas', 1)
+                    return False
+                self._pendientes += 1
+                if self._ejecutor is None:
+                    # Se crea al primer uso: con gunicorn --preload no queda en el master
+                    self._ejecutor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='sombra-ml')
+            self._ejecutor.submit(self._comparar, candidato, list(solicitudes_data), list(servidas), origen)
+            return True
+        finally:
+            registro_metricas.registrar_sobrecosto_sombra(origen, time.perf_counter() - inicio)
+
+    def _comparar(self, candidato, solicitudes_data, servidas, origen):
+        try:
+            predichas = predecir_medido(candidato, solicitudes_data, 'sombra').tolist()
+            desacuerdos = [(s.get('id'), servida, predicha)
+                           for s, servida, predicha in zip(solicitudes_data, servidas, predichas) if servida != predicha]
+            registro_metricas.registrar_sombra(candidato.version_modelo, origen, 'comparadas', len(predichas))
+            registro_metricas.registrar_sombra(candidato.version_modelo, origen, 'desacuerdos', len(desacuerdos))
+            if desacuerdos:
+                ejemplos = ', '.join(f'{i}: {a} -> {b}' for i, a, b in desacuerdos[:10])
+                referencia = 'las reglas' if origen == 'procesar' else 'el modelo activo'
+                logger_sombra.info(f'{origen}: {len(desacuerdos)}/{len(predichas)} desacuerdos entre {referencia} y el '
+                                   f'candidato {candidato.version_modelo} ({ejemplos})')
+        except Exception as e:
+            registro_metricas.registrar_sombra(candidato.version_modelo, origen, 'errores', 1)
+            logger_sombra.warning(f'{origen}: error del candidato {candidato.version_modelo} en sombra: {e}')
+        finally:
+            with self._lock:
+                self._pendientes -= 1
+
+
+sombra = Sombra()
@@ -0,0 +1,364 @@
+"""
+Cola de tareas en segundo plano (entrenamiento ML, puntuación, análisis e integridad de documentos).
+
+Las tareas se registran con @tarea('nombre') y se encolan con encolar(); los workers
+(worker.py) las reservan por prioridad, las ejecutan dentro de un app context y las
+reintentan con backoff exponencial si fallan.
+
+Backend local: un archivo SQLite (TAREAS_DB_PATH) compartido por la web y los
+procesos worker. Mientras una tarea se ejecuta, un hilo renueva su latido cada
+TAREAS_LATIDO_SEGUNDOS; solo las que llevan TAREAS_TIMEOUT_SEGUNDOS sin latido
+(su worker murió) vuelven a la cola, así que una tarea larga no se duplica.
+
+Con TAREAS_EN_LINEA=True cada encolar() ejecuta su tarea en la misma petición
+(útil en desarrollo y tests sin workers): los reintentos se hacen en el momento,
+sin backoff, y con el semáforo de admisión lleno la tarea falla en vez de
+posponerse, porque no hay workers que la recojan después.
+"""
+from flask import current_app # type: ignore
+from app import db, admision
+from contextlib import contextmanager
+from datetime import datetime
+import json
+import os
+import sqlite3
+import threading
+import time
+import traceback
+
+ESTADOS_TAREA = ('pendiente', 'en_proceso', 'completada', 'fallida')
+
+# Registro global nombre -> (función, max_intentos)
+_REGISTRO = {}
+# Tarea -> operación de admisión cuyo semáforo limita las ejecuciones simultáneas
+_OPERACIONES = {}
+
+
+def tarea(nombre, max_intentos=3, operacion=None):
+    """Decorador para registrar una función como tarea en segundo plano"""
+    def decorador(funcion):
+        _REGISTRO[nombre] = (funcion, max_intentos)
+        if operacion:
+            _OPERACIONES[nombre] = operacion
+        return funcion
+    return decorador
+
+
+class BackendSQLite:
+    """Cola persistente sobre un archivo SQLite (segura entre procesos)"""
+
+    ESQUEMA = """
+        CREATE TABLE IF NOT EXISTS tareas (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            nombre TEXT NOT NULL,
+            argumentos TEXT NOT NULL DEFAULT '{}',
+            estado TEXT NOT NULL DEFAULT 'pendiente',
+            prioridad INTEGER NOT NULL DEFAULT 0,
+            intentos INTEGER NOT NULL DEFAULT 0,
+            max_intentos INTEGER NOT NULL DEFAULT 3,
+            clave_unica TEXT,
+            usuario_id INTEGER,
+            worker TEXT,
+            resultado TEXT,
+            error TEXT,
+            disponible_en REAL NOT NULL,
+            creada_en REAL NOT NULL,
+            iniciada_en REAL,
+            latido_en REAL,
+            finalizada_en REAL
+        );
+        CREATE INDEX IF NOT EXISTS idx_tareas_cola ON tareas(estado, prioridad, disponible_en);
+        CREATE INDEX IF NOT EXISTS idx_tareas_clave ON tareas(clave_unica, estado);
+        CREATE INDEX IF NOT EXISTS idx_tareas_usuario ON tareas(usuario_id, id);
+    """
+
+    def __init__(self, ruta, timeout_tarea=600):
+        self.ruta = ruta
+        self.timeout_tarea = timeout_tarea
+        directorio = os.path.dirname(os.path.abspath(ruta))
+        os.makedirs(directorio, exist_ok=True)
+        with self._conexion() as conexion:
+            conexion.execute('PRAGMA journal_mode=WAL')
+            conexion.executescript(self.ESQUEMA)
+            # Archivos creados antes del latido
+            columnas = {fila['name'] for fila in conexion.execute('PRAGMA table_info(tareas)')}
+            if 'latido_en' not in columnas:
+                conexion.execute('ALTER TABLE tareas ADD COLUMN latido_en REAL')
+
+    def _conectar(self):
+        conexion = sqlite3.connect(self.ruta, timeout=30, isolation_level=None)
+        conexion.row_factory = sqlite3.Row
+        return conexion
+
+    @contextmanager
+    def _conexion(self):
+        conexion = self._conectar()
+        try:
+            yield conexion
+        finally:
+            conexion.close()
+
+    def encolar(self, nombre, argumentos, prioridad=0, max_intentos=3, clave_unica=None, usuario_id=None,
+                compartir_en_curso=False):
+        ahora = time.time()
+        conexion = self._conectar()
+        try:
+            conexion.execute('BEGIN IMMEDIATE')
+            # Si ya hay una tarea igual esperando (o ejecutándose, con compartir_en_curso),
+            # se reutiliza (evita trabajos duplicados)
+            if clave_unica:
+                estados = ('pendiente', 'en_proceso') if compartir_en_curso else ('pendiente',)
+                fila = conexion.execute(
+                    f"SELECT id FROM tareas WHERE clave_unica = ? AND estado IN ({', '.join('?' * len(estados))}) "
+                    "ORDER BY id LIMIT 1",
+                    (clave_unica, *estados)
+                ).fetchone()
+                if fila:
+                    conexion.execute('COMMIT')
+                    return fila['id']
+            cursor = conexion.execute(
+                """INSERT INTO tareas (nombre, argumentos, prioridad, max_intentos, clave_unica,
+                                       usuario_id, disponible_en, creada_en)
+                   VALUES (?, ?, ?, ?, ?, ?, ?, ?)""",
+                (nombre, json.dumps(argumentos), prioridad, max_intentos, clave_unica,
+                 usuario_id, ahora, ahora)
+            )
+            conexion.execute('COMMIT')
+            return cursor.lastrowid
+        except Exception:
+            conexion.execute('ROLLBACK')
+            raise
+        finally:
+            conexion.close()
+
+    def reservar(self, worker, tarea_id=None):
+        """Tomar la siguiente tarea disponible de mayor prioridad, o la tarea_id si está disponible (o None)"""
+        ahora = time.time()
+        conexion = self._conectar()
+        try:
+            conexion.execute('BEGIN IMMEDIATE')
+            # Recuperar tareas de workers que murieron a mitad de ejecución (sin latido reciente)
+            conexion.execute(
+                """UPDATE tareas SET estado = 'pendiente', worker = NULL, disponible_en = ?
+                   WHERE estado = 'en_proceso' AND COALESCE(latido_en, iniciada_en) < ?""",
+                (ahora, ahora - self.timeout_tarea)
+            )
+            filtro_id = '' if tarea_id is None else 'AND id = ?'
+            fila = conexion.execute(
+                f"""SELECT * FROM tareas
+                    WHERE estado = 'pendiente' AND disponible_en <= ? {filtro_id}
+                    ORDER BY prioridad DESC, id
+                    LIMIT 1""",
+                (ahora,) if tarea_id is None else (ahora, tarea_id)
+            ).fetchone()
+            if fila is None:
+                conexion.execute('COMMIT')
+                return None
+            conexion.execute(
+                """UPDATE tareas SET estado = 'en_proceso', worker = ?, iniciada_en = ?, latido_en = ?,
+                                     intentos = intentos + 1
+                   WHERE id = ?""",
+                (worker, ahora, ahora, fila['id'])
+            )
+            conexion.execute('COMMIT')
+            datos = dict(fila)
+            datos['intentos'] += 1
+            datos['worker'] = worker
+            return datos
+        except Exception:
+            conexion.execute('ROLLBACK')
+            raise
+        finally:
+            conexion.close()
+
+    def latir(self, tarea_id, worker):
+        """Renovar el latido de una tarea que este worker sigue ejecutando"""
+        with self._conexion() as conexion:
+            conexion.execute(
+                "UPDATE tareas SET latido_en = ? WHERE id = ? AND estado = 'en_proceso' AND worker = ?",
+                (time.time(), tarea_id, worker)
+            )
+
+    def completar(self, tarea_id, resultado):
+        with self._conexion() as conexion:
+            conexion.execute(
+                """UPDATE tareas SET estado = 'completada', resultado = ?, error = NULL,
+                                     finalizada_en = ?
+                   WHERE id = ?""",
+                (json.dumps(resultado, default=str), time.time(), tarea_id)
+            )
+
+    def fallar(self, tarea_id, error, reintentar_en=None):
+        """Registrar el error; si reintentar_en no es None, vuelve a la cola en esa fecha"""
+        with self._conexion() as conexion:
+            if reintentar_en is None:
+                conexion.execute(
+                    "UPDATE tareas SET estado = 'fallida', error = ?, finalizada_en = ? WHERE id = ?",
+                    (error, time.time(), tarea_id)
+                )
+            else:
+                conexion.execute(
+                    """UPDATE tareas SET estado = 'pendiente', error = ?, worker = NULL,
+                                         disponible_en = ?
+                       WHERE id = ?""",
+                    (error, reintentar_en, tarea_id)
+                )
+
+    def posponer(self, tarea_id, disponible_en):
+        """Devolver a la cola una tarea reservada sin contar el intento"""
+        with self._conexion() as conexion:
+            conexion.execute(
+                """UPDATE tareas SET estado = 'pendiente', worker = NULL, iniciada_en = NULL,
+                                     intentos = intentos - 1, disponible_en = ?
+                   WHERE id = ?""",
+                (disponible_en, tarea_id)
+            )
+
+    def obtener(self, tarea_id):
+        with self._conexion() as conexion:
+            fila = conexion.execute('SELECT * FROM tareas WHERE id = ?', (tarea_id,)).fetchone()
+        return dict(fila) if fila else None
+
+    def listar(self, usuario_id=None, estado=None, limite=50):
+        condiciones, parametros = [], []
+        if usuario_id is not None:
+            condiciones.append('usuario_id = ?')
+            parametros.append(usuario_id)
+        if estado:
+            condiciones.append('estado = ?')
+            parametros.append(estado)
+        where = f"WHERE {' AND '.join(condiciones)}" if condiciones else ''
+        with self._conexion() as conexion:
+            filas = conexion.execute(
+                f'SELECT * FROM tareas {where} ORDER BY id DESC LIMIT ?', (*parametros, limite)
+            ).fetchall()
+        return [dict(f) for f in filas]
+
+
+def tarea_to_dict(datos):
+    """Representación JSON de una tarea"""
+    def fecha(valor):
+        return datetime.utcfromtimestamp(valor).isoformat() if valor else None
+
+    return {
+        'id': datos['id'],
+        'nombre': datos['nombre'],
+        'estado': datos['estado'],
+        'prioridad': datos['prioridad'],
+        'intentos': datos['intentos'],
+        'max_intentos': datos['max_intentos'],
+        'usuario_id': datos['usuario_id'],
+        'resultado': json.loads(datos['resultado']) if datos['resultado'] else None,
+        'error': datos['error'],
+        'creada_en': fecha(datos['creada_en']),
+        'iniciada_en': fecha(datos['iniciada_en']),
+        'finalizada_en': fecha(datos['finalizada_en'])
+    }
+
+
+def init_app(app):
+    """Crear el backend de la cola y registrar las tareas de la aplicación"""
+    app.extensions['tareas'] = BackendSQLite(
+        app.config['TAREAS_DB_PATH'],
+        timeout_tarea=app.config['TAREAS_TIMEOUT_SEGUNDOS']
+    )
+    # Importar las definiciones para que queden registradas
+    from app import trabajos # noqa: F401
+
+
+def obtener_cola():
+    return current_app.extensions['tareas']
+
+
+def encolar(nombre, argumentos=None, prioridad=0, clave_unica=None, usuario_id=None, compartir_en_curso=False):
+    """
+    Encolar una tarea registrada y devolver su id. Con clave_unica se reutiliza la tarea
+    pendiente con esa clave; con compartir_en_curso también la que se está ejecutando.
+    """
+    if nombre not in _REGISTRO:
+        raise ValueError(f'Tarea no registrada: {nombre}')
+    _, max_intentos = _REGISTRO[nombre]
+    cola = obtener_cola()
+    tarea_id = cola.encolar(nombre, argumentos or {}, prioridad=prioridad, max_intentos=max_intentos,
+                            clave_unica=clave_unica, usuario_id=usuario_id,
+                            compartir_en_curso=compartir_en_curso)
+
+    if current_app.config['TAREAS_EN_LINEA']:
+        # Solo la tarea de esta llamada (las demás pendientes son de otras peticiones o de
+        # workers), con sus reintentos inmediatos hasta max_intentos
+        datos = cola.reservar('en-linea', tarea_id=tarea_id)
+        while datos is not None:
+            ejecutar_tarea(cola, datos, en_linea=True)
+            datos = cola.reservar('en-linea', tarea_id=tarea_id)
+    return tarea_id
+
+
+@contextmanager
+def _latiendo(cola, datos, intervalo):
+    """Renovar el latido de la tarea en un hilo mientras se ejecuta el bloque"""
+    detener = threading.Event()
+
+    def latir():
+        while not detener.wait(intervalo):
+            try:
+                cola.latir(datos['id'], datos['worker'])
+            except sqlite3.Error:
+                pass  # Base ocupada: se reintenta en el siguiente latido
+
+    hilo = threading.Thread(target=latir, name=f"latido-tarea-{datos['id']}", daemon=True)
+    hilo.start()
+    try:
+        yield
+    finally:
+        detener.set()
+        hilo.join()
+
+
+def ejecutar_tarea(cola, datos, en_linea=False):
+    """Ejecutar una tarea reservada y registrar el resultado o programar el reintento"""
+    funcion, _ = _REGISTRO.get(datos['nombre'], (None, 0))
+    operacion = _OPERACIONES.get(datos['nombre'])
+    ficha = admision.adquirir(operacion) if operacion else True
+    if ficha is None:
+        if en_linea:
+            # Sin workers nadie la recogería más tarde
+            cola.fallar(datos['id'], f'Semáforo de {operacion} lleno')
+            current_app.logger.warning(f"Tarea {datos['id']} ({datos['nombre']}) no ejecutada: semáforo de {operacion} lleno")
+            return
+        # Semáforo de la operación lleno: vuelve a la cola sin gastar un intento
+        cola.posponer(datos['id'], time.time() + current_app.config['ADMISION_POSPONER_SEGUNDOS'])
+        return
+    try:
+        if funcion is None:
+            raise ValueError(f"Tarea no registrada: {datos['nombre']}")
+        with _latiendo(cola, datos, current_app.config['TAREAS_LATIDO_SEGUNDOS']):
+            resultado = funcion(**json.loads(datos['argumentos']))
+        cola.completar(datos['id'], resultado)
+    except Exception as e:
+        db.session.rollback()
+        error = f'{e}\n{traceback.format_exc(limit=5)}'
+        if funcion is not None and datos['intentos'] < datos['max_intentos']:
+            espera = 0 if en_linea else current_app.config['TAREAS_BACKOFF_SEGUNDOS'] * 2 ** (datos['intentos'] - 1)
+            cola.fallar(datos['id'], error, reintentar_en=time.time() + espera)
+        else:
+            cola.fallar(datos['id'], error)
+        current_app.logger.error(f"Tarea {datos['id']} ({datos['nombre']}) falló: {e}")
+    finally:
+        if operacion:
+            admision.liberar(operacion, ficha)
+
+
+def ejecutar_worker(app, nombre_worker, detener=None):
+    """Bucle de un worker: reservar, ejecutar y esperar cuando la cola está vacía"""
+    espera = app.config['TAREAS_POLL_SEGUNDOS']
+    cola = app.extensions['tareas']
+    while detener is None or not detener.is_set():
+        with app.app_context():
+            datos = cola.reservar(nombre_worker)
+            if datos is None:
+                time.sleep(espera)
+                continue
+            try:
+                ejecutar_tarea(cola, datos)
+            finally:
+                db.session.remove()
@@ -0,0 +1,226 @@
+"""
+Definiciones de las tareas en segundo plano de la aplicación (ver app/tareas.py).
+"""
+from flask import current_app # type: ignore
+from app import db
+from app.models import Usuario, Tramite, Solicitud, Documento
+from app.tareas import tarea
+from app.eventos import publicar_al_confirmar
+from app.ml_utils import SolicitudMLProcessor, solicitud_processor, document_processor
+from app.evaluacion import evaluar_modelo
+from app import servicio_modelos
+from app.almacenamiento import archivo_disponible, hash_documento, archivar_documentos, reconciliar_archivos
+import hashlib
+
+
+def calcular_hash_archivo(ruta, tamano_bloque=1024 * 1024):
+    """SHA256 de un archivo leído por bloques (memoria acotada)"""
+    sha256 = hashlib.sha256()
+    with open(ruta, 'rb') as f:
+        for bloque in iter(lambda: f.read(tamano_bloque), b''):
+            sha256.update(bloque)
+    return sha256.hexdigest()
+
+
+def aplicar_prioridad_ml(solicitudes_data):
+    """Puntuar un lote de solicitudes (dicts planos con 'id' y 'usuario_id') y guardar la prioridad ML con un solo UPDATE"""
+    resultados = solicitud_processor.process_solicitudes(solicitudes_data)
+    if not resultados:
+        return 0
+
+    propietarios = {s['id']: s.get('usuario_id') for s in solicitudes_data}
+    tabla = Solicitud.__table__
+    db.session.execute(
+        tabla.update()
+        .where(tabla.c.id == db.bindparam('b_id'))
+        .values(
+            prioridad_ml=db.bindparam('b_prioridad_ml'),
+            puntuacion_ml=db.bindparam('b_puntuacion_ml'),
+            modelo_ml=db.bindparam('b_modelo_ml'),
+            procesado_ml=True,
+            version=tabla.c.version + 1
+        ),
+        [{
+            'b_id': r['solicitud_id'],
+            'b_prioridad_ml': r['prioridad_ml'],
+            'b_puntuacion_ml': r['puntuacion_ml'],
+            'b_modelo_ml': r['modelo']
+        } for r in resultados]
+    )
+    for r in resultados:
+        publicar_al_confirmar('solicitud.ml', propietarios[r['solicitud_id']], solicitud_id=r['solicitud_id'],
+                              prioridad_ml=r['prioridad_ml'], puntuacion_ml=r['puntuacion_ml'],
+                              modelo_ml=r['modelo'])
+    db.session.commit()
+    return len(resultados)
+
+
+@tarea('ml.entrenar_prioridad', max_intentos=2, operacion='ml.entrenar')
+def entrenar_prioridad(usuario_id=None, automatico=False):
+    """
+    Reentrenar el modelo de prioridad y registrarlo como candidato en sombra (o activo si
+    es el primero). Los automáticos (al crear solicitudes) se omiten hasta que pasan
+    ML_REENTRENO_MIN_SEGUNDOS y hay ML_REENTRENO_MIN_NUEVAS solicitudes etiquetadas nuevas.
+    """
+    etiquetadas = Solicitud.query.filter(Solicitud.prioridad.isnot(None)).count()
+    if automatico and not servicio_modelos.reentreno_pendiente(
+            etiquetadas, current_app.config['ML_REENTRENO_MIN_SEGUNDOS'], current_app.config['ML_REENTRENO_MIN_NUEVAS']):
+        return {'status': 'omitido', 'message': 'Reentrenamiento automático aún no necesario'}
+    # Procesador aparte: el modelo activo sigue sirviendo hasta que se promueva el candidato
+    entrenador = SolicitudMLProcessor()
+    resultado = entrenador.train_priority_model_from_db()
+    if resultado.get('status') == 'ok':
+        manifiesto = servicio_modelos.registrar_entrenado(
+            entrenador.version_modelo, etiquetadas, current_app.config['ML_VERSIONES_CONSERVAR'], usuario_id)
+        resultado['version'] = entrenador.version_modelo
+        resultado['manifiesto'] = manifiesto
+        # Deja calculada la evaluación de la nueva versión sobre su ventana independiente
+        resultado['evaluacion'] = evaluar_modelo(entrenador)
+    return resultado
+
+
+@tarea('ml.puntuar_lote', operacion='ml.puntuar')
+def puntuar_lote(solicitud_ids):
+    """Una pasada de puntuación ML para un lote de solicitudes"""
+    filas = db.session.query(
+        Solicitud.id, Solicitud.usuario_id, Solicitud.fecha_solicitud, Solicitud.fecha_limite,
+        Tramite.categoria, Tramite.costo, Tramite.tiempo_estimado_dias, Usuario.rol,
+        db.func.count(Documento.id)
+    ).join(Tramite, Solicitud.tramite_id == Tramite.id) \
+     .join(Usuario, Solicitud.usuario_id == Usuario.id) \
+     .outerjoin(Documento, Documento.solicitud_id == Solicitud.id) \
+     .filter(Solicitud.id.in_(solicitud_ids)) \
+     .group_by(Solicitud.id, Solicitud.usuario_id, Solicitud.fecha_solicitud, Solicitud.fecha_limite,
+               Tramite.categoria, Tramite.costo, Tramite.tiempo_estimado_dias, Usuario.rol) \
+     .all()
+
+    procesadas = aplicar_prioridad_ml([{
+        'id': f[0],
+        'usuario_id': f[1],
+        'fecha_solicitud': f[2],
+        'fecha_limite': f[3],
+        'categoria_tramite': f[4],
+        'costo_tramite': float(f[5] or 0),
+        'tiempo_estimado_dias': f[6],
+        'rol_usuario': f[7],
+        'num_documentos': f[8]
+    } for f in filas])
+    return {'solicitudes_procesadas': procesadas}
+
+
+@tarea('ml.procesar_pendientes', operacion='ml.procesar')
+def procesar_pendientes():
+    """Asignar prioridad ML a las solicitudes pendientes de procesamiento"""
+    solicitudes_pendientes = Solicitud.query.filter_by(procesado_ml=False).all()
+
+    procesadas = 0
+    for solicitud in solicitudes_pendientes:
+        # Aquí iría la lógica de ML real
+        # Por ahora, asignamos prioridad basada en tipo de trámite
+        if solicitud.tramite.categoria == 'licencias':
+            solicitud.prioridad_ml = 'alta'
+            solicitud.puntuacion_ml = 85.0
+        elif solicitud.tramite.categoria == 'certificados':
+            solicitud.prioridad_ml = 'media'
+            solicitud.puntuacion_ml = 65.0
+        else:
+            solicitud.prioridad_ml = 'baja'
+            solicitud.puntuacion_ml = 45.0
+
+        solicitud.modelo_ml = 'reglas'
+        solicitud.procesado_ml = True
+        procesadas += 1
+        publicar_al_confirmar('solicitud.ml', solicitud.usuario_id, solicitud_id=solicitud.id,
+                              prioridad_ml=solicitud.prioridad_ml, puntuacion_ml=solicitud.puntuacion_ml)
+
+    db.session.commit()
+    return {'solicitudes_procesadas': procesadas}
+
+
+@tarea('documentos.analizar', operacion='documentos.analizar')
+def analizar_documento(documento_id):
+    """Analizar un documento recién subido y guardar el resultado ML"""
+    documento = Documento.query.get(documento_id)
+    if not documento:
+        return {'documento_id': documento_id, 'omitido': 'Documento no encontrado'}
+
+    resultado = document_processor.analyze_document(documento.to_dict())
+    documento.set_resultado_ml(resultado)
+    documento.procesado_ml = True
+    publicar_al_confirmar('documento.ml', documento.solicitud.usuario_id, solicitud_id=documento.solicitud_id,
+                          documento_id=documento.id, estado_sugerido=resultado['estado_sugerido'])
+    db.session.commit()
+    return {'documento_id': documento_id, 'estado_sugerido': resultado['estado_sugerido']}
+
+
+@tarea('documentos.verificar_integridad', max_intentos=1, operacion='documentos.integridad')
+def verificar_integridad():
+    """Verificar existencia y hash de todos los documentos"""
+    documentos = db.session.query(
+        Documento.id, Documento.nombre_original, Documento.nombre_archivo, Documento.ruta_archivo,
+        Documento.hash_archivo, Documento.almacenamiento, Documento.paquete, Documento.paquete_offset,
+        Documento.paquete_longitud, Documento.paquete_compresion, Documento.archivo_existe
+    ).all()
+    resultados = {
+        'total_documentos': len(documentos),
+        'archivos_faltantes': [],
+        'hashes_incorrectos': [],
+        'documentos_validos': 0
+    }
+    cambios_existencia = []
+
+    for documento in documentos:
+        # Verificar que el archivo existe
+        existe = archivo_disponible(documento)
+        if existe != bool(documento.archivo_existe):
+            cambios_existencia.append({'b_id': documento.id, 'b_existe': existe})
+        if not existe:
+            resultados['archivos_faltantes'].append({
+                'id': documento.id,
+                'nombre': documento.nombre_original,
+                'ruta': documento.paquete if documento.almacenamiento == 'archivado' else documento.ruta_archivo
+            })
+            continue
+
+        # Verificar hash
+        try:
+            hash_actual = hash_documento(documento)
+
+            if hash_actual != documento.hash_archivo:
+                resultados['hashes_incorrectos'].append({
+                    'id': documento.id,
+                    'nombre': documento.nombre_original,
+                    'hash_esperado': documento.hash_archivo,
+                    'hash_actual': hash_actual
+                })
+            else:
+                resultados['documentos_validos'] += 1
+
+        except Exception as hash_error:
+            resultados['hashes_incorrectos'].append({
+                'id': documento.id,
+                'nombre': documento.nombre_original,
+                'error': str(hash_error)
+            })
+
+    if cambios_existencia:
+        tabla = Documento.__table__
+        db.session.execute(
+            tabla.update().where(tabla.c.id == db.bindparam('b_id')).values(archivo_existe=db.bindparam('b_existe')),
+            cambios_existencia
+        )
+        db.session.commit()
+    resultados['estados_actualizados'] = len(cambios_existencia)
+    return resultados
+
+
+@tarea('documentos.archivar', max_intentos=1, operacion='documentos.archivar')
+def archivar(dias=None):
+    """Pasar a paquetes comprimidos los documentos de solicitudes finalizadas hace tiempo"""
+    return archivar_documentos(dias)
+
+
+@tarea('documentos.reconciliar_archivos', max_intentos=1, operacion='documentos.integridad')
+def reconciliar():
+    """Actualizar archivo_existe de todos los documentos con una pasada de os.scandir"""
+    return reconciliar_archivos()
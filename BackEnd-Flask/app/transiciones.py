@@ -0,0 +1,174 @@
+from app import db
+from app.models import Usuario, Solicitud, HistorialEstado
+from app.eventos import publicar_al_confirmar
+from datetime import datetime
+import json
+
+# Tabla de transiciones permitidas de estado_actual
+TRANSICIONES_ESTADO = {
+    'pendiente': {'en_revision', 'observado', 'rechazado'},
+    'en_revision': {'observado', 'aprobado', 'rechazado'},
+    'observado': {'en_revision', 'rechazado'},
+    'aprobado': {'finalizado'},
+    'rechazado': {'finalizado'},
+    'finalizado': set()
+}
+
+# Acción registrada en historial_estado según el estado destino
+ACCIONES_ESTADO = {
+    'en_revision': 'revision',
+    'observado': 'observacion',
+    'aprobado': 'aprobacion',
+    'rechazado': 'rechazo',
+    'finalizado': 'finalizacion'
+}
+
+ROLES_ASIGNABLES = ['administrativo', 'supervisor', 'admin']
+
+
+def transicion_permitida(estado_actual, estado_nuevo):
+    """Verificar si el cambio de estado está permitido"""
+    return estado_nuevo in TRANSICIONES_ESTADO.get(estado_actual, set())
+
+
+def aplicar_transiciones(cambios, realizado_por):
+    """
+    Aplicar cambios de estado y/o reasignaciones sobre varias solicitudes.
+
+    Cada cambio es un dict con 'solicitud_id' y al menos 'estado' o 'asignado_a';
+    opcionalmente 'version' (control de concurrencia optimista) y 'comentario'.
+    Usa un UPDATE condicionado por versión en lugar de bloqueos de fila y escribe
+    el historial con executemany, todo en una sola transacción.
+
+    Devuelve una lista de resultados en el mismo orden que los cambios.
+    """
+    resultados = [None] * len(cambios)
+
+    # Estado actual de todas las solicitudes involucradas en una sola consulta
+    ids = {c.get('solicitud_id') for c in cambios if isinstance(c, dict) and isinstance(c.get('solicitud_id'), int)}
+    actuales = {
+        fila.id: fila for fila in db.session.query(
+            Solicitud.id, Solicitud.usuario_id, Solicitud.estado_actual, Solicitud.version,
+            Solicitud.asignado_a, Solicitud.fecha_finalizacion
+        ).filter(Solicitud.id.in_(ids))
+    } if ids else {}
+
+    asignables = {c.get('asignado_a') for c in cambios if isinstance(c, dict) and isinstance(c.get('asignado_a'), int)}
+    asignables = {
+        uid for (uid,) in db.session.query(Usuario.id).filter(
+            Usuario.id.in_(asignables),
+            Usuario.rol.in_(ROLES_ASIGNABLES),
+            Usuario.estado == 'activo'
+        )
+    } if asignables else set()
+
+    ahora = datetime.utcnow()
+    vistos = set()
+    parametros = []
+    historial = []
+
+    for indice, cambio in enumerate(cambios):
+        if not isinstance(cambio, dict) or not isinstance(cambio.get('solicitud_id'), int):
+            resultados[indice] = {'indice': indice, 'estado': 'error', 'error': 'ID de solicitud es requerido'}
+            continue
+
+        solicitud_id = cambio['solicitud_id']
+        base = {'indice': indice, 'solicitud_id': solicitud_id}
+
+        if solicitud_id in vistos:
+            resultados[indice] = {**base, 'estado': 'error', 'error': 'Solicitud repetida en el lote'}
+            continue
+        vistos.add(solicitud_id)
+
+        actual = actuales.get(solicitud_id)
+        if not actual:
+            resultados[indice] = {**base, 'estado': 'error', 'error': 'Solicitud no encontrada'}
+            continue
+
+        if 'estado' not in cambio and 'asignado_a' not in cambio:
+            resultados[indice] = {**base, 'estado': 'error', 'error': 'Se requiere estado o asignado_a'}
+            continue
+
+        estado_nuevo = cambio.get('estado', actual.estado_actual)
+        if 'estado' in cambio and not transicion_permitida(actual.estado_actual, estado_nuevo):
+            resultados[indice] = {
+                **base, 'estado': 'error',
+                'error': f'Transición no permitida: {actual.estado_actual} -> {estado_nuevo}'
+            }
+            continue
+
+        asignado_a = cambio.get('asignado_a', actual.asignado_a)
+        if 'asignado_a' in cambio and asignado_a is not None and asignado_a not in asignables:
+            resultados[indice] = {**base, 'estado': 'error', 'error': 'Usuario asignado no válido'}
+            continue
+
+        version = cambio.get('version', actual.version)
+        if version != actual.version:
+            resultados[indice] = {**base, 'estado': 'conflicto', 'error': 'La solicitud fue modificada por otro usuario'}
+            continue
+
+        parametros.append({
+            'b_id': solicitud_id,
+            'b_version': version,
+            'b_estado': estado_nuevo,
+            'b_asignado': asignado_a,
+            'b_fecha_fin': ahora if estado_nuevo == 'finalizado' else actual.fecha_finalizacion
+        })
+        historial.append({
+            'solicitud_id': solicitud_id,
+            'estado_anterior': actual.estado_actual,
+            'estado_nuevo': estado_nuevo,
+            'accion': ACCIONES_ESTADO[estado_nuevo] if 'estado' in cambio else 'reasignacion',
+            'comentarios': cambio.get('comentario'),
+            'realizado_por': realizado_por,
+            'datos_adicionales': _datos_reasignacion(actual.asignado_a, asignado_a) if 'asignado_a' in cambio else None,
+            'fecha_accion': ahora
+        })
+        resultados[indice] = {**base, 'estado': 'aplicado', 'estado_actual': estado_nuevo, 'version': version + 1}
+
+    if not parametros:
+        return resultados
+
+    tabla = Solicitud.__table__
+    resultado = db.session.execute(
+        tabla.update()
+        .where(tabla.c.id == db.bindparam('b_id'))
+        .where(tabla.c.version == db.bindparam('b_version'))
+        .values(
+            estado_actual=db.bindparam('b_estado'),
+            asignado_a=db.bindparam('b_asignado'),
+            fecha_finalizacion=db.bindparam('b_fecha_fin'),
+            version=tabla.c.version + 1
+        ),
+        parametros
+    )
+
+    # Si alguna fila no coincidió, otra transacción cambió su versión entre la lectura y el UPDATE
+    if resultado.rowcount != len(parametros):
+        versiones = dict(
+            db.session.query(Solicitud.id, Solicitud.version)
+            .filter(Solicitud.id.in_([p['b_id'] for p in parametros]))
+        )
+        perdidos = {p['b_id'] for p in parametros if versiones.get(p['b_id']) != p['b_version'] + 1}
+        historial = [h for h in historial if h['solicitud_id'] not in perdidos]
+        for i, r in enumerate(resultados):
+            if r and r['estado'] == 'aplicado' and r['solicitud_id'] in perdidos:
+                resultados[i] = {
+                    'indice': r['indice'], 'solicitud_id': r['solicitud_id'],
+                    'estado': 'conflicto', 'error': 'La solicitud fue modificada por otro usuario'
+                }
+
+    if historial:
+        db.session.execute(HistorialEstado.__table__.insert(), historial)
+    for h in historial:
+        publicar_al_confirmar('solicitud.estado', actuales[h['solicitud_id']].usuario_id,
+                              solicitud_id=h['solicitud_id'], accion=h['accion'],
+                              estado_anterior=h['estado_anterior'], estado_nuevo=h['estado_nuevo'])
+    db.session.commit()
+
+    return resultados
+
+
+def _datos_reasignacion(anterior, nuevo):
+    """Datos adicionales del historial para una reasignación"""
+    return json.dumps({'asignado_anterior': anterior, 'asignado_nuevo': nuevo})
@@ -0,0 +1,391 @@
+"""
+Vistas previas (miniaturas y render de la primera página) de documentos jpg/png/pdf.
+
+Se generan al primer pedido y se guardan en una caché en disco indexada por
+hash_archivo + variante (PREVIEWS_DIRECTORIO), acotada a PREVIEWS_CACHE_MAX_BYTES
+con expulsión LRU (la fecha de modificación se actualiza en cada acierto).
+
+Generación:
+- Con Pillow instalado (opcional): se reescala la imagen, o en un PDF la primera
+  imagen JPEG incrustada (la página de un PDF escaneado).
+- Sin Pillow, en Python puro: PNG de 8 bits decodificado fila a fila y reducido por
+  muestreo; JPEG mediante la miniatura EXIF incrustada; imágenes que ya son
+  pequeñas se sirven tal cual. Lo que no se puede generar queda marcado en la
+  caché para no reintentarlo en cada petición.
+
+Las generaciones (fallos de caché) ocupan una plaza del semáforo de admisión
+'documentos.preview': con el semáforo lleno se lanza PreviewOcupada y la vista
+responde 503, en vez de dejar cada vez más hilos decodificando imágenes.
+"""
+from flask import current_app # type: ignore
+from app.admision import una_vez, adquirir, liberar
+from app.almacenamiento import archivo_local
+import io
+import mmap
+import os
+import re
+import struct
+import threading
+import time
+import uuid
+import zlib
+
+try:
+    from PIL import Image # type: ignore
+except ImportError:  # pragma: no cover - Pillow es opcional
+    Image = None
+
+EXTENSIONES_PREVIEW = {'jpg', 'jpeg', 'png', 'pdf'}
+TIPOS = {'jpg': 'image/jpeg', 'png': 'image/png'}
+
+_tamano_cache = None
+_cache_lock = threading.Lock()
+
+
+class PreviewOcupada(Exception):
+    """Semáforo de generación de vistas previas lleno: reintentar más tarde"""
+
+
+# ------------------------------------------------------------------------------------------------
+# Caché en disco
+# ------------------------------------------------------------------------------------------------
+
+def directorio_previews():
+    directorio = current_app.config['PREVIEWS_DIRECTORIO'] or os.path.join(current_app.config['UPLOAD_FOLDER'], '.previews')
+    os.makedirs(directorio, exist_ok=True)
+    return directorio
+
+
+def _buscar_en_cache(directorio, clave):
+    """Ruta y tipo de la entrada (None, None si no está); tipo None = vista previa no disponible"""
+    for extension in ('jpg', 'png', 'none'):
+        ruta = os.path.join(directorio, f'{clave}.{extension}')
+        try:
+            # LRU: el acierto renueva la fecha de modificación
+            os.utime(ruta)
+        except FileNotFoundError:
+            continue
+        return ruta, TIPOS.get(extension)
+    return None, None
+
+
+def _guardar_en_cache(directorio, clave, extension, contenido):
+    global _tamano_cache
+    ruta = os.path.join(directorio, f'{clave}.{extension}')
+    temporal = f'{ruta}.{uuid.uuid4().hex}.tmp'
+    with open(temporal, 'wb') as f:
+        f.write(contenido)
+    os.replace(temporal, ruta)
+    with _cache_lock:
+        if _tamano_cache is None:
+            _tamano_cache = _escanear(directorio)[0]
+        else:
+            _tamano_cache += len(contenido)
+        if _tamano_cache > current_app.config['PREVIEWS_CACHE_MAX_BYTES']:
+            _tamano_cache = _expulsar(directorio, current_app.config['PREVIEWS_CACHE_MAX_BYTES'], ruta)
+    return ruta
+
+
+def _escanear(directorio):
+    total, entradas = 0, []
+    with os.scandir(directorio) as it:
+        for entrada in it:
+            try:
+                info = entrada.stat()
+            except OSError:
+                continue
+            total += info.st_size
+            entradas.append((info.st_mtime, info.st_size, entrada.path))
+    return total, entradas
+
+
+def _expulsar(directorio, maximo, proteger=None):
+    """Borrar las entradas usadas hace más tiempo hasta quedar en el 90% del máximo; devuelve el tamaño final"""
+    total, entradas = _escanear(directorio)
+    objetivo = maximo * 0.9
+    for _, tamano, ruta in sorted(entradas):
+        if total <= objetivo:
+            break
+        if ruta == proteger:
+            continue
+        try:
+            os.remove(ruta)
+            total -= tamano
+        except OSError:
+            pass
+    return total
+
+
+def obtener_preview(documento, variante):
+    """
+    (ruta, mimetype) de la vista previa del documento o (None, None) si no se puede generar.
+    variante: una clave de PREVIEWS_TAMANOS ('miniatura', 'pagina').
+    Lanza PreviewOcupada si hay que generarla y el semáforo de generación está lleno.
+    """
+    lado = current_app.config['PREVIEWS_TAMANOS'][variante]
+    extension = documento.nombre_archivo.rsplit('.', 1)[-1].lower()
+    if extension not in EXTENSIONES_PREVIEW or not documento.hash_archivo:
+        return None, None
+
+    directorio = directorio_previews()
+    clave = f'{documento.hash_archivo}-{variante}'
+    ruta, tipo = _buscar_en_cache(directorio, clave)
+    if ruta:
+        return (ruta, tipo) if tipo else (None, None)
+
+    def generar():
+        ruta, tipo = _buscar_en_cache(directorio, clave)
+        if ruta:
+            return ruta, tipo
+        ficha = adquirir('documentos.preview')
+        if ficha is None:
+            raise PreviewOcupada()
+        inicio = time.perf_counter()
+        try:
+            with archivo_local(documento) as ruta_local:
+                resultado = generar_preview(ruta_local, extension, lado)
+        except Exception as e:
+            # Archivo ilegible o imagen corrupta/no soportada: se marca como no disponible
+            current_app.logger.warning(f'No se pudo generar la vista previa del documento {documento.id}: {e}')
+            resultado = None
+        finally:
+            liberar('documentos.preview', ficha)
+        if resultado is None:
+            return _guardar_en_cache(directorio, clave, 'none', b''), None
+        formato, contenido = resultado
+        current_app.logger.debug(f'Vista previa {clave}: {len(contenido)} bytes en '
+                                 f'{(time.perf_counter() - inicio) * 1000:.0f} ms')
+        return _guardar_en_cache(directorio, clave, formato, contenido), TIPOS[formato]
+
+    # Peticiones simultáneas del mismo documento comparten una sola generación
+    ruta, tipo = una_vez(f'preview:{clave}', generar)
+    return (ruta, tipo) if tipo else (None, None)
+
+
+# ------------------------------------------------------------------------------------------------
+# Generación
+# ------------------------------------------------------------------------------------------------
+
+def generar_preview(ruta, extension, lado):
+    """('jpg'|'png', bytes) con la imagen reducida a `lado` píxeles como máximo, o None"""
+    if extension == 'pdf':
+        contenido = primera_imagen_pdf(ruta)
+        if contenido is None:
+            return None
+        return _reducir_jpeg(contenido, lado)
+    with open(ruta, 'rb') as f:
+        contenido = f.read()
+    if extension == 'png':
+        if Image is not None:
+            return _reducir_pillow(contenido, lado)
+        return _reducir_png(contenido, lado, current_app.config['PREVIEWS_MAX_PIXELES_PURO'])
+    return _reducir_jpeg(contenido, lado)
+
+
+def _reducir_pillow(contenido, lado):
+    imagen = Image.open(io.BytesIO(contenido))
+    # En JPEG, draft() decodifica directamente a una escala reducida (mucho más rápido)
+    imagen.draft('RGB', (lado, lado))
+    imagen.thumbnail((lado, lado))
+    salida = io.BytesIO()
+    if imagen.mode in ('RGBA', 'LA', 'P'):
+        imagen.save(salida, 'PNG', optimize=True)
+        return 'png', salida.getvalue()
+    imagen.convert('RGB').save(salida, 'JPEG', quality=80, optimize=True)
+    return 'jpg', salida.getvalue()
+
+
+def _reducir_jpeg(contenido, lado):
+    if Image is not None:
+        return _reducir_pillow(contenido, lado)
+    dimensiones = dimensiones_jpeg(contenido)
+    if dimensiones and max(dimensiones) <= lado:
+        return 'jpg', contenido
+    miniatura = miniatura_exif(contenido)
+    if miniatura is not None:
+        return 'jpg', miniatura
+    return None
+
+
+def dimensiones_jpeg(contenido):
+    """(ancho, alto) leídos del marcador SOF, o None"""
+    posicion = 2
+    while posicion + 9 < len(contenido):
+        if contenido[posicion] != 0xFF:
+            return None
+        marcador = contenido[posicion + 1]
+        longitud = struct.unpack('>H', contenido[posicion + 2:posicion + 4])[0]
+        if 0xC0 <= marcador <= 0xCF and marcador not in (0xC4, 0xC8, 0xCC):
+            alto, ancho = struct.unpack('>HH', contenido[posicion + 5:posicion + 9])
+            return ancho, alto
+        posicion += 2 + longitud
+    return None
+
+
+def miniatura_exif(contenido):
+    """JPEG de la miniatura EXIF (IFD1) que incluyen cámaras y escáneres, o None"""
+    posicion = 2
+    while posicion + 4 < len(contenido) and contenido[posicion] == 0xFF:
+        marcador = contenido[posicion + 1]
+        longitud = struct.unpack('>H', contenido[posicion + 2:posicion + 4])[0]
+        if marcador == 0xDA:
+            break
+        segmento = contenido[posicion + 4:posicion + 2 + longitud]
+        if marcador == 0xE1 and segmento[:6] == b'Exif\x00\x00':
+            return _miniatura_tiff(segmento[6:])
+        posicion += 2 + longitud
+    return None
+
+
+def _miniatura_tiff(tiff):
+    orden = {b'II': '<', b'MM': '>'}.get(tiff[:2])
+    if orden is None:
+        return None
+    ifd0 = struct.unpack(orden + 'I', tiff[4:8])[0]
+    entradas = struct.unpack(orden + 'H', tiff[ifd0:ifd0 + 2])[0]
+    ifd1 = struct.unpack(orden + 'I', tiff[ifd0 + 2 + entradas * 12:ifd0 + 6 + entradas * 12])[0]
+    if not ifd1:
+        return None
+    entradas = struct.unpack(orden + 'H', tiff[ifd1:ifd1 + 2])[0]
+    etiquetas = {}
+    for i in range(entradas):
+        entrada = tiff[ifd1 + 2 + i * 12:ifd1 + 14 + i * 12]
+        etiqueta, _, _, valor = struct.unpack(orden + 'HHII', entrada)
+        etiquetas[etiqueta] = valor
+    inicio, longitud = etiquetas.get(0x0201), etiquetas.get(0x0202)
+    if not inicio or not longitud:
+        return None
+    miniatura = tiff[inicio:inicio + longitud]
+    return miniatura if miniatura[:2] == b'\xff\xd8' else None
+
+
+_STREAM_PDF = re.compile(rb'stream\r?\n')
+_LONGITUD_PDF = re.compile(rb'/Length\s+(\d+)(?!\s+\d+\s+R)')
+
+
+def primera_imagen_pdf(ruta):
+    """Bytes de la primera imagen JPEG (/DCTDecode) del PDF, sin cargar el archivo en memoria"""
+    with open(ruta, 'rb') as f:
+        if os.fstat(f.fileno()).st_size == 0:
+            return None
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as datos:
+            for coincidencia in _STREAM_PDF.finditer(datos):
+                # Diccionario del objeto: desde el último 'obj' anterior al stream
+                inicio_dic = datos.rfind(b'obj', max(0, coincidencia.start() - 4096), coincidencia.start())
+                diccionario = datos[inicio_dic:coincidencia.start()] if inicio_dic >= 0 else b''
+                if not re.search(rb'/Subtype\s*/Image', diccionario) or b'/DCTDecode' not in diccionario:
+                    continue
+                if re.search(rb'/Filter\s*\[[^\]]*/\w+Decode[^\]]*/\w+Decode', diccionario):
+                    continue  # Filtros encadenados: el contenido no es un JPEG directo
+                inicio = coincidencia.end()
+                longitud = _LONGITUD_PDF.search(diccionario)
+                fin = inicio + int(longitud.group(1)) if longitud else datos.find(b'endstream', inicio)
+                if fin > inicio:
+                    contenido = datos[inicio:fin]
+                    if contenido[:2] == b'\xff\xd8':
+                        return contenido
+    return None
+
+
+def _reducir_png(contenido, lado, max_pixeles):
+    """PNG de 8 bits sin entrelazar reducido por muestreo (vecino más cercano), en Python puro"""
+    if contenido[:8] != b'\x89PNG\r\n\x1a\n':
+        return None
+    posicion, idat, paleta = 8, [], None
+    ancho = alto = None
+    while posicion < len(contenido):
+        longitud, tipo = struct.unpack('>I4s', contenido[posicion:posicion + 8])
+        datos = contenido[posicion + 8:posicion + 8 + longitud]
+        if tipo == b'IHDR':
+            ancho, alto, profundidad, color, _, _, entrelazado = struct.unpack('>IIBBBBB', datos)
+        elif tipo == b'PLTE':
+            paleta = datos
+        elif tipo == b'IDAT':
+            idat.append(datos)
+        elif tipo == b'IEND':
+            break
+        posicion += 12 + longitud
+    if ancho is None or profundidad != 8 or entrelazado or color not in (0, 2, 3, 4, 6):
+        return None
+    if color == 3 and (not paleta or len(paleta) % 3):
+        return None
+    if max(ancho, alto) <= lado:
+        return 'png', contenido
+    if ancho * alto > max_pixeles:
+        return None
+
+    canales = {0: 1, 2: 3, 3: 1, 4: 2, 6: 4}[color]
+    escala = lado / max(ancho, alto)
+    nuevo_ancho, nuevo_alto = max(1, round(ancho * escala)), max(1, round(alto * escala))
+    columnas = [int(x * ancho / nuevo_ancho) for x in range(nuevo_ancho)]
+    filas_destino = {}
+    for y in range(nuevo_alto):
+        filas_destino.setdefault(int(y * alto / nuevo_alto), []).append(y)
+
+    salida = [None] * nuevo_alto
+    bytes_fila = ancho * canales
+    descompresor = zlib.decompressobj()
+    pendiente = b''
+    previa = bytearray(bytes_fila)
+    fuente = iter(idat)
+    for y in range(alto):
+        # Descomprimir solo lo necesario para la fila siguiente (memoria acotada)
+        while len(pendiente) < bytes_fila + 1:
+            trozo = next(fuente, None)
+            if trozo is None:
+                pendiente += descompresor.flush()
+                break
+            pendiente += descompresor.decompress(trozo)
+        if len(pendiente) < bytes_fila + 1:
+            raise ValueError(f'PNG truncado: faltan datos de la fila {y}')
+        filtro, linea = pendiente[0], bytearray(pendiente[1:bytes_fila + 1])
+        pendiente = pendiente[bytes_fila + 1:]
+        _desfiltrar(filtro, linea, previa, canales)
+        previa = linea
+        for destino in filas_destino.get(y, ()):
+            salida[destino] = bytes(b for x in columnas for b in linea[x * canales:(x + 1) * canales])
+
+    if color == 3:
+        # Paleta expandida a RGB (los índices fuera de la paleta quedan en negro)
+        paleta = paleta + bytes(768 - len(paleta)) if len(paleta) < 768 else paleta
+        salida = [bytes(b for i in fila for b in paleta[i * 3:i * 3 + 3]) for fila in salida]
+        color = 2
+    return 'png', _codificar_png(salida, nuevo_ancho, nuevo_alto, color)
+
+
+def _desfiltrar(filtro, linea, previa, bpp):
+    if filtro == 0:
+        return
+    n = len(linea)
+    if filtro == 1:
+        for i in range(bpp, n):
+            linea[i] = (linea[i] + linea[i - bpp]) & 0xFF
+    elif filtro == 2:
+        for i in range(n):
+            linea[i] = (linea[i] + previa[i]) & 0xFF
+    elif filtro == 3:
+        for i in range(n):
+            izquierda = linea[i - bpp] if i >= bpp else 0
+            linea[i] = (linea[i] + ((izquierda + previa[i]) >> 1)) & 0xFF
+    elif filtro == 4:
+        for i in range(n):
+            a = linea[i - bpp] if i >= bpp else 0
+            b = previa[i]
+            c = previa[i - bpp] if i >= bpp else 0
+            p = a + b - c
+            pa, pb, pc = abs(p - a), abs(p - b), abs(p - c)
+            prediccion = a if pa <= pb and pa <= pc else (b if pb <= pc else c)
+            linea[i] = (linea[i] + prediccion) & 0xFF
+    else:
+        raise ValueError(f'Filtro PNG desconocido: {filtro}')
+
+
+def _codificar_png(filas, ancho, alto, color):
+    def bloque(tipo, datos):
+        return struct.pack('>I', len(datos)) + tipo + datos + struct.pack('>I', zlib.crc32(tipo + datos) & 0xFFFFFFFF)
+
+    crudo = b''.join(b'\x00' + fila for fila in filas)
+    return (b'\x89PNG\r\n\x1a\n'
+            + bloque(b'IHDR', struct.pack('>IIBBBBB', ancho, alto, 8, color, 0, 0, 0))
+            + bloque(b'IDAT', zlib.compress(crudo, 9))
+            + bloque(b'IEND', b''))
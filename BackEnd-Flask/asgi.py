@@ -0,0 +1,13 @@
+"""
+Punto de entrada ASGI (opcional; requiere un servidor ASGI, p. ej. uvicorn).
+
+Uso:
+    uvicorn asgi:app --host 0.0.0.0 --port 5000 --workers 4
+
+Las rutas de E/S (eventos SSE, estado de tareas, subidas y descargas) se atienden sin
+ocupar un hilo por conexión; el resto de la API es la misma app Flask (ver app/asgi.py).
+"""
+from app import create_app
+from app.asgi import AppASGI
+
+app = AppASGI(create_app())
@@ -0,0 +1,151 @@
+"""
+Benchmark de arranque: tiempo de importación/creación de la app y memoria (RSS).
+
+Cada medición se hace en un proceso nuevo, como un worker de gunicorn o una
+invocación de CLI, en dos escenarios:
+
+- perezoso:   configuración por defecto; pandas/scikit-learn se importan al
+              primer uso de ML
+- precargado: ML_PRECARGAR=true; la pila de ML se importa y el modelo se carga
+              al crear la app (equivale al arranque anterior con imports globales)
+
+Para cada uno reporta (mediana de --repeticiones procesos):
+    create_app        segundos hasta tener la app creada y su RSS
+    primera petición  GET / y GET /api/tramites/ (sin ML)
+    primer uso ML     process_solicitudes sobre un lote pequeño
+
+Uso:
+    python benchmarks/bench_arranque.py
+    python benchmarks/bench_arranque.py --repeticiones 10 --comparar benchmarks/resultados/arranque-anterior.json
+"""
+import argparse
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+from datetime import datetime
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from carga_api import version_codigo, DIRECTORIO_RESULTADOS  # noqa: E402
+
+RAIZ = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+
+# Se ejecuta en un proceso hijo; imprime una línea JSON con las medidas
+MEDICION = r'''
+import json, sys, time
+inicio = time.perf_counter()
+
+def rss():
+    try:
+        with open('/proc/self/status') as f:
+            for linea in f:
+                if linea.startswith('VmRSS:'):
+                    return int(linea.split()[1]) * 1024
+    except OSError:
+        pass
+    import resource
+    maximo = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return maximo if sys.platform == 'darwin' else maximo * 1024
+
+from app import create_app, db
+app = create_app('testing')
+medidas = {'create_app_s': time.perf_counter() - inicio, 'create_app_rss': rss(),
+           'ml_importado': 'sklearn' in sys.modules}
+
+with app.app_context():
+    db.create_all()
+cliente = app.test_client()
+t = time.perf_counter()
+cliente.get('/')
+cliente.get('/api/tramites/')
+medidas['primera_peticion_s'] = time.perf_counter() - t
+medidas['primera_peticion_rss'] = rss()
+medidas['ml_importado_tras_peticion'] = 'sklearn' in sys.modules
+
+from datetime import datetime, timedelta
+from app.ml_utils import solicitud_processor
+lote = [{'id': i, 'fecha_solicitud': datetime.now() - timedelta(days=i), 'fecha_limite': datetime.now() + timedelta(days=i),
+         'categoria_tramite': 'licencias', 'costo_tramite': 100.0, 'tiempo_estimado_dias': 10,
+         'rol_usuario': 'ciudadano', 'num_documentos': 1} for i in range(10)]
+t = time.perf_counter()
+with app.app_context():
+    solicitud_processor.process_solicitudes(lote)
+medidas['primer_uso_ml_s'] = time.perf_counter() - t
+medidas['primer_uso_ml_rss'] = rss()
+medidas['total_s'] = time.perf_counter() - inicio
+print(json.dumps(medidas))
+'''
+
+ESCENARIOS = {
+    'perezoso': {'ML_PRECARGAR': 'false'},
+    'precargado': {'ML_PRECARGAR': 'true'},
+}
+
+METRICAS = ['create_app_s', 'create_app_rss', 'primera_peticion_s', 'primera_peticion_rss',
+            'primer_uso_ml_s', 'primer_uso_ml_rss', 'total_s']
+
+
+def medir(escenario):
+    entorno = {**os.environ, **ESCENARIOS[escenario], 'FLASK_ENV': 'testing'}
+    salida = subprocess.run([sys.executable, '-W', 'ignore', '-c', MEDICION], cwd=RAIZ, env=entorno,
+                            capture_output=True, text=True, check=True).stdout
+    return json.loads(salida.strip().splitlines()[-1])
+
+
+def formato(metrica, valor):
+    if metrica.endswith('_rss'):
+        return f'{valor / 1024 / 1024:.1f} MB'
+    return f'{valor * 1000:.0f} ms'
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--repeticiones', type=int, default=5, help='Procesos medidos por escenario')
+    parser.add_argument('--salida', help='Archivo JSON de resultados (por defecto benchmarks/resultados/)')
+    parser.add_argument('--comparar', help='JSON de una ejecución anterior')
+    args = parser.parse_args()
+
+    anterior = {}
+    if args.comparar:
+        with open(args.comparar, encoding='utf-8') as f:
+            anterior = json.load(f)['escenarios']
+
+    resultados = {}
+    for escenario in ESCENARIOS:
+        muestras = [medir(escenario) for _ in range(args.repeticiones)]
+        resultados[escenario] = {m: statistics.median(s[m] for s in muestras) for m in METRICAS}
+        resultados[escenario]['ml_importado_al_crear'] = muestras[0]['ml_importado']
+        resultados[escenario]['ml_importado_tras_peticion'] = muestras[0]['ml_importado_tras_peticion']
+
+    print(f"{'métrica':<24}" + ''.join(f'{e:>14}' for e in ESCENARIOS)
+          + (''.join(f'{"ant. " + e:>20}' for e in ESCENARIOS) if anterior else ''))
+    for metrica in METRICAS:
+        linea = f'{metrica:<24}' + ''.join(f'{formato(metrica, resultados[e][metrica]):>14}' for e in ESCENARIOS)
+        if anterior:
+            linea += ''.join(f'{formato(metrica, anterior[e][metrica]) if e in anterior else "-":>20}'
+                             for e in ESCENARIOS)
+        print(linea)
+    for escenario in ESCENARIOS:
+        print(f"{escenario}: scikit-learn importado al crear la app: {resultados[escenario]['ml_importado_al_crear']}, "
+              f"tras peticiones sin ML: {resultados[escenario]['ml_importado_tras_peticion']}")
+
+    informe = {
+        'version': version_codigo(),
+        'fecha': datetime.utcnow().isoformat(),
+        'entorno': {'python': platform.python_version(), 'plataforma': platform.platform(), 'cpus': os.cpu_count()},
+        'repeticiones': args.repeticiones,
+        'escenarios': resultados
+    }
+    salida = args.salida or os.path.join(
+        DIRECTORIO_RESULTADOS, f"arranque-{datetime.utcnow().strftime('%Y%m%d-%H%M%S')}-{informe['version']}.json")
+    os.makedirs(os.path.dirname(os.path.abspath(salida)), exist_ok=True)
+    with open(salida, 'w', encoding='utf-8') as f:
+        json.dump(informe, f, indent=2, ensure_ascii=False)
+    print(f'Resultados guardados en {salida}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,290 @@
+"""
+Benchmark de capacidad de conexiones simultáneas por worker: WSGI con hilos frente a ASGI.
+
+Un worker de cada modo se monta en el proceso con el mismo presupuesto de --hilos:
+
+- wsgi: pool de --hilos hilos que ejecuta la app Flask y recorre el cuerpo de la
+        respuesta, como un worker gthread de gunicorn (un hilo por conexión mientras dura)
+- asgi: app/asgi.py sobre un bucle de asyncio con ASGI_HILOS = --hilos
+
+Sobre cada worker se abren N conexiones largas de un tipo:
+
+- sse:      GET /api/eventos/stream abierto --duracion segundos
+- descarga: GET /api/documentos/descargar/<id> de un archivo de --tamano-kb, leído por un
+            cliente lento que tarda --duracion segundos en recibirlo
+
+y, con esas conexiones abiertas, --sondas peticiones cortas a GET /api/tramites/. La
+capacidad de un modo es el mayor N para el que el p95 de las sondas queda por debajo
+de --umbral-ms con todas las conexiones largas atendidas.
+
+Las conexiones se simulan en el proceso (sin sockets ni servidor): la lentitud del
+cliente se modela como esperas del emisor. Mide cómo ocupa cada modo sus hilos, no la
+pila de red de uvicorn/gunicorn.
+
+Uso:
+    python benchmarks/bench_asgi.py
+    python benchmarks/bench_asgi.py --hilos 8 --conexiones 8,32,128,512 --duracion 3
+"""
+import argparse
+import asyncio
+import json
+import logging
+import os
+import platform
+import shutil
+import sys
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+
+from werkzeug.test import EnvironBuilder  # type: ignore
+
+RAIZ = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+sys.path.insert(0, RAIZ)
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from app import create_app, db  # noqa: E402
+from app.asgi import AppASGI  # noqa: E402
+from app.config import config, TestingConfig  # noqa: E402
+from app.models import Usuario, Tramite, Solicitud, Documento  # noqa: E402
+from app.almacenamiento import preparar_ruta  # noqa: E402
+from flask_jwt_extended import create_access_token  # type: ignore # noqa: E402
+from carga_api import version_codigo, percentil, DIRECTORIO_RESULTADOS  # noqa: E402
+
+
+def crear_app_asgi(directorio, hilos):
+    config['asgi'] = type('AsgiConfig', (TestingConfig,), {
+        'SQLALCHEMY_DATABASE_URI': 'sqlite:///' + os.path.join(directorio, 'asgi.sqlite3'),
+        'SQLALCHEMY_ENGINE_OPTIONS': {'connect_args': {'timeout': 30, 'check_same_thread': False}},
+        'UPLOAD_FOLDER': os.path.join(directorio, 'uploads'),
+        'TAREAS_DB_PATH': os.path.join(directorio, 'tareas.sqlite3'),
+        'SSE_HEARTBEAT_SEGUNDOS': 0.5,
+        'ASGI_HILOS': hilos,
+        'DESCARGAS_VERIFICAR_HASH': False,
+        'METRICAS_UMBRAL_LENTO_MS': 10 ** 9,
+    })
+    app = create_app('asgi')
+    app.logger.setLevel(logging.WARNING)
+    return app
+
+
+def sembrar(app, tamano_kb):
+    """Un usuario, un trámite, una solicitud y un documento de tamano_kb; devuelve (token, documento_id)"""
+    with app.app_context():
+        db.create_all()
+        usuario = Usuario(dni='30000000', nombres='Bench', apellidos='ASGI', email='bench@asgi.local', rol='ciudadano')
+        usuario.set_password('bench')
+        db.session.add(usuario)
+        db.session.add(Tramite(codigo='ASGI-1', nombre='Trámite', categoria='licencias',
+                               tiempo_estimado_dias=10, costo=0))
+        db.session.flush()
+        solicitud = Solicitud(numero_expediente='EXP-ASGI-1', usuario_id=usuario.id, tramite_id=1)
+        db.session.add(solicitud)
+        db.session.flush()
+        nombre = f'{solicitud.id}_bench.pdf'
+        relativa, ruta = preparar_ruta(nombre)
+        with open(ruta, 'wb') as f:
+            f.write(os.urandom(tamano_kb * 1024))
+        documento = Documento(solicitud_id=solicitud.id, nombre_archivo=nombre, nombre_original='bench.pdf',
+                              tipo_documento='general', ruta_archivo=relativa, tamano_bytes=tamano_kb * 1024,
+                              tipo_mime='application/pdf', subido_por=usuario.id)
+        db.session.add(documento)
+        db.session.commit()
+        return create_access_token(identity=str(usuario.id)), documento.id
+
+
+# ------------------------------------------------------------------------------------------------
+# Modo WSGI: un hilo del pool por conexión mientras dura
+# ------------------------------------------------------------------------------------------------
+
+def conexion_wsgi(app, ruta, token, consumir):
+    environ = EnvironBuilder(path=ruta, headers={'Authorization': f'Bearer {token}'}).get_environ()
+    estado = {}
+
+    def start_response(status, headers, exc_info=None):
+        estado['codigo'] = int(status.split(' ', 1)[0])
+
+    resultado = app(environ, start_response)
+    try:
+        consumir(resultado)
+    finally:
+        if hasattr(resultado, 'close'):
+            resultado.close()
+    return estado['codigo']
+
+
+def medir_wsgi(app, token, documento_id, tipo, conexiones, args):
+    pool = ThreadPoolExecutor(max_workers=args.hilos)
+    ritmo = args.tamano_kb * 1024 / args.duracion
+
+    def consumir_largo(cuerpo):
+        inicio = time.perf_counter()
+        for trozo in cuerpo:
+            if tipo == 'descarga':
+                time.sleep(len(trozo) / ritmo)  # El envío al cliente lento bloquea el hilo
+            elif time.perf_counter() - inicio >= args.duracion:
+                break
+
+    ruta_larga = '/api/eventos/stream' if tipo == 'sse' else f'/api/documentos/descargar/{documento_id}'
+    largas = [pool.submit(conexion_wsgi, app, ruta_larga, token, consumir_largo) for _ in range(conexiones)]
+    time.sleep(0.2)
+
+    def sonda():
+        codigo = conexion_wsgi(app, '/api/tramites/', token, lambda cuerpo: b''.join(cuerpo))
+        return codigo, time.perf_counter()
+
+    sondas = []
+    for _ in range(args.sondas):
+        sondas.append((time.perf_counter(), pool.submit(sonda)))
+        time.sleep(args.duracion / args.sondas / 2)
+    tiempos = []
+    for enviada, futuro in sondas:
+        codigo, fin = futuro.result()
+        # Latencia vista por el cliente: incluye la espera a que un hilo quede libre
+        tiempos.append(fin - enviada if codigo == 200 else None)
+    atendidas = sum(1 for futuro in largas if futuro.result() == 200)
+    pool.shutdown(wait=True)
+    return tiempos, atendidas
+
+
+# ------------------------------------------------------------------------------------------------
+# Modo ASGI
+# ------------------------------------------------------------------------------------------------
+
+async def conexion_asgi(asgi, ruta, token, al_recibir=None):
+    escopo = {'type': 'http', 'method': 'GET', 'path': ruta, 'query_string': b'', 'root_path': '',
+              'headers': [(b'authorization', f'Bearer {token}'.encode())], 'http_version': '1.1',
+              'scheme': 'http', 'server': ('bench', 80), 'client': ('127.0.0.1', 0)}
+    desconectar = asyncio.Event()
+    pedido = [False]
+    estado = {}
+
+    async def receive():
+        if not pedido[0]:
+            pedido[0] = True
+            return {'type': 'http.request', 'body': b'', 'more_body': False}
+        await desconectar.wait()
+        return {'type': 'http.disconnect'}
+
+    async def send(mensaje):
+        if mensaje['type'] == 'http.response.start':
+            estado['codigo'] = mensaje['status']
+        elif al_recibir is not None and await al_recibir(mensaje.get('body', b'')):
+            desconectar.set()
+
+    await asgi(escopo, receive, send)
+    return estado.get('codigo')
+
+
+async def medir_asgi_async(asgi, token, documento_id, tipo, conexiones, args):
+    ritmo = args.tamano_kb * 1024 / args.duracion
+
+    def cliente_largo():
+        inicio = time.perf_counter()
+
+        async def al_recibir(cuerpo):
+            if tipo == 'descarga':
+                await asyncio.sleep(len(cuerpo) / ritmo)  # Cliente lento: el bucle sigue atendiendo
+                return False
+            return time.perf_counter() - inicio >= args.duracion
+        return al_recibir
+
+    ruta_larga = '/api/eventos/stream' if tipo == 'sse' else f'/api/documentos/descargar/{documento_id}'
+    largas = [asyncio.ensure_future(conexion_asgi(asgi, ruta_larga, token, cliente_largo()))
+              for _ in range(conexiones)]
+    await asyncio.sleep(0.2)
+
+    async def sonda():
+        inicio = time.perf_counter()
+        codigo = await conexion_asgi(asgi, '/api/tramites/', token)
+        return time.perf_counter() - inicio if codigo == 200 else None
+
+    sondas = []
+    for _ in range(args.sondas):
+        sondas.append(asyncio.ensure_future(sonda()))
+        await asyncio.sleep(args.duracion / args.sondas / 2)
+    tiempos = await asyncio.gather(*sondas)
+    atendidas = sum(1 for codigo in await asyncio.gather(*largas) if codigo == 200)
+    return list(tiempos), atendidas
+
+
+def medir(modo, tipo, conexiones, args):
+    directorio = tempfile.mkdtemp(prefix='bench_asgi_')
+    try:
+        app = crear_app_asgi(directorio, args.hilos)
+        token, documento_id = sembrar(app, args.tamano_kb)
+        inicio = time.perf_counter()
+        if modo == 'wsgi':
+            tiempos, atendidas = medir_wsgi(app, token, documento_id, tipo, conexiones, args)
+        else:
+            asgi = AppASGI(app)
+            tiempos, atendidas = asyncio.run(medir_asgi_async(asgi, token, documento_id, tipo, conexiones, args))
+            asgi.cerrar()
+        duracion = time.perf_counter() - inicio
+        validos = sorted(t for t in tiempos if t is not None)
+        p95 = percentil(validos, 95) * 1000 if validos else None
+        return {
+            'modo': modo, 'tipo': tipo, 'conexiones': conexiones,
+            'atendidas': atendidas,
+            'sondas_ok': len(validos),
+            'sonda_p50_ms': percentil(validos, 50) * 1000 if validos else None,
+            'sonda_p95_ms': p95,
+            'duracion_s': duracion,
+            'dentro_de_umbral': (p95 is not None and p95 <= args.umbral_ms and atendidas == conexiones
+                                 and len(validos) == args.sondas)
+        }
+    finally:
+        shutil.rmtree(directorio, ignore_errors=True)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--hilos', type=int, default=16, help='Hilos por worker en ambos modos')
+    parser.add_argument('--conexiones', default='8,32,128,256', help='Conexiones largas simultáneas a probar')
+    parser.add_argument('--tipos', default='sse,descarga')
+    parser.add_argument('--duracion', type=float, default=2.0, help='Segundos que dura cada conexión larga')
+    parser.add_argument('--tamano-kb', type=int, default=512, help='Tamaño del documento descargado')
+    parser.add_argument('--sondas', type=int, default=20)
+    parser.add_argument('--umbral-ms', type=float, default=500)
+    parser.add_argument('--salida', help='Archivo JSON de resultados (por defecto benchmarks/resultados/)')
+    args = parser.parse_args()
+
+    niveles = [int(n) for n in args.conexiones.split(',')]
+    filas = []
+    print(f"{'modo':<6}{'tipo':<10}{'conex.':>8}{'atendidas':>11}{'sondas':>8}{'p50 ms':>10}{'p95 ms':>10}")
+    for tipo in args.tipos.split(','):
+        for modo in ('wsgi', 'asgi'):
+            for conexiones in niveles:
+                r = medir(modo, tipo, conexiones, args)
+                filas.append(r)
+                p50 = f"{r['sonda_p50_ms']:.1f}" if r['sonda_p50_ms'] is not None else '-'
+                p95 = f"{r['sonda_p95_ms']:.1f}" if r['sonda_p95_ms'] is not None else '-'
+                print(f"{modo:<6}{tipo:<10}{conexiones:>8}{r['atendidas']:>11}{r['sondas_ok']:>8}{p50:>10}{p95:>10}")
+
+    capacidad = {}
+    for tipo in args.tipos.split(','):
+        for modo in ('wsgi', 'asgi'):
+            dentro = [r['conexiones'] for r in filas if r['tipo'] == tipo and r['modo'] == modo and r['dentro_de_umbral']]
+            capacidad[f'{modo}.{tipo}'] = max(dentro) if dentro else 0
+            print(f"capacidad {modo} {tipo}: {capacidad[f'{modo}.{tipo}']} conexiones "
+                  f"(p95 de sondas <= {args.umbral_ms:.0f} ms, de {niveles})")
+
+    informe = {
+        'version': version_codigo(),
+        'fecha': datetime.utcnow().isoformat(),
+        'entorno': {'python': platform.python_version(), 'plataforma': platform.platform(), 'cpus': os.cpu_count()},
+        'parametros': vars(args),
+        'capacidad_por_worker': capacidad,
+        'mediciones': filas
+    }
+    salida = args.salida or os.path.join(
+        DIRECTORIO_RESULTADOS, f"asgi-{datetime.utcnow().strftime('%Y%m%d-%H%M%S')}-{informe['version']}.json")
+    os.makedirs(os.path.dirname(os.path.abspath(salida)), exist_ok=True)
+    with open(salida, 'w', encoding='utf-8') as f:
+        json.dump(informe, f, indent=2, ensure_ascii=False)
+    print(f'Resultados guardados en {salida}')
+
+
+if __name__ == '__main__':
+    main()
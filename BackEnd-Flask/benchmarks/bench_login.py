@@ -0,0 +1,162 @@
+"""
+Benchmark de login: peticiones por segundo por núcleo.
+
+Ejerce POST /api/auth/login en un solo hilo con el cliente de pruebas de Flask
+(sin red) sobre una base SQLite en un archivo temporal, en tres escenarios:
+
+- antes:        hash por defecto de werkzeug (scrypt N=32768) y UPDATE + commit
+                de ultima_actividad en cada login (ACTIVIDAD_INTERVALO_SEGUNDOS=0)
+- actividad:    mismo hash, ultima_actividad acumulada y escrita en lote
+- despues:      PASSWORD_HASH_METODO=--metodo y ultima_actividad en lote
+
+Los usuarios se siembran con el hash por defecto, así que en "despues" el primer
+login de cada uno re-hashea la contraseña; esa pasada se mide aparte
+(primera_pasada_p50_ms) y no entra en las peticiones por segundo.
+
+Peticiones por segundo por núcleo = peticiones / segundos de CPU del proceso
+(incluye el hilo que vuelca ultima_actividad).
+
+Uso:
+    python benchmarks/bench_login.py
+    python benchmarks/bench_login.py --metodo pbkdf2:sha256:100000 --peticiones 500
+"""
+import argparse
+import json
+import logging
+import os
+import platform
+import shutil
+import statistics
+import sys
+import tempfile
+import time
+from datetime import datetime
+
+from werkzeug.security import generate_password_hash  # type: ignore
+
+RAIZ = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+sys.path.insert(0, RAIZ)
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from app import create_app, db  # noqa: E402
+from app.config import config, TestingConfig  # noqa: E402
+from app.models import Usuario  # noqa: E402
+from carga_api import version_codigo, DIRECTORIO_RESULTADOS  # noqa: E402
+
+PASSWORD = 'login-docucontrol'
+METODO_ANTERIOR = 'scrypt:32768:8:1'
+
+
+def crear_app_login(directorio, metodo, intervalo):
+    config['login'] = type('LoginConfig', (TestingConfig,), {
+        'SQLALCHEMY_DATABASE_URI': 'sqlite:///' + os.path.join(directorio, 'login.sqlite3'),
+        'SQLALCHEMY_ENGINE_OPTIONS': {'connect_args': {'timeout': 30, 'check_same_thread': False}},
+        'UPLOAD_FOLDER': os.path.join(directorio, 'uploads'),
+        'TAREAS_DB_PATH': os.path.join(directorio, 'tareas.sqlite3'),
+        'PASSWORD_HASH_METODO': metodo,
+        'ACTIVIDAD_INTERVALO_SEGUNDOS': intervalo,
+        'METRICAS_UMBRAL_LENTO_MS': 10 ** 9,
+    })
+    app = create_app('login')
+    app.logger.setLevel(logging.WARNING)
+    return app
+
+
+def sembrar(app, usuarios):
+    """Usuarios con un único hash del método anterior (como una base ya existente)"""
+    with app.app_context():
+        db.create_all()
+        password_hash = generate_password_hash(PASSWORD, method=METODO_ANTERIOR)
+        db.session.execute(Usuario.__table__.insert(), [{
+            'dni': f'{20000000 + i}', 'nombres': f'Usuario {i}', 'apellidos': 'Login',
+            'email': f'usuario{i}@login.local', 'password_hash': password_hash, 'rol': 'ciudadano',
+            'ultima_actividad': datetime(2000, 1, 1)
+        } for i in range(usuarios)])
+        db.session.commit()
+
+
+def login(cliente, i, usuarios):
+    inicio = time.perf_counter()
+    respuesta = cliente.post('/api/auth/login',
+                             json={'email': f'usuario{i % usuarios}@login.local', 'password': PASSWORD})
+    if respuesta.status_code != 200:
+        raise RuntimeError(f'login {respuesta.status_code}: {respuesta.get_data(as_text=True)}')
+    return time.perf_counter() - inicio
+
+
+def medir(metodo, intervalo, args):
+    directorio = tempfile.mkdtemp(prefix='bench_login_')
+    try:
+        app = crear_app_login(directorio, metodo, intervalo)
+        sembrar(app, args.usuarios)
+        cliente = app.test_client()
+
+        # Primera pasada: un login por usuario (re-hash si cambió el método)
+        primera = [login(cliente, i, args.usuarios) for i in range(args.usuarios)]
+
+        cpu, reloj = time.process_time(), time.perf_counter()
+        tiempos = [login(cliente, i, args.usuarios) for i in range(args.peticiones)]
+        cpu, reloj = time.process_time() - cpu, time.perf_counter() - reloj
+
+        registro = app.extensions.get('actividad')
+        volcadas = registro.volcar() if registro else 0
+        with app.app_context():
+            sin_actividad = Usuario.query.filter(Usuario.ultima_actividad < datetime(2001, 1, 1)).count()
+            prefijos = {u.password_hash.split('$', 1)[0] for u in Usuario.query}
+        tiempos.sort()
+        return {
+            'metodo': metodo,
+            'intervalo_actividad_s': intervalo,
+            'rps_por_nucleo': args.peticiones / cpu if cpu else None,
+            'rps': args.peticiones / reloj,
+            'p50_ms': statistics.median(tiempos) * 1000,
+            'p95_ms': tiempos[int(len(tiempos) * 0.95) - 1] * 1000,
+            'primera_pasada_p50_ms': statistics.median(primera) * 1000,
+            'actividad_volcada_al_final': volcadas,
+            'usuarios_sin_actividad': sin_actividad,
+            'metodos_en_base': sorted(prefijos),
+        }
+    finally:
+        shutil.rmtree(directorio, ignore_errors=True)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--metodo', default='scrypt:16384:8:1', help='PASSWORD_HASH_METODO del escenario "despues"')
+    parser.add_argument('--usuarios', type=int, default=20)
+    parser.add_argument('--peticiones', type=int, default=200)
+    parser.add_argument('--salida', help='Archivo JSON de resultados (por defecto benchmarks/resultados/)')
+    args = parser.parse_args()
+
+    escenarios = {
+        'antes': (METODO_ANTERIOR, 0),
+        'actividad': (METODO_ANTERIOR, 30),
+        'despues': (args.metodo, 30),
+    }
+    resultados = {nombre: medir(metodo, intervalo, args) for nombre, (metodo, intervalo) in escenarios.items()}
+
+    print(f"{'escenario':<12}{'método':<22}{'rps/núcleo':>12}{'p50 ms':>10}{'p95 ms':>10}{'1ª pasada':>12}")
+    for nombre, r in resultados.items():
+        print(f"{nombre:<12}{r['metodo']:<22}{r['rps_por_nucleo']:>12.1f}{r['p50_ms']:>10.1f}"
+              f"{r['p95_ms']:>10.1f}{r['primera_pasada_p50_ms']:>10.1f}ms")
+    base = resultados['antes']['rps_por_nucleo']
+    for nombre in ('actividad', 'despues'):
+        print(f"{nombre}: x{resultados[nombre]['rps_por_nucleo'] / base:.2f} respecto de 'antes'")
+
+    informe = {
+        'version': version_codigo(),
+        'fecha': datetime.utcnow().isoformat(),
+        'entorno': {'python': platform.python_version(), 'plataforma': platform.platform(), 'cpus': os.cpu_count()},
+        'parametros': vars(args),
+        'escenarios': resultados
+    }
+    salida = args.salida or os.path.join(
+        DIRECTORIO_RESULTADOS, f"login-{datetime.utcnow().strftime('%Y%m%d-%H%M%S')}-{informe['version']}.json")
+    os.makedirs(os.path.dirname(os.path.abspath(salida)), exist_ok=True)
+    with open(salida, 'w', encoding='utf-8') as f:
+        json.dump(informe, f, indent=2, ensure_ascii=False)
+    print(f'Resultados guardados en {salida}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,328 @@
+"""
+Micro-benchmarks de las rutas calientes de app/ml_utils.py.
+
+Mide tiempo (mínimo y mediana de varias repeticiones) y pico de memoria
+(tracemalloc, en una pasada aparte) de:
+
+- SolicitudMLProcessor.prepare_features        (entrada plana y anidada)
+- SolicitudMLProcessor.encode_categorical_features (encoders nuevos y ya ajustados)
+- SolicitudMLProcessor.calculate_priority_score
+- SolicitudMLProcessor.process_solicitudes      (entrada plana y anidada)
+- SolicitudMLProcessor.predict_priority       (solo y con un candidato en sombra)
+- DocumentMLProcessor.analyze_document          (N documentos)
+
+con datos sintéticos deterministas de 1k, 100k y 1M filas. Los resultados se
+guardan en JSON (benchmarks/resultados/) y se pueden comparar con --comparar
+para medir cualquier cambio de vectorización o caché contra esta línea base.
+
+Uso:
+    python benchmarks/bench_ml_utils.py
+    python benchmarks/bench_ml_utils.py --tamanos 1000,100000 --funciones prepare,score
+    python benchmarks/bench_ml_utils.py --comparar benchmarks/resultados/ml-anterior.json
+
+Con 1M filas las funciones que iteran fila a fila tardan minutos; en tamaños
+grandes se hace una sola repetición.
+"""
+import argparse
+import gc
+import json
+import os
+import platform
+import random
+import statistics
+import sys
+import time
+import tracemalloc
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import pandas as pd  # noqa: E402  # type: ignore
+from sklearn.ensemble import RandomForestClassifier  # noqa: E402  # type: ignore
+from app.ml_utils import SolicitudMLProcessor, DocumentMLProcessor, COLUMNAS_ENTRENAMIENTO  # noqa: E402
+from carga_api import version_codigo, DIRECTORIO_RESULTADOS  # noqa: E402
+
+CATEGORIAS = ['licencias', 'permisos', 'servicios', 'certificados', 'otros']
+ROLES = ['ciudadano', 'ciudadano', 'ciudadano', 'administrativo', 'supervisor', 'admin']
+PRIORIDADES = ['baja', 'media', 'alta', 'critica']
+NOMBRES_DOCUMENTO = ['dni_titular.pdf', 'ruc_empresa.pdf', 'recibo_luz.pdf', 'plano_ubicacion.dwg',
+                     'plano_arquitectura.pdf', 'memoria_descriptiva.docx', 'estudio_suelos.pdf',
+                     'declaracion_jurada.pdf', 'foto.jpg', 'anexo.txt']
+# Listas de documentos compartidas: la forma anidada solo necesita su longitud
+_DOCUMENTOS = [[{}] * k for k in range(6)]
+
+
+# ------------------------------------------------------------------------------------------------
+# Generadores de datos sintéticos
+# ------------------------------------------------------------------------------------------------
+
+def generar_solicitudes(n, forma, semilla=42):
+    """Solicitudes sintéticas en la forma plana (extract_training_data) o anidada (train_priority_model_from_db)"""
+    rng = random.Random(semilla)
+    ahora = datetime.now()
+    solicitudes = []
+    for i in range(n):
+        fecha_solicitud = ahora - timedelta(days=rng.randint(0, 365))
+        fecha_limite = ahora + timedelta(days=rng.randint(-30, 90)) if rng.random() > 0.05 else None
+        categoria = rng.choice(CATEGORIAS)
+        costo = float(rng.choice((0, 25, 80, 150, 300, 650, 1200)))
+        tiempo = rng.randint(5, 60)
+        rol = rng.choice(ROLES)
+        num_documentos = rng.randint(0, 5)
+        if forma == 'anidada':
+            solicitudes.append({
+                'id': i + 1,
+                'fecha_solicitud': fecha_solicitud,
+                'fecha_limite': fecha_limite,
+                'tramite': {'categoria': categoria, 'costo': costo, 'tiempo_estimado_dias': tiempo},
+                'usuario': {'rol': rol},
+                'documentos': _DOCUMENTOS[num_documentos],
+                'prioridad': rng.choice(PRIORIDADES)
+            })
+        else:
+            solicitudes.append({
+                'id': i + 1,
+                'fecha_solicitud': fecha_solicitud,
+                'fecha_limite': fecha_limite,
+                'categoria_tramite': categoria,
+                'costo_tramite': costo,
+                'tiempo_estimado_dias': tiempo,
+                'rol_usuario': rol,
+                'num_documentos': num_documentos,
+                'prioridad': rng.choice(PRIORIDADES)
+            })
+    return solicitudes
+
+
+def generar_documentos(n, semilla=42):
+    rng = random.Random(semilla)
+    return [{'id': i + 1, 'nombre_original': rng.choice(NOMBRES_DOCUMENTO).upper() if rng.random() < 0.2
+             else rng.choice(NOMBRES_DOCUMENTO), 'tamano_bytes': rng.randint(1024, 16 * 1024 * 1024)}
+            for i in range(n)]
+
+
+def procesador_entrenado(semilla=42):
+    """Procesador con codificador y un modelo ajustados con las columnas de entrenamiento"""
+    procesador = SolicitudMLProcessor()
+    datos = generar_solicitudes(2000, 'plana', semilla)
+    X = procesador.encode_categorical_features(procesador.prepare_features(datos), ajustar=True)[COLUMNAS_ENTRENAMIENTO]
+    modelo = RandomForestClassifier(n_estimators=100, random_state=semilla)
+    modelo.fit(X, [d['prioridad'] for d in datos])
+    procesador.priority_model = modelo
+    procesador.is_trained = True
+    procesador.version_modelo = f'bench-{semilla}'
+    # Fuera del manifiesto de model_versions: se mide siempre este modelo
+    procesador._manifiesto_revisar = float('inf')
+    return procesador
+
+
+# ------------------------------------------------------------------------------------------------
+# Casos: nombre -> preparar(n) devuelve la función a medir (la preparación no se mide)
+# ------------------------------------------------------------------------------------------------
+
+def _cache(funcion):
+    """Reutilizar entre casos los datos generados para un mismo tamaño (se libera al cambiar de tamaño)"""
+    memoria = {}
+
+    def envoltura(*args):
+        if args not in memoria:
+            for clave in [c for c in memoria if c[0] != args[0]]:
+                del memoria[clave]
+            memoria[args] = funcion(*args)
+        return memoria[args]
+    return envoltura
+
+
+datos_solicitudes = _cache(generar_solicitudes)
+
+
+@_cache
+def features_codificadas(n):
+    procesador = SolicitudMLProcessor()
+    return procesador.encode_categorical_features(procesador.prepare_features(datos_solicitudes(n, 'plana')), ajustar=True)
+
+
+def caso_prepare_features(forma):
+    def preparar(n):
+        datos = datos_solicitudes(n, forma)
+        procesador = SolicitudMLProcessor()
+        return lambda: procesador.prepare_features(datos)
+    return preparar
+
+
+def caso_encode(ajustado):
+    def preparar(n):
+        df = SolicitudMLProcessor().prepare_features(datos_solicitudes(n, 'plana'))
+        procesador = SolicitudMLProcessor()
+        if ajustado:
+            # Camino de inferencia: codificador ya ajustado, sin reajustar
+            procesador.encode_categorical_features(df.copy(), ajustar=True)
+            return lambda: procesador.encode_categorical_features(df)
+        # Camino de entrenamiento: ajusta el codificador, así que preparar() se llama en cada repetición
+        return lambda: procesador.encode_categorical_features(df, ajustar=True)
+    return preparar
+
+
+def caso_calculate_priority_score(n):
+    df = features_codificadas(n)
+    procesador = SolicitudMLProcessor()
+    return lambda: procesador.calculate_priority_score(df)
+
+
+def caso_process_solicitudes(forma):
+    def preparar(n):
+        datos = datos_solicitudes(n, forma)
+
+        def ejecutar():
+            # Encoders nuevos en cada ejecución, como un worker recién iniciado
+            return SolicitudMLProcessor().process_solicitudes(datos)
+        return ejecutar
+    return preparar
+
+
+_procesador_prediccion = None
+
+
+def caso_predict_priority(n):
+    global _procesador_prediccion
+    if _procesador_prediccion is None:
+        _procesador_prediccion = procesador_entrenado()
+    datos = datos_solicitudes(n, 'plana')
+    return lambda: _procesador_prediccion.predict_priority(datos)
+
+
+_procesador_sombra = None
+
+
+def caso_predict_sombra(n):
+    """predict_priority con un candidato en sombra: mide el sobrecosto en el camino crítico"""
+    global _procesador_sombra
+    if _procesador_sombra is None:
+        _procesador_sombra = procesador_entrenado()
+        _procesador_sombra.candidato = procesador_entrenado(semilla=7)
+        _procesador_sombra.candidato_config = {'version': 'bench-7', 'modo': 'sombra', 'muestreo': 1.0}
+    datos = datos_solicitudes(n, 'plana')
+    return lambda: _procesador_sombra.predict_priority(datos)
+
+
+def caso_analyze_document(n):
+    documentos = generar_documentos(n)
+    procesador = DocumentMLProcessor()
+    return lambda: [procesador.analyze_document(d) for d in documentos]
+
+
+CASOS = {
+    'prepare_features[plana]': caso_prepare_features('plana'),
+    'prepare_features[anidada]': caso_prepare_features('anidada'),
+    'encode_categorical_features[nuevo]': caso_encode(False),
+    'encode_categorical_features[ajustado]': caso_encode(True),
+    'calculate_priority_score': caso_calculate_priority_score,
+    'process_solicitudes[plana]': caso_process_solicitudes('plana'),
+    'process_solicitudes[anidada]': caso_process_solicitudes('anidada'),
+    'predict_priority': caso_predict_priority,
+    'predict_priority[sombra]': caso_predict_sombra,
+    'analyze_document': caso_analyze_document,
+}
+
+
+# ------------------------------------------------------------------------------------------------
+# Medición
+# ------------------------------------------------------------------------------------------------
+
+def medir_tiempo(preparar, n, repeticiones):
+    tiempos = []
+    for _ in range(repeticiones):
+        ejecutar = preparar(n)
+        gc.collect()
+        inicio = time.perf_counter()
+        ejecutar()
+        tiempos.append(time.perf_counter() - inicio)
+    return tiempos
+
+
+def medir_memoria(preparar, n):
+    """Pico de memoria asignada durante la ejecución (sin contar los datos de entrada)"""
+    ejecutar = preparar(n)
+    gc.collect()
+    tracemalloc.start()
+    try:
+        base = tracemalloc.get_traced_memory()[0]
+        resultado = ejecutar()
+        pico = tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+    del resultado
+    return max(0, pico - base)
+
+
+def formato_bytes(n):
+    for unidad in ('B', 'KB', 'MB', 'GB'):
+        if abs(n) < 1024 or unidad == 'GB':
+            return f'{n:.1f} {unidad}' if unidad != 'B' else f'{n} B'
+        n /= 1024
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--tamanos', default='1000,100000,1000000', help='Filas por caso, separadas por comas')
+    parser.add_argument('--funciones', help='Filtrar casos por subcadena, separadas por comas (p. ej. prepare,score)')
+    parser.add_argument('--repeticiones', type=int, default=5, help='Repeticiones por caso (1 en tamaños ≥ 100k)')
+    parser.add_argument('--sin-memoria', action='store_true', help='No medir el pico de memoria (más rápido)')
+    parser.add_argument('--salida', help='Archivo JSON de resultados (por defecto benchmarks/resultados/)')
+    parser.add_argument('--comparar', help='JSON de una ejecución anterior para mostrar la aceleración')
+    args = parser.parse_args()
+
+    tamanos = [int(t) for t in args.tamanos.split(',')]
+    filtros = [f.strip() for f in args.funciones.split(',')] if args.funciones else None
+    casos = {nombre: preparar for nombre, preparar in CASOS.items()
+             if not filtros or any(f in nombre for f in filtros)}
+
+    anterior = {}
+    if args.comparar:
+        with open(args.comparar, encoding='utf-8') as f:
+            anterior = {(r['caso'], r['filas']): r for r in json.load(f)['resultados']}
+
+    print(f"{'caso':<40}{'filas':>10}{'mín s':>10}{'mediana s':>11}{'filas/s':>12}{'pico mem':>12}"
+          + (f"{'vs ant.':>9}" if anterior else ''))
+    resultados = []
+    for n in tamanos:
+        repeticiones = args.repeticiones if n < 100000 else 1
+        for nombre, preparar in casos.items():
+            tiempos = medir_tiempo(preparar, n, repeticiones)
+            memoria = None if args.sin_memoria else medir_memoria(preparar, n)
+            resultado = {
+                'caso': nombre,
+                'filas': n,
+                'repeticiones': repeticiones,
+                'min_s': round(min(tiempos), 6),
+                'mediana_s': round(statistics.median(tiempos), 6),
+                'filas_por_s': round(n / min(tiempos), 1),
+                'pico_memoria_bytes': memoria
+            }
+            resultados.append(resultado)
+            linea = (f"{nombre:<40}{n:>10}{resultado['min_s']:>10.4f}{resultado['mediana_s']:>11.4f}"
+                     f"{resultado['filas_por_s']:>12.0f}{formato_bytes(memoria) if memoria is not None else '-':>12}")
+            previo = anterior.get((nombre, n))
+            if previo:
+                linea += f"{previo['min_s'] / resultado['min_s']:>8.1f}x"
+            print(linea, flush=True)
+
+    informe = {
+        'version': version_codigo(),
+        'fecha': datetime.utcnow().isoformat(),
+        'entorno': {'python': platform.python_version(), 'plataforma': platform.platform(),
+                    'cpus': os.cpu_count(), 'pandas': pd.__version__},
+        'parametros': {k: v for k, v in vars(args).items() if k not in ('salida', 'comparar')},
+        'resultados': resultados
+    }
+    salida = args.salida or os.path.join(
+        DIRECTORIO_RESULTADOS, f"ml-{datetime.utcnow().strftime('%Y%m%d-%H%M%S')}-{informe['version']}.json")
+    os.makedirs(os.path.dirname(os.path.abspath(salida)), exist_ok=True)
+    with open(salida, 'w', encoding='utf-8') as f:
+        json.dump(informe, f, indent=2, ensure_ascii=False)
+    print(f'Resultados guardados en {salida}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,101 @@
+"""
+Benchmark: creación de solicitudes una a una vs carga masiva.
+
+Compara el throughput de N llamadas a POST /api/solicitudes/ contra una sola
+llamada a POST /api/solicitudes/masivo con los mismos N elementos, sobre una
+base SQLite en memoria.
+
+Uso:
+    python benchmarks/bench_solicitudes_masivas.py --n 200
+    python benchmarks/bench_solicitudes_masivas.py --n 200 --con-reentrenamiento
+
+Por defecto el camino individual se mide SIN el reentrenamiento del modelo
+que encola crear_solicitud, así que el resultado es una cota favorable al camino
+individual. Las versiones de modelo, el manifiesto y la copia priority_model.joblib
+(relativa al directorio actual) se escriben en un directorio temporal, nunca en el
+repositorio.
+"""
+import argparse
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from app import create_app, db  # noqa: E402
+from app.models import Usuario, Tramite  # noqa: E402
+from app.ml_utils import SolicitudMLProcessor  # noqa: E402
+from app import servicio_modelos  # noqa: E402
+
+
+def preparar_app():
+    """Crear la app de testing con un usuario administrativo y algunos trámites"""
+    app = create_app('testing')
+    with app.app_context():
+        db.create_all()
+        usuario = Usuario(dni='00000000', nombres='Bench', apellidos='Mark',
+                          email='bench@docucontrol.local', rol='administrativo')
+        usuario.set_password('bench')
+        db.session.add(usuario)
+        for i, categoria in enumerate(['licencias', 'permisos', 'servicios', 'certificados', 'otros']):
+            db.session.add(Tramite(codigo=f'BEN-{i:03d}', nombre=f'Trámite {i}', categoria=categoria,
+                                   tiempo_estimado_dias=7 * (i + 1), costo=100 * i))
+        db.session.commit()
+    return app
+
+
+def token(client):
+    respuesta = client.post('/api/auth/login', json={'email': 'bench@docucontrol.local', 'password': 'bench'})
+    return {'Authorization': f"Bearer {respuesta.get_json()['access_token']}"}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--n', type=int, default=200, help='Número de solicitudes a crear')
+    parser.add_argument('--con-reentrenamiento', action='store_true',
+                        help='Incluir el reentrenamiento del modelo en el camino individual')
+    args = parser.parse_args()
+
+    directorio_modelos = tempfile.TemporaryDirectory(prefix='bench_modelos_')
+    servicio_modelos.usar_directorio(directorio_modelos.name)
+    directorio_original = os.getcwd()
+    os.chdir(directorio_modelos.name)
+    if not args.con_reentrenamiento:
+        # En la clase: entrenar_prioridad crea su propio SolicitudMLProcessor
+        SolicitudMLProcessor.train_priority_model_from_db = lambda self: {'status': 'omitido'}
+
+    items = [{'tramite_id': (i % 5) + 1, 'observaciones': f'bench {i}'} for i in range(args.n)]
+
+    # Camino individual
+    app = preparar_app()
+    client = app.test_client()
+    headers = token(client)
+    fallidas = 0
+    inicio = time.perf_counter()
+    for item in items:
+        respuesta = client.post('/api/solicitudes/', json=item, headers=headers)
+        # El número de expediente individual (sufijo de 3 dígitos) puede colisionar en el mismo segundo
+        if respuesta.status_code != 201:
+            fallidas += 1
+    t_individual = time.perf_counter() - inicio
+
+    # Carga masiva (base nueva para no arrastrar filas)
+    app = preparar_app()
+    client = app.test_client()
+    headers = token(client)
+    inicio = time.perf_counter()
+    respuesta = client.post('/api/solicitudes/masivo', json={'solicitudes': items}, headers=headers)
+    assert respuesta.status_code == 201, respuesta.get_json()
+    t_masivo = time.perf_counter() - inicio
+
+    print(f'Solicitudes: {args.n}')
+    print(f'Individual: {t_individual:.3f}s  ({args.n / t_individual:.1f} solicitudes/s, {fallidas} fallidas)')
+    print(f'Masivo:     {t_masivo:.3f}s  ({args.n / t_masivo:.1f} solicitudes/s)')
+    print(f'Aceleración: x{t_individual / t_masivo:.1f}')
+    os.chdir(directorio_original)
+    directorio_modelos.cleanup()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,459 @@
+"""
+Prueba de carga reproducible de la API.
+
+Siembra una base (SQLite en un archivo temporal o una MySQL local) con el
+volumen indicado de usuarios, trámites, solicitudes y documentos, levanta la
+app en un servidor WSGI con hilos y la ejerce con clientes HTTP concurrentes
+(login, crear solicitud, listar, detalle, subir, descargar, ML).
+
+Por endpoint reporta p50/p95/p99, media, máximo, errores y peticiones por
+segundo, y guarda el resultado en JSON (benchmarks/resultados/) para comparar
+versiones con --comparar.
+
+Uso:
+    python benchmarks/carga_api.py
+    python benchmarks/carga_api.py --clientes 16 --peticiones 300 --solicitudes 20000
+    python benchmarks/carga_api.py --db-uri mysql+pymysql://root:@localhost/docucontrol_carga
+    python benchmarks/carga_api.py --url http://localhost:5000 --db-uri mysql+pymysql://...  # servidor externo
+    python benchmarks/carga_api.py --comparar benchmarks/resultados/anterior.json
+
+Con la misma --semilla y los mismos volúmenes, la base sembrada y la secuencia
+de operaciones de cada cliente son idénticas entre ejecuciones.
+"""
+import argparse
+import hashlib
+import http.client
+import json
+import logging
+import os
+import platform
+import random
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import urllib.parse
+import uuid
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from sqlalchemy import event  # noqa: E402
+from app import create_app, db  # noqa: E402
+from app.config import config, TestingConfig  # noqa: E402
+from app.models import Usuario, Tramite, Solicitud, Documento, HistorialEstado  # noqa: E402
+from app.almacenamiento import preparar_ruta  # noqa: E402
+
+DIRECTORIO_RESULTADOS = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'resultados')
+PASSWORD = 'carga-docucontrol'
+CATEGORIAS = ['licencias', 'permisos', 'servicios', 'certificados', 'otros']
+ESTADOS = ['pendiente', 'en_revision', 'observado', 'aprobado', 'rechazado', 'finalizado']
+PRIORIDADES = ['baja', 'media', 'alta', 'critica']
+
+# Peso relativo de cada operación en la mezcla de tráfico
+MEZCLA = {
+    'login': 5,
+    'crear_solicitud': 10,
+    'listar_solicitudes': 25,
+    'detalle_solicitud': 25,
+    'subir_documento': 5,
+    'descargar_documento': 15,
+    'ml_procesar': 2,
+    'ml_estadisticas': 3,
+}
+
+
+# ------------------------------------------------------------------------------------------------
+# App y siembra
+# ------------------------------------------------------------------------------------------------
+
+def crear_app_carga(db_uri, directorio, tareas_en_linea):
+    """App con la configuración de testing apuntando a la base y directorios de la prueba"""
+    opciones = {}
+    if db_uri.startswith('sqlite'):
+        opciones = {'connect_args': {'timeout': 30, 'check_same_thread': False}}
+    config['carga'] = type('CargaConfig', (TestingConfig,), {
+        'SQLALCHEMY_DATABASE_URI': db_uri,
+        'SQLALCHEMY_ENGINE_OPTIONS': opciones,
+        'UPLOAD_FOLDER': os.path.join(directorio, 'uploads'),
+        'TAREAS_DB_PATH': os.path.join(directorio, 'tareas.sqlite3'),
+        'TAREAS_EN_LINEA': tareas_en_linea,
+        'METRICAS_UMBRAL_LENTO_MS': 10 ** 9,
+    })
+    app = create_app('carga')
+    app.logger.setLevel(logging.WARNING)
+    if db_uri.startswith('sqlite'):
+        with app.app_context():
+            # WAL para que las lecturas no bloqueen a las escrituras concurrentes
+            event.listen(db.engine, 'connect', lambda conexion, _: conexion.execute('PRAGMA journal_mode=WAL'))
+    return app
+
+
+def sembrar(app, args):
+    """Insertar los volúmenes pedidos con executemany y crear los archivos de los documentos"""
+    rng = random.Random(args.semilla)
+    ahora = datetime.utcnow()
+    with app.app_context():
+        db.drop_all()
+        db.create_all()
+
+        # Un solo hash para todos: bcrypt por usuario dominaría el tiempo de siembra
+        modelo = Usuario()
+        modelo.set_password(PASSWORD)
+        usuarios = [{'dni': '90000000', 'nombres': 'Admin', 'apellidos': 'Carga',
+                     'email': 'admin@carga.local', 'password_hash': modelo.password_hash, 'rol': 'admin'}]
+        usuarios += [{
+            'dni': f'{10000000 + i}',
+            'nombres': f'Ciudadano {i}',
+            'apellidos': 'Carga',
+            'email': f'ciudadano{i}@carga.local',
+            'password_hash': modelo.password_hash,
+            'rol': 'ciudadano'
+        } for i in range(args.usuarios)]
+        db.session.execute(Usuario.__table__.insert(), usuarios)
+
+        db.session.execute(Tramite.__table__.insert(), [{
+            'codigo': f'CAR-{i:04d}',
+            'nombre': f'Trámite de carga {i}',
+            'categoria': CATEGORIAS[i % len(CATEGORIAS)],
+            'tiempo_estimado_dias': rng.randint(5, 60),
+            'costo': rng.randint(0, 500),
+            'prioridad_default': rng.choice(PRIORIDADES),
+            'requisitos': json.dumps(['DNI', 'Recibo']),
+            'documentos_requeridos': json.dumps(['DNI'])
+        } for i in range(args.tramites)])
+        db.session.commit()
+
+        ids_usuarios = [fila[0] for fila in db.session.query(Usuario.id).filter(Usuario.rol == 'ciudadano')
+                        .order_by(Usuario.id)]
+        admin_id = db.session.query(Usuario.id).filter(Usuario.rol == 'admin').scalar()
+        ids_tramites = [fila[0] for fila in db.session.query(Tramite.id).order_by(Tramite.id)]
+
+        solicitudes = []
+        for k in range(args.solicitudes):
+            fecha = ahora - timedelta(days=rng.randint(0, 365), seconds=rng.randint(0, 86400))
+            solicitudes.append({
+                'numero_expediente': f'CAR-{k:08d}',
+                'usuario_id': ids_usuarios[k % len(ids_usuarios)],
+                'tramite_id': rng.choice(ids_tramites),
+                'estado_actual': rng.choice(ESTADOS),
+                'prioridad': rng.choice(PRIORIDADES),
+                'fecha_solicitud': fecha,
+                'fecha_limite': fecha + timedelta(days=rng.randint(5, 60)),
+                'observaciones': f'Solicitud de carga {k}'
+            })
+        for inicio in range(0, len(solicitudes), 5000):
+            db.session.execute(Solicitud.__table__.insert(), solicitudes[inicio:inicio + 5000])
+        db.session.commit()
+
+        filas = db.session.query(Solicitud.id, Solicitud.usuario_id, Solicitud.fecha_solicitud) \
+            .order_by(Solicitud.id).all()
+        historial = [{'solicitud_id': f[0], 'estado_nuevo': 'pendiente', 'accion': 'creacion',
+                      'realizado_por': f[1], 'fecha_accion': f[2]} for f in filas]
+        for inicio in range(0, len(historial), 5000):
+            db.session.execute(HistorialEstado.__table__.insert(), historial[inicio:inicio + 5000])
+
+        documentos = []
+        for j in range(args.documentos):
+            solicitud_id, usuario_id, _ = filas[j % len(filas)]
+            contenido = rng.randbytes(args.tamano_documento) if hasattr(rng, 'randbytes') \
+                else bytes(rng.getrandbits(8) for _ in range(args.tamano_documento))
+            nombre = f'{solicitud_id}_{j:08d}.pdf'
+            # Misma disposición que las subidas reales: ruta relativa en la base, repartida en disco
+            ruta_relativa, ruta = preparar_ruta(nombre)
+            with open(ruta, 'wb') as f:
+                f.write(contenido)
+            documentos.append({
+                'solicitud_id': solicitud_id,
+                'nombre_archivo': nombre,
+                'nombre_original': f'documento_{j}.pdf',
+                'tipo_documento': 'general',
+                'ruta_archivo': ruta_relativa,
+                'tamano_bytes': len(contenido),
+                'tipo_mime': 'application/pdf',
+                'hash_archivo': hashlib.sha256(contenido).hexdigest(),
+                'subido_por': usuario_id
+            })
+        for inicio in range(0, len(documentos), 5000):
+            db.session.execute(Documento.__table__.insert(), documentos[inicio:inicio + 5000])
+        db.session.commit()
+
+        # Índices para los clientes: solicitudes y documentos de cada usuario
+        por_usuario = {usuario_id: {'solicitudes': [], 'documentos': []} for usuario_id in ids_usuarios}
+        for solicitud_id, usuario_id, _ in filas:
+            por_usuario[usuario_id]['solicitudes'].append(solicitud_id)
+        for documento_id, usuario_id in db.session.query(Documento.id, Solicitud.usuario_id) \
+                .join(Solicitud, Documento.solicitud_id == Solicitud.id).order_by(Documento.id):
+            por_usuario[usuario_id]['documentos'].append(documento_id)
+
+    return {'admin_id': admin_id, 'usuarios': ids_usuarios, 'tramites': ids_tramites, 'por_usuario': por_usuario}
+
+
+# ------------------------------------------------------------------------------------------------
+# Clientes
+# ------------------------------------------------------------------------------------------------
+
+class ClienteHTTP:
+    """Cliente HTTP mínimo (stdlib) que reutiliza la conexión cuando el servidor lo permite"""
+
+    def __init__(self, url_base):
+        partes = urllib.parse.urlsplit(url_base)
+        self.host = partes.hostname
+        self.puerto = partes.port or 80
+        self.conexion = http.client.HTTPConnection(self.host, self.puerto, timeout=120)
+
+    def peticion(self, metodo, ruta, cuerpo=None, cabeceras=None):
+        cabeceras = dict(cabeceras or {})
+        if isinstance(cuerpo, (dict, list)):
+            cuerpo = json.dumps(cuerpo).encode()
+            cabeceras['Content-Type'] = 'application/json'
+        try:
+            self.conexion.request(metodo, ruta, body=cuerpo, headers=cabeceras)
+            respuesta = self.conexion.getresponse()
+        except (http.client.HTTPException, ConnectionError):
+            # Conexión cerrada por el servidor: reabrir y reintentar una vez
+            self.conexion.close()
+            self.conexion = http.client.HTTPConnection(self.host, self.puerto, timeout=120)
+            self.conexion.request(metodo, ruta, body=cuerpo, headers=cabeceras)
+            respuesta = self.conexion.getresponse()
+        datos = respuesta.read()
+        return respuesta.status, datos
+
+    def cerrar(self):
+        self.conexion.close()
+
+
+def multipart(campos, nombre_archivo, contenido):
+    """Cuerpo multipart/form-data con un campo 'archivo'"""
+    limite = uuid.uuid4().hex
+    partes = []
+    for nombre, valor in campos.items():
+        partes.append(f'--{limite}\r\nContent-Disposition: form-data; name="{nombre}"\r\n\r\n{valor}\r\n'.encode())
+    partes.append(
+        f'--{limite}\r\nContent-Disposition: form-data; name="archivo"; filename="{nombre_archivo}"\r\n'
+        f'Content-Type: application/pdf\r\n\r\n'.encode() + contenido + b'\r\n'
+    )
+    partes.append(f'--{limite}--\r\n'.encode())
+    return b''.join(partes), f'multipart/form-data; boundary={limite}'
+
+
+def login(cliente, email):
+    estado, datos = cliente.peticion('POST', '/api/auth/login', {'email': email, 'password': PASSWORD})
+    if estado != 200:
+        raise RuntimeError(f'Login fallido para {email}: {estado} {datos[:200]!r}')
+    return {'Authorization': f"Bearer {json.loads(datos)['access_token']}"}
+
+
+def ejecutar_cliente(indice, url_base, datos, args, resultados, barrera):
+    """Hilo de un cliente: secuencia de operaciones determinada por la semilla"""
+    rng = random.Random(args.semilla * 1000 + indice)
+    cliente = ClienteHTTP(url_base)
+    usuario_id = datos['usuarios'][indice % len(datos['usuarios'])]
+    email = f"ciudadano{datos['usuarios'].index(usuario_id)}@carga.local"
+    propios = datos['por_usuario'][usuario_id]
+    cabeceras = login(cliente, email)
+    cabeceras_admin = login(cliente, 'admin@carga.local')
+    operaciones, pesos = zip(*MEZCLA.items())
+    contenido = rng.randbytes(args.tamano_documento) if hasattr(rng, 'randbytes') else os.urandom(args.tamano_documento)
+    medidas = []
+
+    barrera.wait()
+    for _ in range(args.peticiones):
+        operacion = rng.choices(operaciones, weights=pesos)[0]
+        if operacion == 'login':
+            metodo, ruta, cuerpo, extra = 'POST', '/api/auth/login', {'email': email, 'password': PASSWORD}, {}
+        elif operacion == 'crear_solicitud':
+            metodo, ruta, extra = 'POST', '/api/solicitudes/', cabeceras
+            cuerpo = {'tramite_id': rng.choice(datos['tramites']), 'observaciones': 'carga'}
+        elif operacion == 'listar_solicitudes':
+            metodo, ruta, cuerpo, extra = 'GET', '/api/solicitudes/mis-solicitudes', None, cabeceras
+        elif operacion == 'detalle_solicitud':
+            if not propios['solicitudes']:
+                continue
+            metodo, ruta, cuerpo, extra = 'GET', f"/api/solicitudes/{rng.choice(propios['solicitudes'])}", None, cabeceras
+        elif operacion == 'subir_documento':
+            if not propios['solicitudes']:
+                continue
+            cuerpo, tipo = multipart({'tipo_documento': 'general'}, 'carga_dni.pdf', contenido)
+            metodo, ruta = 'POST', f"/api/documentos/subir/{rng.choice(propios['solicitudes'])}"
+            extra = {**cabeceras, 'Content-Type': tipo}
+        elif operacion == 'descargar_documento':
+            if not propios['documentos']:
+                continue
+            metodo, ruta, cuerpo, extra = 'GET', f"/api/documentos/descargar/{rng.choice(propios['documentos'])}", None, cabeceras
+        elif operacion == 'ml_procesar':
+            metodo, ruta, cuerpo, extra = 'POST', '/api/ml/procesar-solicitudes', None, cabeceras_admin
+        else:
+            metodo, ruta, cuerpo, extra = 'GET', '/api/ml/estadisticas', None, cabeceras_admin
+
+        inicio = time.perf_counter()
+        try:
+            estado, _ = cliente.peticion(metodo, ruta, cuerpo, extra)
+        except Exception as e:
+            estado = f'excepcion:{type(e).__name__}'
+        medidas.append((operacion, time.perf_counter() - inicio, estado))
+
+    cliente.cerrar()
+    resultados[indice] = medidas
+
+
+# ------------------------------------------------------------------------------------------------
+# Estadísticas y reporte
+# ------------------------------------------------------------------------------------------------
+
+def percentil(ordenados, p):
+    """Percentil por rango más cercano sobre una lista ordenada"""
+    if not ordenados:
+        return 0.0
+    rango = max(1, int(round(p / 100 * len(ordenados) + 0.5)))
+    return ordenados[min(rango, len(ordenados)) - 1]
+
+
+def resumir(medidas, duracion):
+    def estadisticas(latencias, codigos):
+        ordenadas = sorted(latencias)
+        errores = sum(n for codigo, n in codigos.items() if not (isinstance(codigo, int) and codigo < 400))
+        return {
+            'peticiones': len(ordenadas),
+            'errores': errores,
+            'codigos': {str(codigo): n for codigo, n in sorted(codigos.items(), key=lambda x: str(x[0]))},
+            'rps': round(len(ordenadas) / duracion, 2) if duracion else 0.0,
+            'media_ms': round(sum(ordenadas) / len(ordenadas) * 1000, 2) if ordenadas else 0.0,
+            'p50_ms': round(percentil(ordenadas, 50) * 1000, 2),
+            'p95_ms': round(percentil(ordenadas, 95) * 1000, 2),
+            'p99_ms': round(percentil(ordenadas, 99) * 1000, 2),
+            'max_ms': round(ordenadas[-1] * 1000, 2) if ordenadas else 0.0
+        }
+
+    por_operacion = {}
+    for operacion, latencia, estado in medidas:
+        entrada = por_operacion.setdefault(operacion, ([], {}))
+        entrada[0].append(latencia)
+        entrada[1][estado] = entrada[1].get(estado, 0) + 1
+
+    total_codigos = {}
+    for _, codigos in por_operacion.values():
+        for codigo, n in codigos.items():
+            total_codigos[codigo] = total_codigos.get(codigo, 0) + n
+    return {
+        'total': estadisticas([m[1] for m in medidas], total_codigos),
+        'endpoints': {op: estadisticas(lat, cod) for op, (lat, cod) in sorted(por_operacion.items())}
+    }
+
+
+def version_codigo():
+    try:
+        return subprocess.check_output(['git', 'describe', '--always', '--dirty'], stderr=subprocess.DEVNULL,
+                                       cwd=os.path.dirname(os.path.abspath(__file__))).decode().strip()
+    except Exception:
+        return 'desconocida'
+
+
+def imprimir(resumen, anterior=None):
+    print(f"{'endpoint':<22}{'n':>7}{'err':>6}{'rps':>9}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}"
+          + (f"{'Δp95':>9}{'Δrps':>9}" if anterior else ''))
+    filas = list(resumen['endpoints'].items()) + [('TOTAL', resumen['total'])]
+    for nombre, e in filas:
+        linea = (f"{nombre:<22}{e['peticiones']:>7}{e['errores']:>6}{e['rps']:>9.1f}"
+                 f"{e['p50_ms']:>10.1f}{e['p95_ms']:>10.1f}{e['p99_ms']:>10.1f}")
+        if anterior:
+            previo = anterior['total'] if nombre == 'TOTAL' else anterior['endpoints'].get(nombre)
+            if previo and previo['p95_ms'] and previo['rps']:
+                linea += (f"{(e['p95_ms'] / previo['p95_ms'] - 1) * 100:>+8.0f}%"
+                          f"{(e['rps'] / previo['rps'] - 1) * 100:>+8.0f}%")
+        print(linea)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--db-uri', help='URI SQLAlchemy (por defecto SQLite en un archivo temporal)')
+    parser.add_argument('--url', help='Servidor externo ya en ejecución sobre la misma base (no se levanta uno local)')
+    parser.add_argument('--usuarios', type=int, default=200)
+    parser.add_argument('--tramites', type=int, default=20)
+    parser.add_argument('--solicitudes', type=int, default=5000)
+    parser.add_argument('--documentos', type=int, default=1000)
+    parser.add_argument('--tamano-documento', type=int, default=64 * 1024, help='Bytes por documento')
+    parser.add_argument('--clientes', type=int, default=8, help='Clientes concurrentes')
+    parser.add_argument('--peticiones', type=int, default=200, help='Peticiones por cliente')
+    parser.add_argument('--semilla', type=int, default=42)
+    parser.add_argument('--tareas-en-linea', action='store_true',
+                        help='Ejecutar las tareas ML en la petición (por defecto quedan encoladas)')
+    parser.add_argument('--salida', help='Archivo JSON de resultados (por defecto benchmarks/resultados/)')
+    parser.add_argument('--comparar', help='JSON de una ejecución anterior para mostrar diferencias')
+    parser.add_argument('--conservar', action='store_true', help='No borrar la base y archivos temporales')
+    args = parser.parse_args()
+
+    if args.url and not args.db_uri:
+        parser.error('--url requiere --db-uri (la base que usa ese servidor, para sembrarla)')
+
+    logging.getLogger('werkzeug').setLevel(logging.ERROR)
+    directorio = tempfile.mkdtemp(prefix='docucontrol_carga_')
+    db_uri = args.db_uri or f"sqlite:///{os.path.join(directorio, 'carga.sqlite3')}"
+    servidor = None
+    try:
+        app = crear_app_carga(db_uri, directorio, args.tareas_en_linea)
+        inicio = time.perf_counter()
+        datos = sembrar(app, args)
+        print(f'Base sembrada en {time.perf_counter() - inicio:.1f}s: {args.usuarios} usuarios, '
+              f'{args.tramites} trámites, {args.solicitudes} solicitudes, {args.documentos} documentos')
+
+        if args.url:
+            url_base = args.url
+        else:
+            from werkzeug.serving import make_server  # type: ignore
+            servidor = make_server('127.0.0.1', 0, app, threaded=True)
+            threading.Thread(target=servidor.serve_forever, daemon=True).start()
+            url_base = f'http://127.0.0.1:{servidor.server_port}'
+
+        resultados = [None] * args.clientes
+        barrera = threading.Barrier(args.clientes + 1)
+        hilos = [threading.Thread(target=ejecutar_cliente, args=(i, url_base, datos, args, resultados, barrera))
+                 for i in range(args.clientes)]
+        for hilo in hilos:
+            hilo.start()
+        barrera.wait()
+        inicio = time.perf_counter()
+        for hilo in hilos:
+            hilo.join()
+        duracion = time.perf_counter() - inicio
+        if any(r is None for r in resultados):
+            raise RuntimeError('Algún cliente terminó con error antes de medir')
+
+        resumen = resumir([m for medidas in resultados for m in medidas], duracion)
+        informe = {
+            'version': version_codigo(),
+            'fecha': datetime.utcnow().isoformat(),
+            'entorno': {'python': platform.python_version(), 'plataforma': platform.platform(),
+                        'cpus': os.cpu_count(), 'base': db_uri.split(':', 1)[0],
+                        'servidor': args.url or 'werkzeug (hilos, en proceso)'},
+            'parametros': {k: v for k, v in vars(args).items() if k not in ('salida', 'comparar', 'db_uri')},
+            'mezcla': MEZCLA,
+            'duracion_s': round(duracion, 3),
+            **resumen
+        }
+
+        anterior = None
+        if args.comparar:
+            with open(args.comparar, encoding='utf-8') as f:
+                anterior = json.load(f)
+        imprimir(resumen, anterior)
+
+        salida = args.salida or os.path.join(
+            DIRECTORIO_RESULTADOS, f"carga-{datetime.utcnow().strftime('%Y%m%d-%H%M%S')}-{informe['version']}.json")
+        os.makedirs(os.path.dirname(os.path.abspath(salida)), exist_ok=True)
+        with open(salida, 'w', encoding='utf-8') as f:
+            json.dump(informe, f, indent=2, ensure_ascii=False)
+        print(f'Resultados guardados en {salida}')
+    finally:
+        if servidor is not None:
+            servidor.shutdown()
+        if args.conservar:
+            print(f'Archivos temporales conservados en {directorio}')
+        else:
+            shutil.rmtree(directorio, ignore_errors=True)
+
+
+if __name__ == '__main__':
+    main()
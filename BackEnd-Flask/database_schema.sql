@@ -40,11 +40,11 @@ CREATE TABLE tramites (
     nombre VARCHAR(200) NOT NULL,
     descripcion TEXT,
     categoria ENUM('licencias', 'permisos', 'servicios', 'certificados', 'otros') NOT NULL,
-    requisitos TEXT, -- JSON como texto para compatibilidad
+    requisitos JSON,
     tiempo_estimado_dias INT DEFAULT 15,
     costo DECIMAL(10,2) DEFAULT 0.00,
     prioridad_default ENUM('baja', 'media', 'alta', 'critica') DEFAULT 'media',
-    documentos_requeridos TEXT, -- JSON como texto para compatibilidad
+    documentos_requeridos JSON,
     estado ENUM('activo', 'inactivo') DEFAULT 'activo',
     fecha_creacion TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
     
@@ -69,10 +69,12 @@ CREATE TABLE solicitudes (
     fecha_limite TIMESTAMP NULL,
     fecha_finalizacion TIMESTAMP NULL,
     observaciones TEXT,
-    datos_adicionales TEXT, -- JSON como texto para compatibilidad
+    datos_adicionales JSON,
     puntuacion_ml DECIMAL(5,2) NULL, -- Puntuación de prioridad calculada por ML
+    modelo_ml VARCHAR(40) NULL, -- Quién calculó prioridad_ml: 'reglas' o la versión del candidato A/B
     procesado_ml TINYINT(1) DEFAULT 0,
     asignado_a INT NULL, -- ID del usuario administrativo asignado
+    version INT NOT NULL DEFAULT 1, -- Control de concurrencia optimista en transiciones de estado
     
     KEY idx_numero_expediente (numero_expediente),
     KEY idx_estado_actual (estado_actual),
@@ -104,15 +106,29 @@ CREATE TABLE documentos (
     estado_validacion ENUM('pendiente', 'valido', 'invalido', 'observado') DEFAULT 'pendiente',
     observaciones_validacion TEXT,
     procesado_ml TINYINT(1) DEFAULT 0,
-    resultado_ml TEXT, -- JSON como texto para compatibilidad
+    resultado_ml JSON,
     fecha_subida TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
     subido_por INT NOT NULL,
+    -- Nivel de almacenamiento: archivo suelto o miembro de un paquete comprimido
+    almacenamiento ENUM('activo', 'archivado') NOT NULL DEFAULT 'activo',
+    paquete VARCHAR(255),
+    paquete_offset BIGINT,
+    paquete_longitud BIGINT,
+    paquete_compresion VARCHAR(10),
+    -- Estado del archivo mantenido por la aplicación (los listados no consultan el disco)
+    archivo_existe BOOLEAN NOT NULL DEFAULT TRUE,
+    -- Claves de resultado_ml generadas para filtrar en la base
+    ml_estado_sugerido VARCHAR(20) GENERATED ALWAYS AS (JSON_UNQUOTE(JSON_EXTRACT(resultado_ml, '$.estado_sugerido'))) VIRTUAL,
+    ml_tipo_detectado VARCHAR(50) GENERATED ALWAYS AS (JSON_UNQUOTE(JSON_EXTRACT(resultado_ml, '$.tipo_detectado'))) VIRTUAL,
     
     KEY idx_solicitud_id (solicitud_id),
     KEY idx_tipo_documento (tipo_documento),
     KEY idx_estado_validacion (estado_validacion),
     KEY idx_procesado_ml (procesado_ml),
     KEY idx_fecha_subida (fecha_subida),
+    KEY idx_documentos_ml_estado (ml_estado_sugerido),
+    KEY idx_documentos_ml_tipo (ml_tipo_detectado),
+    KEY idx_documentos_almacenamiento (almacenamiento),
     
     CONSTRAINT fk_documentos_solicitud FOREIGN KEY (solicitud_id) REFERENCES solicitudes(id) ON DELETE CASCADE,
     CONSTRAINT fk_documentos_usuario FOREIGN KEY (subido_por) REFERENCES usuarios(id) ON DELETE RESTRICT
@@ -131,7 +147,7 @@ CREATE TABLE historial_estado (
     comentarios TEXT,
     realizado_por INT NOT NULL,
     automatico TINYINT(1) DEFAULT 0, -- Indica si fue una acción automática del sistema/ML
-    datos_adicionales TEXT, -- JSON como texto para compatibilidad
+    datos_adicionales JSON,
     fecha_accion TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
     
     KEY idx_solicitud_id (solicitud_id),
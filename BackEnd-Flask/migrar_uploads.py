@@ -0,0 +1,115 @@
+"""
+Reubica los archivos de documentos en el esquema repartido (UPLOAD_FOLDER/ab/cd/<nombre>)
+y reescribe Documento.ruta_archivo como ruta relativa a UPLOAD_FOLDER.
+
+Trabaja por lotes: mueve los archivos de un lote y confirma sus filas en un solo
+UPDATE. Se puede interrumpir y volver a lanzar: las filas ya migradas se saltan, y
+un archivo que ya se movió pero cuya fila no llegó a confirmarse (corte entre el
+movimiento y el commit) se reconoce en el destino y solo se actualiza la fila.
+
+Uso:
+    python migrar_uploads.py --simular           # cuántos archivos se moverían
+    python migrar_uploads.py                     # migrar en lotes de 500
+    python migrar_uploads.py --lote 200 --raiz-anterior /datos/uploads
+"""
+from app import create_app, db
+from app.models import Documento
+from app.almacenamiento import ruta_repartida, ruta_fisica
+import argparse
+import errno
+import os
+import shutil
+import time
+
+
+def origen_de(ruta_archivo, raiz_anterior):
+    """Ruta en disco actual de una fila (con --raiz-anterior si se movió la raíz de las relativas)"""
+    if os.path.isabs(ruta_archivo):
+        return ruta_archivo
+    if raiz_anterior:
+        return os.path.join(raiz_anterior, *ruta_archivo.split('/'))
+    return ruta_fisica(ruta_archivo)
+
+
+def mover(origen, destino):
+    """Mover un archivo; entre sistemas de archivos distintos se copia, se sincroniza y luego se borra"""
+    os.makedirs(os.path.dirname(destino), exist_ok=True)
+    try:
+        os.replace(origen, destino)
+        return
+    except OSError as e:
+        if e.errno != errno.EXDEV:
+            raise
+    temporal = destino + '.migrando'
+    with open(origen, 'rb') as f_origen, open(temporal, 'wb') as f_destino:
+        shutil.copyfileobj(f_origen, f_destino, 1024 * 1024)
+        f_destino.flush()
+        os.fsync(f_destino.fileno())
+    shutil.copystat(origen, temporal)
+    os.replace(temporal, destino)
+    os.remove(origen)
+
+
+def migrar(lote=500, simular=False, raiz_anterior=None):
+    tabla = Documento.__table__
+    resumen = {'revisados': 0, 'movidos': 0, 'solo_fila': 0, 'faltantes': [], 'ya_migrados': 0}
+    ultimo_id = 0
+    inicio = time.perf_counter()
+    while True:
+        # Paginación por clave: cada lote empieza después del último id visto
+        filas = db.session.query(
+            Documento.id, Documento.nombre_archivo, Documento.ruta_archivo, Documento.almacenamiento
+        ).filter(Documento.id > ultimo_id).order_by(Documento.id).limit(lote).all()
+        if not filas:
+            break
+        ultimo_id = filas[-1].id
+
+        cambios = []
+        for fila in filas:
+            resumen['revisados'] += 1
+            nueva = ruta_repartida(fila.nombre_archivo)
+            if fila.ruta_archivo == nueva and not raiz_anterior:
+                resumen['ya_migrados'] += 1
+                continue
+            origen = origen_de(fila.ruta_archivo, raiz_anterior)
+            destino = ruta_fisica(nueva)
+            if fila.almacenamiento == 'archivado':
+                # Sus bytes están en un paquete: solo se normaliza la ruta
+                resumen['solo_fila'] += 1
+            elif os.path.exists(origen) and os.path.abspath(origen) != os.path.abspath(destino):
+                if not simular:
+                    mover(origen, destino)
+                resumen['movidos'] += 1
+            elif os.path.exists(destino):
+                # Movido en una ejecución interrumpida antes del commit
+                resumen['solo_fila'] += 1
+            else:
+                resumen['faltantes'].append({'id': fila.id, 'ruta': fila.ruta_archivo})
+                continue
+            cambios.append({'b_id': fila.id, 'b_ruta': nueva})
+
+        if cambios and not simular:
+            db.session.execute(
+                tabla.update().where(tabla.c.id == db.bindparam('b_id')).values(ruta_archivo=db.bindparam('b_ruta')),
+                cambios
+            )
+            db.session.commit()
+        print(f"hasta id {ultimo_id}: {resumen['revisados']} revisados, {resumen['movidos']} movidos, "
+              f"{len(resumen['faltantes'])} faltantes ({time.perf_counter() - inicio:.1f}s)", flush=True)
+    return resumen
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Migrar los archivos de documentos al esquema repartido')
+    parser.add_argument('--lote', type=int, default=500, help='Filas por lote (un UPDATE y un commit por lote)')
+    parser.add_argument('--simular', action='store_true', help='Solo contar, sin mover archivos ni escribir la base')
+    parser.add_argument('--raiz-anterior', help='Raíz contra la que se resolvían las rutas relativas, si cambió')
+    args = parser.parse_args()
+
+    app = create_app()
+    with app.app_context():
+        resumen = migrar(args.lote, args.simular, args.raiz_anterior)
+    print(f"Revisados: {resumen['revisados']}  movidos: {resumen['movidos']}  solo fila: {resumen['solo_fila']}  "
+          f"ya migrados: {resumen['ya_migrados']}  faltantes: {len(resumen['faltantes'])}")
+    for faltante in resumen['faltantes'][:20]:
+        print(f"  falta el archivo del documento {faltante['id']}: {faltante['ruta']}")
@@ -0,0 +1,8 @@
+-- ================================================================================================
+-- MIGRACIÓN 001: columna version en solicitudes
+-- Control de concurrencia optimista para PATCH /api/solicitudes/<id>/estado
+-- ================================================================================================
+USE docucontrol_ai;
+
+ALTER TABLE solicitudes
+    ADD COLUMN version INT NOT NULL DEFAULT 1 AFTER asignado_a;
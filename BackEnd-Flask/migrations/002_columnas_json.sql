@@ -0,0 +1,42 @@
+-- ================================================================================================
+-- MIGRACIÓN 002: columnas JSON nativas y claves ML generadas e indexadas
+-- requisitos, documentos_requeridos, datos_adicionales y resultado_ml pasan de TEXT a JSON.
+-- De resultado_ml se generan ml_estado_sugerido y ml_tipo_detectado (virtuales, indexadas)
+-- para filtrar documentos por el resultado ML en la base de datos.
+-- Requiere MySQL 5.7.8+ (o MariaDB 10.2.7+ con JSON como alias de LONGTEXT).
+-- ================================================================================================
+USE docucontrol_ai;
+
+-- 1. Textos que no son JSON válido (vacíos o corruptos) impedirían el cambio de tipo:
+--    se dejan en NULL, que es lo que la aplicación ya devolvía al no poder parsearlos.
+UPDATE tramites SET requisitos = NULL
+    WHERE requisitos IS NOT NULL AND JSON_VALID(requisitos) = 0;
+UPDATE tramites SET documentos_requeridos = NULL
+    WHERE documentos_requeridos IS NOT NULL AND JSON_VALID(documentos_requeridos) = 0;
+UPDATE solicitudes SET datos_adicionales = NULL
+    WHERE datos_adicionales IS NOT NULL AND JSON_VALID(datos_adicionales) = 0;
+UPDATE historial_estado SET datos_adicionales = NULL
+    WHERE datos_adicionales IS NOT NULL AND JSON_VALID(datos_adicionales) = 0;
+UPDATE documentos SET resultado_ml = NULL
+    WHERE resultado_ml IS NOT NULL AND JSON_VALID(resultado_ml) = 0;
+
+-- 2. Tipos JSON nativos
+ALTER TABLE tramites
+    MODIFY requisitos JSON,
+    MODIFY documentos_requeridos JSON;
+
+ALTER TABLE solicitudes
+    MODIFY datos_adicionales JSON;
+
+ALTER TABLE historial_estado
+    MODIFY datos_adicionales JSON;
+
+-- 3. Columnas generadas e índices sobre resultado_ml
+ALTER TABLE documentos
+    MODIFY resultado_ml JSON,
+    ADD COLUMN ml_estado_sugerido VARCHAR(20)
+        GENERATED ALWAYS AS (JSON_UNQUOTE(JSON_EXTRACT(resultado_ml, '$.estado_sugerido'))) VIRTUAL,
+    ADD COLUMN ml_tipo_detectado VARCHAR(50)
+        GENERATED ALWAYS AS (JSON_UNQUOTE(JSON_EXTRACT(resultado_ml, '$.tipo_detectado'))) VIRTUAL,
+    ADD KEY idx_documentos_ml_estado (ml_estado_sugerido),
+    ADD KEY idx_documentos_ml_tipo (ml_tipo_detectado);
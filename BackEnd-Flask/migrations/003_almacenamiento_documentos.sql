@@ -0,0 +1,15 @@
+-- ================================================================================================
+-- MIGRACIÓN 003: almacenamiento por niveles de los documentos
+-- Los documentos de solicitudes finalizadas hace tiempo se mueven a paquetes comprimidos
+-- (tarea documentos.archivar). Cada documento guarda en qué paquete está, su offset y su
+-- longitud dentro del paquete, para leerlo con un solo seek.
+-- ================================================================================================
+USE docucontrol_ai;
+
+ALTER TABLE documentos
+    ADD COLUMN almacenamiento ENUM('activo', 'archivado') NOT NULL DEFAULT 'activo' AFTER subido_por,
+    ADD COLUMN paquete VARCHAR(255) AFTER almacenamiento,
+    ADD COLUMN paquete_offset BIGINT AFTER paquete,
+    ADD COLUMN paquete_longitud BIGINT AFTER paquete_offset,
+    ADD COLUMN paquete_compresion VARCHAR(10) AFTER paquete_longitud,
+    ADD KEY idx_documentos_almacenamiento (almacenamiento);
@@ -0,0 +1,10 @@
+-- ================================================================================================
+-- MIGRACIÓN 004: existencia del archivo como estado del documento
+-- Los listados de documentos dejan de comprobar el disco: la aplicación mantiene la columna al
+-- subir y descargar, en la verificación de integridad y con la reconciliación periódica.
+-- Tras aplicarla conviene encolar documentos.reconciliar_archivos para fijar el estado real.
+-- ================================================================================================
+USE docucontrol_ai;
+
+ALTER TABLE documentos
+    ADD COLUMN archivo_existe BOOLEAN NOT NULL DEFAULT TRUE AFTER paquete_compresion;
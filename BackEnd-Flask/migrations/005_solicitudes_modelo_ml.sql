@@ -0,0 +1,8 @@
+-- ================================================================================================
+-- MIGRACIÓN 005: modelo que sirvió la prioridad ML de cada solicitud
+-- 'reglas' o la versión del candidato en A/B (que no calcula puntuación: puntuacion_ml queda NULL)
+-- ================================================================================================
+USE docucontrol_ai;
+
+ALTER TABLE solicitudes
+    ADD COLUMN modelo_ml VARCHAR(40) NULL AFTER puntuacion_ml;
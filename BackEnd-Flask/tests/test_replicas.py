@@ -0,0 +1,107 @@
+"""
+Enrutado de lecturas a réplicas (app/replicas.py) con dos ficheros SQLite: uno hace
+de principal y otro de réplica. No hay replicación entre ellos, así que cada fila
+sembrada lleva el nombre de su base y se ve de dónde se leyó.
+
+Ejecutar desde BackEnd-Flask: python -m pytest tests
+"""
+import time
+
+import pytest # type: ignore
+from sqlalchemy import select # type: ignore
+from sqlalchemy.orm import Session # type: ignore
+
+from app import create_app, db
+from app.config import TestingConfig, config
+from app.models import Usuario, Tramite, Solicitud
+from app.replicas import leer_de_replica
+
+ADHERENCIA_SEGUNDOS = 0.5
+
+
+def _sembrar(sesion, origen):
+    """Misma fila (mismos ids) en ambas bases, con el nombre de la base en los textos"""
+    admin = Usuario(id=1, dni='10000001', nombres=origen, apellidos='Admin', email='admin@x.pe', rol='admin')
+    admin.set_password('clave')
+    sesion.add(admin)
+    sesion.add(Tramite(id=1, codigo='T-1', nombre=origen, categoria='licencias'))
+    sesion.add(Solicitud(id=1, numero_expediente='EXP-1', usuario_id=1, tramite_id=1, observaciones=origen))
+    sesion.commit()
+
+
+@pytest.fixture
+def app(tmp_path, monkeypatch):
+    class ConfigReplicas(TestingConfig):
+        SQLALCHEMY_DATABASE_URI = f"sqlite:///{tmp_path / 'principal.sqlite3'}"
+        REPLICAS_URIS = [f"sqlite:///{tmp_path / 'replica.sqlite3'}"]
+        REPLICAS_ADHERENCIA_SEGUNDOS = ADHERENCIA_SEGUNDOS
+        UPLOAD_FOLDER = str(tmp_path / 'uploads')
+
+    monkeypatch.setitem(config, 'replicas_test', ConfigReplicas)
+    app = create_app('replicas_test')
+    with app.app_context():
+        db.create_all()
+        db.metadata.create_all(db.engines['replica0'])
+        for motor, origen in ((db.engine, 'principal'), (db.engines['replica0'], 'replica')):
+            with Session(motor) as sesion:
+                _sembrar(sesion, origen)
+    yield app
+    with app.app_context():
+        for motor in db.engines.values():
+            motor.dispose()
+
+
+def _nombres_tramites():
+    return db.session.scalars(select(Tramite.nombre).order_by(Tramite.id)).all()
+
+
+def _cabeceras(client):
+    respuesta = client.post('/api/auth/login', json={'email': 'admin@x.pe', 'password': 'clave'})
+    assert respuesta.status_code == 200
+    return {'Authorization': 'Bearer ' + respuesta.get_json()['access_token']}
+
+
+def test_select_dentro_de_leer_de_replica_va_a_la_replica(app):
+    with app.app_context():
+        assert _nombres_tramites() == ['principal']
+        with leer_de_replica():
+            assert _nombres_tramites() == ['replica']
+        assert _nombres_tramites() == ['principal']
+
+
+def test_escrituras_y_lecturas_posteriores_van_a_la_principal(app):
+    with app.app_context():
+        with leer_de_replica():
+            db.session.add(Tramite(id=2, codigo='T-2', nombre='nuevo', categoria='permisos'))
+            db.session.flush()
+            # Tras escribir, la sesión deja de leer de la réplica (que aún no tiene la fila)
+            assert _nombres_tramites() == ['principal', 'nuevo']
+            db.session.commit()
+            assert _nombres_tramites() == ['principal', 'nuevo']
+
+    with app.app_context():
+        with Session(db.engines['replica0']) as sesion:
+            assert sesion.scalars(select(Tramite.nombre).order_by(Tramite.id)).all() == ['replica']
+        # Sesión nueva: vuelve a leer de la réplica
+        with leer_de_replica():
+            assert _nombres_tramites() == ['replica']
+
+
+def test_solo_lectura_adhiere_a_la_principal_tras_escribir_y_vence(app):
+    client = app.test_client()
+    cabeceras = _cabeceras(client)
+
+    assert client.get('/api/auth/profile', headers=cabeceras).get_json()['nombres'] == 'replica'
+
+    respuesta = client.patch('/api/solicitudes/1/estado', json={'estado': 'en_revision'}, headers=cabeceras)
+    assert respuesta.status_code == 200
+
+    # Leer lo propio escrito: las vistas @solo_lectura del usuario leen de la principal
+    assert client.get('/api/auth/profile', headers=cabeceras).get_json()['nombres'] == 'principal'
+    detalle = client.get('/api/solicitudes/1?fields=estado_actual,observaciones', headers=cabeceras).get_json()
+    assert detalle == {'estado_actual': 'en_revision', 'observaciones': 'principal'}
+
+    time.sleep(ADHERENCIA_SEGUNDOS + 0.1)
+    assert client.get('/api/auth/profile', headers=cabeceras).get_json()['nombres'] == 'replica'
+    detalle = client.get('/api/solicitudes/1?fields=estado_actual,observaciones', headers=cabeceras).get_json()
+    assert detalle == {'estado_actual': 'pendiente', 'observaciones': 'replica'}
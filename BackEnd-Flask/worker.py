@@ -0,0 +1,80 @@
+"""
+Workers de la cola de tareas (entrenamiento ML, puntuación y documentos).
+
+Con ARCHIVOS_RECONCILIAR_SEGUNDOS > 0, el proceso principal encola además cada ese
+intervalo la reconciliación de Documento.archivo_existe con el disco.
+
+Los eventos que publican las tareas solo llegan al stream SSE de la web con un
+backend compartido (EVENTOS_BACKEND=redis); con 'memoria' se quedan en el proceso
+del worker, así que no arranca salvo con --permitir-eventos-en-memoria.
+
+Uso:
+    python worker.py                # un proceso por núcleo
+    python worker.py --procesos 2
+"""
+from app import create_app
+from app.config import config
+from app.tareas import ejecutar_worker, encolar
+import argparse
+import multiprocessing
+import os
+import signal
+import socket
+import threading
+
+
+def proceso_worker(indice, detener):
+    """Punto de entrada de cada proceso: su propia app y su propio pool de conexiones"""
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    app = create_app()
+    nombre = f'{socket.gethostname()}-{os.getpid()}-{indice}'
+    app.logger.info(f'Worker {nombre} iniciado')
+    ejecutar_worker(app, nombre, detener)
+
+
+def programar_reconciliacion(detener):
+    """Encolar documentos.reconciliar_archivos periódicamente (una sola vez aunque haya varios hosts)"""
+    app = create_app()
+    intervalo = app.config['ARCHIVOS_RECONCILIAR_SEGUNDOS']
+    if not intervalo:
+        return
+    while not detener.wait(intervalo):
+        with app.app_context():
+            try:
+                encolar('documentos.reconciliar_archivos', clave_unica='documentos.reconciliar_archivos',
+                        compartir_en_curso=True)
+            except Exception as e:
+                app.logger.warning(f'No se pudo encolar la reconciliación de archivos: {e}')
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Workers de la cola de tareas de DocuControl AI')
+    parser.add_argument('--procesos', type=int, default=os.cpu_count() or 1)
+    parser.add_argument('--permitir-eventos-en-memoria', action='store_true',
+                        help='Arrancar aunque los eventos de las tareas no lleguen al stream SSE')
+    args = parser.parse_args()
+
+    # Misma configuración que elige create_app()
+    eventos_backend = config[os.environ.get('FLASK_ENV', 'development')].EVENTOS_BACKEND
+    if eventos_backend == 'memoria' and not args.permitir_eventos_en_memoria:
+        parser.error("EVENTOS_BACKEND='memoria' es local a cada proceso: los eventos de las tareas "
+                     "no llegarían al stream SSE. Usa EVENTOS_BACKEND=redis o --permitir-eventos-en-memoria")
+
+    detener = multiprocessing.Event()
+    procesos = [
+        multiprocessing.Process(target=proceso_worker, args=(i, detener), name=f'worker-{i}')
+        for i in range(args.procesos)
+    ]
+    for proceso in procesos:
+        proceso.start()
+    threading.Thread(target=programar_reconciliacion, args=(detener,), name='reconciliacion', daemon=True).start()
+
+    def terminar(signum, frame):
+        # Los workers terminan la tarea en curso y salen
+        detener.set()
+
+    signal.signal(signal.SIGINT, terminar)
+    signal.signal(signal.SIGTERM, terminar)
+    print(f'{args.procesos} workers en ejecución (Ctrl+C para detener)')
+    for proceso in procesos:
+        proceso.join()
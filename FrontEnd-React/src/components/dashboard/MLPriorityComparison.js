@@ -14,26 +14,25 @@ const PRIORITY_COLORS = {
   baja: '#22c55e',
 };
 
-function getPriorityCounts(data, key) {
-  const counts = { critica: 0, alta: 0, media: 0, baja: 0 };
-  data.forEach(item => {
-    const val = item[key];
-    if (counts[val] !== undefined) counts[val]++;
-  });
-  return counts;
-}
+const DRIFT_COLORS = {
+  estable: 'text-green-600',
+  moderada: 'text-yellow-600',
+  alta: 'text-red-600',
+};
+
+const formatPercent = value => (value === null || value === undefined ? '—' : `${(value * 100).toFixed(1)}%`);
 
 const MLPriorityComparison = () => {
   const { getComparacionPrioridad } = useML();
   const [loading, setLoading] = useState(true);
-  const [comparisonData, setComparisonData] = useState([]);
+  const [evaluation, setEvaluation] = useState(null);
   const [error, setError] = useState(null);
 
   useEffect(() => {
     setLoading(true);
     getComparacionPrioridad().then(result => {
       if (result.success) {
-        setComparisonData(result.data);
+        setEvaluation(result.data);
         setError(null);
       } else {
         setError(result.error);
@@ -44,11 +43,11 @@ const MLPriorityComparison = () => {
 
   if (loading) return <LoadingSpinner label="Cargando comparación ML..." />;
   if (error) return <div className="text-red-600">{error}</div>;
-  if (!comparisonData.length) return <div>No hay datos para mostrar.</div>;
+  if (!evaluation || !evaluation.ventana.evaluadas) return <div>No hay datos para mostrar.</div>;
 
-  // Agrupar por prioridad real y predicha
-  const realCounts = getPriorityCounts(comparisonData, 'prioridad');
-  const predCounts = getPriorityCounts(comparisonData, 'prioridad_predicha');
+  // Conteos ya agregados por el backend (totales de la matriz de confusión)
+  const realCounts = evaluation.reales;
+  const predCounts = evaluation.predichas;
 
   // Datos para gráfico de barras
   const barData = {
@@ -93,6 +92,48 @@ const MLPriorityComparison = () => {
           plugins: { legend: { position: 'bottom' } },
         }} />
       </div>
+      <div className="bg-white rounded-lg shadow p-6">
+        <h3 className="text-lg font-semibold mb-4">Precisión y Recall por Prioridad</h3>
+        <p className="text-sm text-gray-500 mb-2">
+          Modelo {evaluation.version_modelo} · {evaluation.ventana.evaluadas} solicitudes evaluadas
+          {evaluation.ventana.independiente ? '' : ' (incluye datos de entrenamiento)'} · exactitud {formatPercent(evaluation.exactitud)}
+        </p>
+        <table className="w-full text-sm">
+          <thead>
+            <tr className="text-left text-gray-500">
+              <th>Prioridad</th><th>Precisión</th><th>Recall</th><th>Soporte</th>
+            </tr>
+          </thead>
+          <tbody>
+            {PRIORITY_LABELS.map(l => (
+              <tr key={l}>
+                <td className="uppercase">{l}</td>
+                <td>{formatPercent(evaluation.por_clase[l]?.precision)}</td>
+                <td>{formatPercent(evaluation.por_clase[l]?.recall)}</td>
+                <td>{evaluation.por_clase[l]?.soporte ?? 0}</td>
+              </tr>
+            ))}
+          </tbody>
+        </table>
+      </div>
+      <div className="bg-white rounded-lg shadow p-6">
+        <h3 className="text-lg font-semibold mb-4">Deriva de Características (PSI)</h3>
+        {Object.keys(evaluation.deriva).length === 0 ? (
+          <div className="text-sm text-gray-500">El modelo no tiene distribución de referencia; reentrénalo para medir la deriva.</div>
+        ) : (
+          <table className="w-full text-sm">
+            <tbody>
+              {Object.entries(evaluation.deriva).map(([feature, drift]) => (
+                <tr key={feature}>
+                  <td>{feature}</td>
+                  <td>{drift.psi ?? '—'}</td>
+                  <td className={DRIFT_COLORS[drift.estado] || ''}>{drift.estado || '—'}</td>
+                </tr>
+              ))}
+            </tbody>
+          </table>
+        )}
+      </div>
     </div>
   );
 };